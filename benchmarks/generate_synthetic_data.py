@@ -0,0 +1,144 @@
+''' Generates a synthetic dataset in the formats used by the pipeline: painting
+images, a COCO ground truth annotation file, participant heatmap csv files,
+an ANOVA csv file and an Open Images style labels.json with images for
+prepare_dataset.py
+'''
+
+import json
+import os
+import sys
+import numpy as np
+from PIL import Image
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'visualization'))
+from config import CLASSES
+
+# Categories of the Open Images export that prepare_dataset.py does not keep
+OTHER_CATEGORIES = ['Car', 'Chair', 'Table', 'Bottle', 'Flower', 'Window']
+
+""" This function returns painting names in the format of the study (A1_Painting, ...) """
+def painting_names(n_paintings):
+    names = []
+    for index in range(n_paintings):
+        group = ''
+        number = index // 5
+        while True:
+            group = chr(ord('A') + number % 26) + group
+            number = number // 26 - 1
+            if number < 0:
+                break
+        names.append(f'{group}{index % 5 + 1}_Painting')
+    return names
+
+""" This function writes one small jpg per painting and returns the painting sizes """
+def generate_paintings(image_directory, names, rng, min_size=300, max_size=900):
+    os.makedirs(image_directory, exist_ok=True)
+    sizes = {}
+    for name in names:
+        width, height = (int(value) for value in rng.integers(min_size, max_size, size=2))
+        # A smooth gradient compresses well and keeps the files small
+        gradient = np.linspace(0, 255, width, dtype=np.uint8)
+        pixels = np.broadcast_to(gradient[np.newaxis, :, np.newaxis], (height, width, 3))
+        Image.fromarray(np.ascontiguousarray(pixels)).save(os.path.join(image_directory, f'{name}.jpg'), quality=70)
+        sizes[name] = (height, width)
+    return sizes
+
+""" This function writes a COCO annotation file with ground truth boxes for every painting """
+def generate_annotations(annotation_file, names, sizes, rng, boxes_per_painting=8):
+    images = []
+    annotations = []
+    for image_id, name in enumerate(names, start=1):
+        height, width = sizes[name]
+        images.append({'id': image_id, 'file_name': f'{name}.jpg', 'width': width, 'height': height})
+        for _ in range(int(rng.integers(1, 2 * boxes_per_painting))):
+            x_min = float(rng.uniform(0, width * 0.8))
+            y_min = float(rng.uniform(0, height * 0.8))
+            box = [x_min, y_min, float(rng.uniform(10, width - x_min)), float(rng.uniform(10, height - y_min))]
+            annotations.append({'id': len(annotations) + 1, 'image_id': image_id,
+                                'category_id': int(rng.integers(1, len(CLASSES))), 'bbox': box})
+    categories = [{'id': index, 'name': name} for index, name in enumerate(CLASSES)]
+    with open(annotation_file, 'w') as file:
+        json.dump({'images': images, 'annotations': annotations, 'categories': categories}, file)
+
+""" This function writes one heatmap csv file per participant. Every painting block
+is a row with the painting name followed by empty cells and grid_size rows of
+gaze durations, of which about density are nonzero """
+def generate_heatmaps(heatmap_directory, n_participants, names, rng, density=0.05, grid_size=100):
+    os.makedirs(heatmap_directory, exist_ok=True)
+    name_row_suffix = ',' * (grid_size - 1) + '\n'
+    for participant in range(1, n_participants + 1):
+        order = rng.permutation(len(names))
+        with open(os.path.join(heatmap_directory, f'{participant}_heatmap.csv'), 'w') as file:
+            for index in order:
+                file.write(names[index] + name_row_suffix)
+                mask = rng.random((grid_size, grid_size)) < density
+                cells = np.full((grid_size, grid_size), '0', dtype=object)
+                cells[mask] = [repr(float(value)) for value in np.round(rng.uniform(0.005, 0.05, mask.sum()), 7)]
+                file.write('\n'.join(','.join(row) for row in cells) + '\n')
+
+""" This function writes the csv file for the one-way ANOVA test """
+def generate_anova(anova_file, rng, n_rows=300, groups=('Person', 'Building', 'Human head')):
+    with open(anova_file, 'w') as file:
+        file.write('time,category\n')
+        for row in range(n_rows):
+            group = row % len(groups)
+            file.write(f'{rng.gamma(2.0, 10.0 + 2.0 * group):.5f},{groups[group].replace(" ", "_")}\n')
+
+""" This function writes an Open Images style labels.json and its images for prepare_dataset.py """
+def generate_open_images(directory, n_images, rng, annotations_per_image=4):
+    image_directory = os.path.join(directory, 'data')
+    os.makedirs(image_directory, exist_ok=True)
+    names = CLASSES[1:] + OTHER_CATEGORIES
+    # Category ids of the export do not follow config.CLASSES
+    categories = [{'id': index, 'name': name} for index, name in enumerate(rng.permutation(names).tolist())]
+    images = []
+    annotations = []
+    for image_id in range(n_images):
+        file_name = f'{image_id:08d}.jpg'
+        with open(os.path.join(image_directory, file_name), 'wb') as file:
+            file.write(rng.bytes(int(rng.integers(2000, 20000))))
+        images.append({'id': image_id, 'file_name': file_name, 'width': 640, 'height': 480})
+        for _ in range(int(rng.integers(1, 2 * annotations_per_image))):
+            box = [float(value) for value in rng.uniform(0, 300, size=4)]
+            annotations.append({'id': len(annotations), 'image_id': image_id,
+                                'category_id': int(rng.integers(0, len(categories))), 'bbox': box,
+                                'area': box[2] * box[3], 'iscrowd': 0})
+    with open(os.path.join(directory, 'labels.json'), 'w') as file:
+        json.dump({'info': {'description': 'synthetic'}, 'licenses': [], 'categories': categories,
+                   'images': images, 'annotations': annotations}, file)
+
+def main(output_directory = 'synthetic-data', participants = 31, paintings = 19, density = 0.05,
+         open_images = 2000, seed = 0):
+    rng = np.random.default_rng(seed)
+    names = painting_names(paintings)
+    sizes = generate_paintings(os.path.join(output_directory, 'test-images'), names, rng)
+    generate_annotations(os.path.join(output_directory, 'annotations.json'), names, sizes, rng)
+    generate_heatmaps(os.path.join(output_directory, 'heatmaps'), participants, names, rng, density)
+    generate_anova(os.path.join(output_directory, 'anova.csv'), rng)
+    generate_open_images(os.path.join(output_directory, 'open-images'), open_images, rng)
+    print(f"Synthetic data with {participants} participants and {paintings} paintings written to {output_directory}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--output_directory', type=str,
+                           default='synthetic-data',
+                           help='directory to write the synthetic data to')
+    parser.add_argument('--participants', type=int,
+                           default=31,
+                           help='number of participant heatmap files')
+    parser.add_argument('--paintings', type=int,
+                           default=19,
+                           help='number of paintings')
+    parser.add_argument('--density', type=float,
+                           default=0.05,
+                           help='fraction of nonzero heatmap cells')
+    parser.add_argument('--open_images', type=int,
+                           default=2000,
+                           help='number of images in the Open Images style export for prepare_dataset.py')
+    parser.add_argument('--seed', type=int,
+                           default=0,
+                           help='seed of the random generator')
+    args = parser.parse_args()
+    main(**dict(args._get_kwargs()))
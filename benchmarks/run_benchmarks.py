@@ -0,0 +1,332 @@
+''' Times the stages of create_heatmap.py, map_coordinates.py and prepare_dataset.py
+on a dataset written by generate_synthetic_data.py and checks that the numeric
+results match a golden run
+'''
+
+import contextlib
+import csv
+import io
+import json
+import os
+import re
+import ast
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(os.path.join(SRC, 'visualization'))
+sys.path.append(os.path.join(SRC, 'features'))
+sys.path.append(SRC)
+
+import matplotlib
+matplotlib.use('Agg')
+
+import cli
+import create_heatmap
+import prepare_dataset
+from coco_stream import filter_coco_streaming
+from subset_selection import select_image_subset
+from annotation_store import AnnotationStore
+from map_coordinates import calculate_gaze_duration_in_objects, calculate_gaze_duration_in_objects_vectorized
+from aoi_raster import AOIRasterCache, attribute_gaze_with_raster, attribute_gaze_by_area
+from catalog import PaintingCatalog
+from heatmap_reader import read_heatmaps
+from painting_store import PaintingStore
+from stat_analysis import calculate_significance, perform_one_way_anova
+from utils import file_hash
+
+# Metrics compared with the golden run
+METRICS = ['total_time', 'mean_duration', 'total_duration_in_objects', 'total_duration_outside_objects',
+           'average_duration_in_objects', 'average_duration_outside_objects',
+           'max_duration_in_objects', 'max_duration_outside_objects']
+
+""" This function measures the wall time of a stage and stores it in timings """
+@contextlib.contextmanager
+def timed(timings, stage):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    timings[stage] = time.perf_counter() - start
+    print(f"{stage:<45} {timings[stage]:10.3f} s")
+
+""" This function returns the painting images, annotation file, heatmap files and
+ANOVA file of a synthetic dataset """
+def dataset_paths(data_directory):
+    image_directory = os.path.join(data_directory, 'test-images')
+    test_images = sorted(os.path.join(image_directory, path) for path in os.listdir(image_directory) if path.endswith('.jpg'))
+    heatmap_directory = os.path.join(data_directory, 'heatmaps')
+    files = [os.path.join(heatmap_directory, path) for path in os.listdir(heatmap_directory)]
+    return test_images, os.path.join(data_directory, 'annotations.json'), files, os.path.join(data_directory, 'anova.csv')
+
+""" This function times the stages of create_heatmap.main separately, then the whole
+run, which writes its result tables to results_directory """
+def benchmark_create_heatmap(data_directory, results_directory, timings, workers=1):
+    test_images, annotation_file, files, anova_file = dataset_paths(data_directory)
+    painting_names = [os.path.splitext(os.path.basename(test_image))[0] for test_image in test_images]
+
+    with timed(timings, 'create_heatmap: parse heatmap csv files'):
+        heatmaps = [read_heatmaps(file_csv, dtype=np.float64) for file_csv in files]
+    with timed(timings, 'create_heatmap: read painting sizes'):
+        painting_sizes = PaintingStore(test_images, metadata_file=os.path.join(results_directory, 'sizes.json')).sizes
+    with timed(timings, 'create_heatmap: build annotation catalog'):
+        with open(annotation_file, 'r') as file:
+            catalog = PaintingCatalog(json.load(file), painting_names)
+    store_directory = os.path.join(results_directory, 'annotation-store')
+    with timed(timings, 'create_heatmap: build annotation store'):
+        AnnotationStore.open(annotation_file, store_directory)
+    with timed(timings, 'create_heatmap: catalog from annotation store'):
+        PaintingCatalog.from_annotation_store(AnnotationStore.open(annotation_file, store_directory), painting_names)
+
+    # Gaze points of every participant and painting
+    gaze = []
+    for block_names, array_3d in heatmaps:
+        blocks = catalog.heatmap_blocks(block_names)
+        for name in painting_names:
+            if name in blocks:
+                height, width = painting_sizes[name]
+                rows, cols = np.nonzero(array_3d[blocks[name]])
+                gaze.append((name, width, height, rows, cols, array_3d[blocks[name]][rows, cols]))
+
+    with timed(timings, 'create_heatmap: attribution (boxes)'):
+        for name, width, height, rows, cols, durations in gaze:
+            gaze_data = np.column_stack((width / 100 * (cols + 1), height / 100 * (rows + 1), durations))
+            calculate_gaze_duration_in_objects_vectorized(gaze_data, min(width, height) / 200, catalog.boxes(name))
+    with timed(timings, 'create_heatmap: attribution (raster)'):
+        raster_cache = AOIRasterCache(file_hash(annotation_file))
+        for name, width, height, rows, cols, durations in gaze:
+            raster = raster_cache.get(name, catalog.boxes(name), width, height)
+            attribute_gaze_with_raster(rows, cols, durations, raster)
+    with timed(timings, 'create_heatmap: attribution (area)'):
+        for name, width, height, rows, cols, durations in gaze:
+            summed_area_tables = raster_cache.get_summed_area_tables(name, catalog.boxes(name), width, height)
+            attribute_gaze_by_area(rows, cols, durations, summed_area_tables, min(width, height) / 200, width, height, raster_cache.subdivisions)
+
+    rng = np.random.default_rng(0)
+    with timed(timings, 'create_heatmap: significance test'):
+        calculate_significance(rng.normal(0.02, 0.005, len(files)), rng.normal(0.019, 0.005, len(files)))
+    with timed(timings, 'create_heatmap: significance test (100000 resamples)'):
+        calculate_significance(rng.normal(0.02, 0.005, 31), rng.normal(0.019, 0.005, 31),
+                               method='resampling', n_resamples=100000, workers=workers)
+    with timed(timings, 'create_heatmap: one-way anova'):
+        perform_one_way_anova(anova_file)
+    with timed(timings, 'create_heatmap: one-way anova (streaming)'):
+        perform_one_way_anova(anova_file, method='streaming')
+
+    with timed(timings, f'create_heatmap: main (workers={workers})'):
+        create_heatmap.main(test_images=os.path.dirname(test_images[0]), annotation_file=annotation_file,
+                            heatmaps=os.path.dirname(files[0]), anova_file=anova_file, workers=workers,
+                            no_plots=True, quiet=True, results_dir=results_directory)
+    return gaze, catalog
+
+""" This function compares the loop and the vectorized version of
+calculate_gaze_duration_in_objects and returns the number of differences """
+def benchmark_map_coordinates(gaze, catalog, timings, sample=200):
+    gaze = gaze[:sample]
+    gaze_data = [np.column_stack((width / 100 * (cols + 1), height / 100 * (rows + 1), durations))
+                 for name, width, height, rows, cols, durations in gaze]
+    # Radius of a gaze point as create_heatmap computes it: half of a heatmap cell
+    radii = [min(width, height) / 200 for name, width, height, rows, cols, durations in gaze]
+    with timed(timings, f'map_coordinates: loop ({len(gaze)} paintings)'):
+        loop_results = [calculate_gaze_duration_in_objects(data.tolist(), radius, catalog.boxes(item[0]))
+                        for data, radius, item in zip(gaze_data, radii, gaze)]
+    with timed(timings, f'map_coordinates: vectorized ({len(gaze)} paintings)'):
+        vectorized_results = [calculate_gaze_duration_in_objects_vectorized(data, radius, catalog.boxes(item[0]))
+                              for data, radius, item in zip(gaze_data, radii, gaze)]
+    differences = sum(1 for loop_result, vectorized_result in zip(loop_results, vectorized_results)
+                      if loop_result != vectorized_result or list(loop_result[-1]) != list(vectorized_result[-1]))
+    print(f"map_coordinates: {differences} differences between loop and vectorized results")
+    return differences
+
+""" This function scales the limits of prepare_dataset.desired_limits by one factor,
+so that no limit is above share of the annotations of its category in input_json.
+The limits of the study are far above the annotations of a synthetic export and
+would keep all of them, so neither selection would cap anything """
+def scaled_limits(input_json, share=0.5):
+    with open(input_json, 'r') as file:
+        json_data = json.load(file)
+    category_names = {category['id']: category['name'] for category in json_data['categories']}
+    available = {name: 0 for name in prepare_dataset.desired_limits}
+    for annotation in json_data['annotations']:
+        name = category_names.get(annotation['category_id'])
+        if name in available:
+            available[name] += 1
+    factor = min(share * available[name] / limit for name, limit in prepare_dataset.desired_limits.items())
+    return {name: max(1, int(limit * factor)) for name, limit in prepare_dataset.desired_limits.items()}
+
+""" This function times prepare_dataset.py on a copy of the Open Images style export,
+with the limits of scaled_limits, and prints how many images the greedy selection
+keeps against the first annotations of every category """
+def benchmark_prepare_dataset(data_directory, work_directory, timings):
+    input_directory = os.path.join(work_directory, 'open-images')
+    output_directory = os.path.join(work_directory, 'thesis-dataset')
+    shutil.copytree(os.path.join(data_directory, 'open-images'), input_directory)
+    os.makedirs(output_directory)
+    input_json = os.path.join(input_directory, 'labels.json')
+
+    # filter_with_annotation_store and main read the limits of the module
+    study_limits = dict(prepare_dataset.desired_limits)
+    limits = scaled_limits(input_json)
+    prepare_dataset.desired_limits.update(limits)
+    try:
+        with timed(timings, 'prepare_dataset: modify_json'):
+            with open(input_json, 'r') as file:
+                first_images = prepare_dataset.modify_json(json.load(file), limits)['images']
+        with timed(timings, 'prepare_dataset: greedy image selection'):
+            with open(input_json, 'r') as file:
+                greedy_images = select_image_subset(json.load(file), limits, os.path.join(input_directory, 'data'))['images']
+        print(f"prepare_dataset: greedy selection keeps {len(greedy_images)} of {len(first_images)} images "
+              f"({100 * (1 - len(greedy_images) / max(len(first_images), 1)):.1f}% fewer) at limits {min(limits.values())}-{max(limits.values())}")
+        with timed(timings, 'prepare_dataset: filter with annotation store'):
+            prepare_dataset.filter_with_annotation_store(input_json, os.path.join(work_directory, 'annotation-store'), None)
+        with timed(timings, 'prepare_dataset: streaming filter'):
+            filter_coco_streaming(input_json, os.path.join(work_directory, 'annotations.json'),
+                                  prepare_dataset.desired_categories, limits)
+        with timed(timings, 'prepare_dataset: main'):
+            prepare_dataset.main(input_json=input_json, input_images=os.path.join(input_directory, 'data'), output_directory=output_directory)
+    finally:
+        prepare_dataset.desired_limits.update(study_limits)
+
+""" This function measures the startup time of every subcommand of cli.py as the best
+wall time of repeat runs of cli.py <subcommand> --help and returns the subcommands
+over their budget in cli.STARTUP_BUDGETS """
+def benchmark_cli_startup(timings, repeat=3):
+    over_budget = []
+    for command, budget in cli.STARTUP_BUDGETS.items():
+        stage = f'cli startup: {command}'
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(SRC, 'cli.py'), command, '--help'], stdout=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        timings[stage] = min(times)
+        print(f"{stage:<45} {timings[stage]:10.3f} s (budget {budget:.3f} s)")
+        if timings[stage] > budget:
+            over_budget.append(command)
+    if over_budget:
+        print(f"Startup time over budget: {', '.join(over_budget)}")
+    return over_budget
+
+""" This function reads the result tables written by create_heatmap into a
+dictionary (participant, painting) -> metrics and category durations """
+def read_results(results_directory):
+    results = {}
+    with open(os.path.join(results_directory, 'painting_metrics.csv'), 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            record = {metric: float(row[metric]) for metric in METRICS}
+            record['object_durations'] = {}
+            results[(row['participant'], row['painting'])] = record
+    with open(os.path.join(results_directory, 'category_durations.csv'), 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            results[(row['participant'], row['painting'])]['object_durations'][row['category']] = float(row['duration'])
+    return results
+
+""" This function reads the per-painting results printed by create_heatmap.py, such
+as reports/output.txt, into the format of read_results. The printed report has no
+maximum durations """
+def parse_report(report_file):
+    results = {}
+    participant = None
+    record = None
+    patterns = {
+        'total_duration_in_objects': 'Total duration in objects: ',
+        'total_duration_outside_objects': 'Total duration outside objects: ',
+        'average_duration_in_objects': 'Average duration in objects: ',
+        'average_duration_outside_objects': 'Average duration outside objects: '
+    }
+    with open(report_file, 'r') as file:
+        for line in file:
+            line = line.strip()
+            match = re.match(r'Participant: (\S+)$', line)
+            if match:
+                participant = match.group(1)
+                continue
+            match = re.match(r'Image: (\S+), Total time: (\S+) Average gaze: (\S+)$', line)
+            if match:
+                record = {'total_time': float(match.group(2)), 'mean_duration': float(match.group(3))}
+                results[(participant, match.group(1))] = record
+                continue
+            for metric, prefix in patterns.items():
+                if record is not None and line.startswith(prefix):
+                    record[metric] = float(line[len(prefix):])
+            if record is not None and line.startswith('{') and 'object_durations' not in record:
+                record['object_durations'] = next(iter(ast.literal_eval(line).values()))
+    return results
+
+""" This function compares results with golden results and returns a list of differences """
+def compare_results(results, golden, rtol=1e-9):
+    differences = []
+    for key in sorted(set(golden) | set(results)):
+        if key not in results or key not in golden:
+            differences.append(f"{key}: missing in {'results' if key not in results else 'golden run'}")
+            continue
+        for metric, golden_value in golden[key].items():
+            value = results[key][metric]
+            if metric == 'object_durations':
+                if set(value) != set(golden_value):
+                    differences.append(f"{key} categories: {sorted(value)} != {sorted(golden_value)}")
+                    continue
+                pairs = [(value[category], golden_value[category]) for category in golden_value]
+            else:
+                pairs = [(value, golden_value)]
+            for actual, expected in pairs:
+                if not np.isclose(actual, expected, rtol=rtol, atol=0):
+                    differences.append(f"{key} {metric}: {actual} != {expected}")
+    return differences
+
+def main(data_directory = 'synthetic-data', golden = None, write_golden = None, workers = 1, rtol = 1e-9, output = None):
+    timings = {}
+    with tempfile.TemporaryDirectory() as work_directory:
+        results_directory = os.path.join(work_directory, 'results')
+        gaze, catalog = benchmark_create_heatmap(data_directory, results_directory, timings, workers)
+        differences = benchmark_map_coordinates(gaze, catalog, timings)
+        benchmark_prepare_dataset(data_directory, work_directory, timings)
+        over_budget = benchmark_cli_startup(timings)
+
+        results = read_results(results_directory)
+        if write_golden is not None:
+            os.makedirs(write_golden, exist_ok=True)
+            for table in ('painting_metrics.csv', 'category_durations.csv'):
+                shutil.copy(os.path.join(results_directory, table), write_golden)
+            print(f"Golden results written to {write_golden}")
+
+    if golden is not None:
+        golden_results = parse_report(golden) if os.path.isfile(golden) else read_results(golden)
+        golden_differences = compare_results(results, golden_results, rtol)
+        for difference in golden_differences[:20]:
+            print(difference)
+        print(f"Golden run: {len(golden_differences)} differences in {len(golden_results)} participant x painting results")
+        differences += len(golden_differences)
+
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump({'timings': timings, 'differences': differences, 'startup_over_budget': over_budget}, file, indent=2)
+    return differences
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--data_directory', type=str,
+                           default='synthetic-data',
+                           help='directory written by generate_synthetic_data.py')
+    parser.add_argument('--golden', type=str,
+                           default=None,
+                           help='golden results to compare with: a directory with result tables or a printed report such as reports/output.txt')
+    parser.add_argument('--write_golden', type=str,
+                           default=None,
+                           help='directory to store the result tables of this run as golden results')
+    parser.add_argument('--workers', type=int,
+                           default=1,
+                           help='number of processes used by create_heatmap.main')
+    parser.add_argument('--rtol', type=float,
+                           default=1e-9,
+                           help='relative tolerance of the golden comparison')
+    parser.add_argument('--output', type=str,
+                           default=None,
+                           help='json file to write the timings to')
+    args = parser.parse_args()
+    sys.exit(1 if main(**dict(args._get_kwargs())) else 0)
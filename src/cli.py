@@ -0,0 +1,58 @@
+''' Command line interface with one subcommand per script: heatmap
+(visualization/create_heatmap.py), stats (visualization/stat_analysis.py),
+prepare-dataset (features/prepare_dataset.py) and semart
+(data/semart_object_analysis.py). The module of a subcommand is imported only
+when that subcommand runs, and the modules import matplotlib, statsmodels, NLTK
+and spaCy only where they are used, so a subcommand does not pay for the
+dependencies of the others
+'''
+
+import importlib
+import os
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommand -> directory in src, module and help
+SUBCOMMANDS = {
+    'heatmap': ('visualization', 'create_heatmap', 'create heatmap visualizations and perform statistical tests'),
+    'stats': ('visualization', 'stat_analysis', 'run the statistical tests on result tables of heatmap and on the anova file'),
+    'prepare-dataset': ('features', 'prepare_dataset', 'prepare a downloaded Open Images dataset for object detection'),
+    'semart': ('data', 'semart_object_analysis', 'find the most common objects in SemArt painting descriptions')
+}
+
+# Startup time budget of every subcommand in seconds: the wall time of
+# python cli.py <subcommand> --help, measured by benchmarks/run_benchmarks.py
+STARTUP_BUDGETS = {
+    'heatmap': 0.5,
+    'stats': 0.5,
+    'prepare-dataset': 0.2,
+    'semart': 0.5
+}
+
+""" This function imports the module of a subcommand. The module directory is put on
+sys.path because the scripts import their sibling modules by name """
+def load_subcommand(command):
+    directory, module_name, _ = SUBCOMMANDS[command]
+    sys.path.insert(0, os.path.join(SRC, directory))
+    return importlib.import_module(module_name)
+
+def main(argv=None):
+    parser = ArgumentParser(prog='cli.py', description='Run a script of the project: python cli.py <subcommand> [arguments]')
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='subcommand')
+    for command, (_, _, help_text) in SUBCOMMANDS.items():
+        # Arguments of the subcommand are parsed after its module is imported
+        subparsers.add_parser(command, help=help_text, add_help=False)
+    args, remaining = parser.parse_known_args(argv)
+
+    module = load_subcommand(args.command)
+    command_parser = ArgumentParser(prog=f'cli.py {args.command}', description=SUBCOMMANDS[args.command][2],
+                                    formatter_class=ArgumentDefaultsHelpFormatter)
+    module.add_arguments(command_parser)
+    command_args = command_parser.parse_args(remaining)
+    module.main(**dict(command_args._get_kwargs()))
+
+
+if __name__ == "__main__":
+    main()
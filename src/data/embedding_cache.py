@@ -0,0 +1,80 @@
+""" Contains the embedding cache: word vectors of terms are stored on disk as a
+memory-mapped float32 matrix with a json vocabulary index, so every term is
+looked up once per spaCy model and reused by later runs """
+
+import json
+import os
+import numpy as np
+
+VECTORS_FILE = 'vectors.npy'
+VOCABULARY_FILE = 'vocabulary.json'
+
+""" This class gives the word vectors of terms. Vectors are read from the vocab
+table of the spaCy model, which load_model returns and which is only called on
+the first cache miss: the vector of a term is the mean of the vectors of its
+tokens, as nlp(term).vector, without running the pipeline. With cache_dir the
+vectors are kept in vectors.npy (one float32 row per term) and vocabulary.json
+(the model name and the row of every term); new terms are appended. A cache of
+another model is replaced """
+class EmbeddingCache:
+    def __init__(self, model_name, load_model, cache_dir=None):
+        self.model_name = model_name
+        self.load_model = load_model
+        self.cache_dir = cache_dir
+        self.nlp = None
+        self.terms = []
+        self.vectors = None
+        if cache_dir is not None:
+            self.load()
+        self.index = {term: row for row, term in enumerate(self.terms)}
+
+    def load(self):
+        vocabulary_file = os.path.join(self.cache_dir, VOCABULARY_FILE)
+        if not os.path.isfile(vocabulary_file):
+            return
+        with open(vocabulary_file, 'r') as file:
+            vocabulary = json.load(file)
+        if vocabulary['model'] != self.model_name:
+            return
+        self.terms = vocabulary['terms']
+        self.vectors = np.load(os.path.join(self.cache_dir, VECTORS_FILE), mmap_mode='r')
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Files are written next to the cache and renamed, so readers never see partial files
+        vectors_file = os.path.join(self.cache_dir, VECTORS_FILE)
+        with open(vectors_file + '.tmp', 'wb') as file:
+            np.save(file, self.vectors)
+        os.replace(vectors_file + '.tmp', vectors_file)
+        vocabulary_file = os.path.join(self.cache_dir, VOCABULARY_FILE)
+        with open(vocabulary_file + '.tmp', 'w') as file:
+            json.dump({'model': self.model_name, 'terms': self.terms}, file)
+        os.replace(vocabulary_file + '.tmp', vocabulary_file)
+        self.vectors = np.load(vectors_file, mmap_mode='r')
+
+    """ Looks up the vector of a term in the vocab table of the model """
+    def lookup(self, term):
+        if self.nlp is None:
+            self.nlp = self.load_model()
+        tokens = self.nlp.tokenizer(term)
+        if len(tokens) == 0:
+            return np.zeros(self.nlp.vocab.vectors_length, dtype=np.float32)
+        return np.mean([token.vector for token in tokens], axis=0).astype(np.float32)
+
+    """ Returns a (len(terms), vector size) float32 array with the vectors of terms """
+    def vectors_for(self, terms):
+        missing = [term for term in dict.fromkeys(terms) if term not in self.index]
+        if missing:
+            new_vectors = np.stack([self.lookup(term) for term in missing])
+            if self.vectors is None:
+                self.vectors = new_vectors
+            else:
+                self.vectors = np.concatenate((self.vectors, new_vectors))
+            for term in missing:
+                self.index[term] = len(self.terms)
+                self.terms.append(term)
+            if self.cache_dir is not None:
+                self.save()
+        if not terms:
+            return np.zeros((0, 0 if self.vectors is None else self.vectors.shape[1]), dtype=np.float32)
+        return np.array(self.vectors[[self.index[term] for term in terms]])
@@ -1,82 +1,292 @@
-""" This code analyzes SemArt dataset which contains painting desciptions 
+""" This code analyzes SemArt dataset which contains painting desciptions
 to determine most common words for different artistic genres """
 
-import pandas as pd
+import os
+import sys
 import numpy as np
-import nltk
-import scipy.cluster.hierarchy as shc 
-import matplotlib.pyplot as plt
-from nltk.corpus import stopwords
-from nltk.probability import FreqDist
-from nltk.tokenize import RegexpTokenizer
-import spacy
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.cluster import AgglomerativeClustering
-from scipy.cluster.hierarchy import dendrogram
+from collections import Counter
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
-nlp = spacy.load("en_core_web_lg")
+from embedding_cache import EmbeddingCache
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'visualization'))
+from config import CLASSES
 
-nltk.download('punkt')  
-nltk.download('stopwords')
-nltk.download('wordnet')
-nltk.download('omw-1.4')
-nltk.download('maxent_ne_chunker')
+# NLTK resources used by the analysis and the paths nltk.data.find looks them up by.
+# The tagger was renamed in NLTK 3.9, either name is accepted
+NLTK_RESOURCES = {
+    'stopwords': ['corpora/stopwords'],
+    'wordnet': ['corpora/wordnet'],
+    'omw-1.4': ['corpora/omw-1.4'],
+    'averaged_perceptron_tagger': ['taggers/averaged_perceptron_tagger', 'taggers/averaged_perceptron_tagger_eng']
+}
 
-# Load the dataset
-df = pd.read_csv('../../data/external/semart_train.csv', sep='\t', encoding = 'latin-1')
-# print(df.head(15))
+# Columns of the SemArt catalogue used by the analysis
+SEMART_COLUMNS = ['TIMEFRAME', 'TYPE', 'DESCRIPTION']
 
-filtered_df = df[(df['TIMEFRAME'] == '1601-1650') | (df['TIMEFRAME'] == '1651-1700')] 
+# Manually defined words to remove
+individual_words = (["painting", "picture", "work", "artist", "painter", "scene", "figure", "time", "year", "century", "wall", "subject", "style", "art", "van", "composition", "theme", "version", "example", "background", "life", "number", "colour", "foreground", "right", "left", "rembrandt", "period", "age", "part", "group", "event", "history", "view", "cycle", "space", "light", "series", "story", "allegory", "way", "side", "sketch", "design", "models", "de", "studio", "panel", "collection", "effect", "depiction", "type", "motif", "viewer", "piece", "end", "da", "perspective", "der", "distance", "influence", "form", "tradition", "setting", "zquez", "set", "de'", "place", "drawing", "canvas", "object", "sitter", "sale", "member", "self-portrait", "length"])
 
-# Get unique genres of paintings and create plural versions of genre names
-unique_genres = filtered_df["TYPE"].unique()
-plural_genres = np.char.add(unique_genres.astype(str), 's')
+""" This function checks that the NLTK resources in resources are installed locally
+and raises an error that lists the missing ones. Nothing is downloaded, so the
+analysis also runs offline once the resources are installed """
+def check_nltk_resources(resources=tuple(NLTK_RESOURCES)):
+    import nltk
 
-grouped_by_type = filtered_df.groupby('TYPE')
+    missing = []
+    for resource in resources:
+        paths = NLTK_RESOURCES[resource]
+        found = False
+        for path in paths:
+            try:
+                nltk.data.find(path)
+                found = True
+                break
+            except LookupError:
+                pass
+        if not found:
+            missing.append(resource)
+    if missing:
+        raise LookupError(f"Missing NLTK resources: {', '.join(missing)}. Install them with: python -m nltk.downloader {' '.join(missing)}")
 
-# Define words to remove
-stop_words = set(stopwords.words('english'))
-# Manually defined words to remove
-individual_words = (["painting", "picture", "work", "artist", "painter", "scene", "figure", "time", "year", "century", "wall", "subject", "style", "art", "van", "composition", "theme", "version", "example", "background", "life", "number", "colour", "foreground", "right", "left", "rembrandt", "period", "age", "part", "group", "event", "history", "view", "cycle", "space", "light", "series", "story", "allegory", "way", "side", "sketch", "design", "models", "de", "studio", "panel", "collection", "effect", "depiction", "type", "motif", "viewer", "piece", "end", "da", "perspective", "der", "distance", "influence", "form", "tradition", "setting", "zquez", "set", "de'", "place", "drawing", "canvas", "object", "sitter", "sale", "member", "self-portrait", "length"]) 
-remove_words = stop_words.union(individual_words, plural_genres, unique_genres)
+# Pipeline components of the spaCy English models, excluded when only word vectors are needed
+PIPELINE_COMPONENTS = ['tok2vec', 'tagger', 'morphologizer', 'parser', 'senter', 'attribute_ruler', 'lemmatizer', 'ner']
+
+""" This function loads an installed spaCy model and raises an error if it is not installed """
+def load_spacy_model(model_name, disable=(), exclude=()):
+    import spacy
+
+    if not spacy.util.is_package(model_name):
+        raise OSError(f"spaCy model {model_name} is not installed. Install it with: python -m spacy download {model_name}")
+    return spacy.load(model_name, disable=list(disable), exclude=list(exclude))
 
-is_noun = lambda pos: pos[:2] == 'NN'
-tokenizer = RegexpTokenizer(r"\w+['\w-]*")
-lemmatizer = nltk.stem.WordNetLemmatizer()
+""" This function reads SemArt catalogues in chunks of chunk_size rows and yields
+the (genre, description) pairs of every chunk. Only the TIMEFRAME, TYPE and
+DESCRIPTION columns are decoded and rows are filtered by timeframes (all if
+empty) chunk by chunk, so memory depends on the chunk size, not on the size of
+the catalogues """
+def iter_semart_chunks(semart_files, timeframes=None, chunk_size=10000):
+    import pandas as pd
+
+    for semart_file in semart_files:
+        for chunk in pd.read_csv(semart_file, sep='\t', encoding='latin-1', usecols=SEMART_COLUMNS, dtype=str, chunksize=chunk_size):
+            if timeframes:
+                chunk = chunk[chunk['TIMEFRAME'].isin(timeframes)]
+            chunk = chunk.dropna(subset=['TYPE', 'DESCRIPTION'])
+            yield list(zip(chunk['TYPE'], chunk['DESCRIPTION']))
 
 def is_name(word):
     return all([w not in word for w in word.lower().split()])
 
+""" This function returns the words that are not counted as terms by either
+pipeline: the NLTK English stop words and the manually defined words. Genre
+names are left out of the most common terms by most_common_terms """
+def words_to_remove():
+    from nltk.corpus import stopwords
+
+    return set(stopwords.words('english')).union(individual_words)
+
+""" This function counts the lemmas of nouns in the descriptions of every genre
+with NLTK: the descriptions of a genre are joined, tagged with nltk.pos_tag and
+lemmatized token by token. genre_descriptions yields (genre, description) pairs.
+main calls it once per chunk of the catalogues and merges the counts; the tagger
+sees the words around a chunk boundary without the other chunk, so the counts
+can differ slightly with the chunk size. Returns a dictionary genre -> Counter """
+def count_nouns_nltk(genre_descriptions, remove_words):
+    import nltk
+    from nltk.tokenize import RegexpTokenizer
+
+    descriptions_by_genre = {}
+    for genre, description in genre_descriptions:
+        descriptions_by_genre.setdefault(genre, []).append(description)
+
+    is_noun = lambda pos: pos[:2] == 'NN'
+    tokenizer = RegexpTokenizer(r"\w+['\w-]*")
+    lemmatizer = nltk.stem.WordNetLemmatizer()
+    counters = {}
+    for genre, descriptions in descriptions_by_genre.items():
+        tokens = tokenizer.tokenize(' '.join(descriptions))
+        nouns = [word for (word, pos) in nltk.pos_tag(tokens) if is_noun(pos) and not is_name(word)]
+        lemmas = [lemmatizer.lemmatize(t) for t in nouns]
+        counters[genre] = Counter(word for word in lemmas if word.lower() not in remove_words)
+    return counters
+
+""" This function streams (genre, description) pairs through nlp.pipe in batches of
+batch_size, in n_process processes, and counts the lemmas of nouns per genre with
+spaCy's own tags and lemmas. Tokens inside named entities and capitalized tokens
+are names and are not counted. Returns a dictionary genre -> Counter """
+def count_nouns_spacy(nlp, genre_descriptions, remove_words, batch_size=256, n_process=1):
+    # nlp.pipe with as_tuples takes (text, context) pairs
+    description_genres = ((description, genre) for genre, description in genre_descriptions)
+    counters = {}
+    for doc, genre in nlp.pipe(description_genres, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        counter = counters.setdefault(genre, Counter())
+        counter.update(token.lemma_ for token in doc
+                       if token.tag_.startswith('NN') and not token.ent_type_ and not is_name(token.text)
+                       and token.lemma_.lower() not in remove_words)
+    return counters
+
+""" This function adds the counts of every genre of other to counters, e.g. to
+combine the counts of several SemArt splits """
+def merge_counters(counters, other):
+    for genre, counter in other.items():
+        counters.setdefault(genre, Counter()).update(counter)
+    return counters
+
+""" This function returns the n most common terms of a genre. Genre names and
+their plurals are not counted as terms """
+def most_common_terms(counter, genres, n=15):
+    genre_words = {str(genre).lower() for genre in genres} | {f'{str(genre).lower()}s' for genre in genres}
+    most_common = []
+    for term, frequency in counter.most_common():
+        if term.lower() not in genre_words:
+            most_common.append((term, frequency))
+            if len(most_common) == n:
+                break
+    return most_common
+
+""" This function groups object categories by the cosine distance of their word vectors """
+def group_categories(object_categories, embeddings):
+    from sklearn.cluster import AgglomerativeClustering
 
-for _type, group in grouped_by_type:
-    descriptions = ' '.join(group['DESCRIPTION'])
-    tokens = tokenizer.tokenize(descriptions)
-    nouns = [word for (word, pos) in nltk.pos_tag(tokens) if is_noun(pos) and not is_name(word)]
-    lemmas = [lemmatizer.lemmatize(t) for t in nouns]
-    filtered_tokens = [word for word in lemmas if word.lower() not in remove_words]
-    fdist = FreqDist(filtered_tokens)
-    most_common = fdist.most_common(15) 
-    print(f"Type {_type}:")
-    for term, frequency in most_common:
-        print(f"{term}: {frequency} occurrences")
-    print("----------------------------------------")
-    
-    # Grouping object categories
-    object_categories = [term for term, _ in most_common]
-    embeddings = [nlp(category).vector for category in object_categories]
-    clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=0.6, affinity='cosine', linkage='average')
+    clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=0.6, metric='cosine', linkage='average')
     clusters = clustering.fit_predict(embeddings)
-    
+
     grouped_categories = {}
     for category, cluster in zip(object_categories, clusters):
         if cluster not in grouped_categories:
             grouped_categories[cluster] = []
         grouped_categories[cluster].append(category)
-        
-    print(f"Type {_type}:")
-    for group, categories in grouped_categories.items():
-        print(f"Group {group}: {categories}")
-    print("----------------------------------------")
-    
-    
\ No newline at end of file
+    return grouped_categories
+
+""" This function returns the cosine similarity matrix of the rows of a and b.
+Zero vectors, e.g. of terms without a word vector, have similarity 0 """
+def cosine_similarity_matrix(a, b):
+    a_norm = np.linalg.norm(a, axis=1, keepdims=True)
+    b_norm = np.linalg.norm(b, axis=1, keepdims=True)
+    return (a / np.where(a_norm > 0, a_norm, 1)) @ (b / np.where(b_norm > 0, b_norm, 1)).T
+
+""" This function clusters the union of the most common terms of all genres once,
+with distances 1 - cosine similarity from a precomputed similarity matrix, and maps
+every cluster to the object class of config.CLASSES whose vector is most similar
+to the mean vector of the cluster. Clusters less similar than min_similarity to
+every class are mapped to None. Returns a dictionary cluster -> (terms, class) """
+def cluster_terms_globally(terms, embeddings, class_embeddings, distance_threshold=0.6, min_similarity=0.4):
+    from sklearn.cluster import AgglomerativeClustering
+
+    if len(terms) < 2:
+        clusters = np.zeros(len(terms), dtype=int)
+    else:
+        distances = np.clip(1 - cosine_similarity_matrix(embeddings, embeddings), 0, 2)
+        np.fill_diagonal(distances, 0)
+        clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=distance_threshold, metric='precomputed', linkage='average')
+        clusters = clustering.fit_predict(distances)
+
+    grouped_terms = {}
+    for cluster in dict.fromkeys(clusters):
+        members = np.flatnonzero(clusters == cluster)
+        centroid = embeddings[members].mean(axis=0, keepdims=True)
+        similarity = cosine_similarity_matrix(centroid, class_embeddings)[0]
+        best = int(np.argmax(similarity))
+        object_class = CLASSES[best + 1] if similarity[best] >= min_similarity else None
+        grouped_terms[cluster] = ([terms[member] for member in members], object_class)
+    return grouped_terms
+
+""" This function prints the most common nouns of every genre and their groups:
+per genre, or with clustering='global' once for the terms of all genres, mapped
+to config.CLASSES """
+def print_genres(counters, embedding_cache, clustering='genre'):
+    genres = sorted(counters)
+    all_terms = []
+    for _type in genres:
+        most_common = most_common_terms(counters[_type], genres)
+        print(f"Type {_type}:")
+        for term, frequency in most_common:
+            print(f"{term}: {frequency} occurrences")
+        print("----------------------------------------")
+        object_categories = [term for term, _ in most_common]
+        all_terms.extend(object_categories)
+        if clustering == 'global':
+            continue
+
+        # Grouping object categories
+        grouped_categories = group_categories(object_categories, embedding_cache.vectors_for(object_categories))
+        print(f"Type {_type}:")
+        for group, categories in grouped_categories.items():
+            print(f"Group {group}: {categories}")
+        print("----------------------------------------")
+
+    if clustering == 'global':
+        terms = list(dict.fromkeys(all_terms))
+        grouped_terms = cluster_terms_globally(terms, embedding_cache.vectors_for(terms), embedding_cache.vectors_for(CLASSES[1:]))
+        print("All types:")
+        for group, (categories, object_class) in grouped_terms.items():
+            print(f"Group {group}: {categories} -> {object_class}")
+        print("----------------------------------------")
+
+def main(semart_file = ['../../data/external/semart_train.csv'], timeframes = ['1601-1650', '1651-1700'],
+         spacy_model = 'en_core_web_lg', pipeline = 'nltk', batch_size = 256, n_process = 1,
+         embedding_cache = None, clustering = 'genre', chunk_size = 10000):
+    # Words to remove: stop words and manually defined words, the same for both pipelines.
+    # Genre names are removed from the most common terms once all genres are known
+    if pipeline == 'nltk':
+        check_nltk_resources()
+        remove_words = words_to_remove()
+        # Only word vectors are needed, and only for terms that are not cached
+        load_model = lambda: load_spacy_model(spacy_model, exclude=PIPELINE_COMPONENTS)
+    else:
+        check_nltk_resources(['stopwords'])
+        remove_words = words_to_remove()
+        # The parser is not needed for tags, lemmas and entities
+        nlp = load_spacy_model(spacy_model, disable=['parser'])
+        load_model = lambda: nlp
+    embeddings = EmbeddingCache(spacy_model, load_model, embedding_cache)
+
+    # Load the dataset chunk by chunk
+    chunks = iter_semart_chunks(semart_file, timeframes, chunk_size)
+    counters = {}
+    if pipeline == 'nltk':
+        for genre_descriptions in chunks:
+            merge_counters(counters, count_nouns_nltk(genre_descriptions, remove_words))
+    else:
+        # nlp.pipe pulls descriptions from the chunks as it needs them
+        genre_descriptions = (pair for chunk in chunks for pair in chunk)
+        merge_counters(counters, count_nouns_spacy(nlp, genre_descriptions, remove_words, batch_size, n_process))
+    print_genres(counters, embeddings, clustering)
+
+""" This function adds the command line arguments of main to parser """
+def add_arguments(parser):
+    parser.add_argument('--semart_file', type=str, nargs='+',
+                           default=['../../data/external/semart_train.csv'],
+                           help='tab separated SemArt catalogues with TIMEFRAME, TYPE and DESCRIPTION columns, e.g. the train and test splits')
+    parser.add_argument('--timeframes', type=str, nargs='*',
+                           default=['1601-1650', '1651-1700'],
+                           help='timeframes of the paintings to analyze; all timeframes if given without values')
+    parser.add_argument('--spacy_model', type=str,
+                           default='en_core_web_lg',
+                           help='installed spaCy model that provides the word vectors')
+    parser.add_argument('--pipeline', type=str, choices=['spacy', 'nltk'],
+                           default='nltk',
+                           help='find nouns and lemmas with nltk.pos_tag and the WordNet lemmatizer, or with spaCy nlp.pipe')
+    parser.add_argument('--batch_size', type=int,
+                           default=256,
+                           help='descriptions per batch of nlp.pipe')
+    parser.add_argument('--n_process', type=int,
+                           default=1,
+                           help='processes used by nlp.pipe')
+    parser.add_argument('--chunk_size', type=int,
+                           default=10000,
+                           help='rows of the SemArt catalogues read at a time; with --pipeline nltk every chunk is tagged on its own, so counts can differ slightly with the chunk size')
+    parser.add_argument('--embedding_cache', type=str,
+                           default=None,
+                           help='directory to store the word vectors of terms between runs')
+    parser.add_argument('--clustering', type=str, choices=['genre', 'global'],
+                           default='genre',
+                           help='group the most common terms of every genre separately, or cluster the terms of all genres once and map the groups to the object classes')
+    return parser
+
+
+if __name__ == "__main__":
+    parser = add_arguments(ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter))
+    args = parser.parse_args()
+    main(**dict(args._get_kwargs()))
@@ -0,0 +1,178 @@
+""" Contains the annotation store: the boxes of a COCO annotation file in
+columnar arrays. Annotations are sorted by image, with image_id int32,
+category_id int16 and bbox float32 (N, 4) columns and offset arrays per image;
+file names are kept in a string table. A store is built from the json file in
+one streaming pass and saved as .npy files that later runs memory map, so
+lookups by image are array slices instead of scans over lists of dicts """
+
+import json
+import os
+from array import array
+from bisect import bisect_left
+import numpy as np
+
+from coco_stream import iter_json_members
+
+INDEX_FILE = 'index.json'
+
+# Arrays of a store and their types
+ARRAYS = {
+    'image_id': np.int32,             # COCO id of every image, in file order
+    'name_offsets': np.int64,         # file name of image i is names[name_offsets[i]:name_offsets[i + 1]]
+    'names': np.uint8,                # utf-8 file names of all images
+    'name_order': np.int32,           # images sorted by file name
+    'annotation_offsets': np.int64,   # annotations of image i are rows annotation_offsets[i]:annotation_offsets[i + 1]
+    'annotation_row': np.int32,       # index of every annotation in the annotations array of the json file
+    'category_id': np.int16,
+    'bbox': np.float32
+}
+
+""" This function converts values to an array of dtype and raises ValueError if
+a value does not fit """
+def checked_array(values, dtype, name):
+    values = np.asarray(values)
+    if len(values) and (values.min() < np.iinfo(dtype).min or values.max() > np.iinfo(dtype).max):
+        raise ValueError(f"{name} values do not fit in {np.dtype(dtype).name}")
+    return values.astype(dtype)
+
+""" This class holds the columnar arrays of an annotation file. categories are
+the category dicts of the file and n_rows the length of its annotations array;
+annotations whose image is not in the images array are not stored """
+class AnnotationStore:
+    def __init__(self, arrays, categories, n_rows):
+        self.arrays = arrays
+        self.categories = categories
+        self.n_rows = n_rows
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self._file_names = None
+        self._sorted_names = None
+
+    """ Builds a store from a COCO annotation file, reading it in one streaming pass """
+    @classmethod
+    def build(cls, annotation_file, block_size=1 << 20):
+        image_ids = array('q')
+        name_offsets = array('q', [0])
+        names = bytearray()
+        row_image_ids = array('q')
+        row_categories = array('q')
+        boxes = array('f')
+        categories = []
+        with open(annotation_file, 'r') as file:
+            for key, value in iter_json_members(file, block_size=block_size):
+                if key == 'images':
+                    for image in value:
+                        image_ids.append(image['id'])
+                        names += image['file_name'].encode('utf-8')
+                        name_offsets.append(len(names))
+                elif key == 'annotations':
+                    for annotation in value:
+                        row_image_ids.append(annotation['image_id'])
+                        row_categories.append(annotation['category_id'])
+                        boxes.extend(annotation['bbox'])
+                elif key == 'categories':
+                    categories = value
+
+        image_ids = np.frombuffer(image_ids, dtype=np.int64)
+        row_image_ids = np.frombuffer(row_image_ids, dtype=np.int64)
+        # Image index of every annotation, -1 if its image is missing
+        id_order = np.argsort(image_ids, kind='stable')
+        sorted_ids = image_ids[id_order]
+        if len(sorted_ids):
+            positions = np.minimum(np.searchsorted(sorted_ids, row_image_ids), len(sorted_ids) - 1)
+            row_images = np.where(sorted_ids[positions] == row_image_ids, id_order[positions], -1)
+        else:
+            row_images = np.full(len(row_image_ids), -1, dtype=np.int64)
+
+        kept = np.flatnonzero(row_images >= 0)
+        annotation_row = kept[np.argsort(row_images[kept], kind='stable')]
+        annotation_offsets = np.zeros(len(image_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_images[kept], minlength=len(image_ids)), out=annotation_offsets[1:])
+
+        file_names = [names[start:end].decode('utf-8') for start, end in zip(name_offsets[:-1], name_offsets[1:])]
+        name_offsets = np.frombuffer(name_offsets, dtype=np.int64)
+        arrays = {
+            'image_id': checked_array(image_ids, np.int32, 'image id'),
+            'name_offsets': name_offsets.copy(),
+            'names': np.frombuffer(bytes(names), dtype=np.uint8).copy(),
+            'name_order': np.array(sorted(range(len(file_names)), key=file_names.__getitem__), dtype=np.int32),
+            'annotation_offsets': annotation_offsets,
+            'annotation_row': annotation_row.astype(np.int32),
+            'category_id': checked_array(np.frombuffer(row_categories, dtype=np.int64)[annotation_row], np.int16, 'category id'),
+            'bbox': np.frombuffer(boxes, dtype=np.float32).reshape(-1, 4)[annotation_row]
+        }
+        return cls(arrays, categories, len(row_image_ids))
+
+    """ Returns the store of annotation_file. With store_dir the store is memory
+    mapped from store_dir if it was built from the current version of the file
+    (same modification time and size), else it is built and saved there """
+    @classmethod
+    def open(cls, annotation_file, store_dir=None):
+        if store_dir is None:
+            return cls.build(annotation_file)
+        stat = os.stat(annotation_file)
+        state = {'source': os.path.abspath(annotation_file), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        index_file = os.path.join(store_dir, INDEX_FILE)
+        if os.path.isfile(index_file):
+            with open(index_file, 'r') as file:
+                index = json.load(file)
+            if all(index.get(key) == value for key, value in state.items()):
+                arrays = {name: np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+                return cls(arrays, index['categories'], index['n_rows'])
+        store = cls.build(annotation_file)
+        store.save(store_dir, state)
+        return cls.open(annotation_file, store_dir)
+
+    """ Writes the arrays as .npy files and the index last, so an interrupted
+    save leaves a store that is rebuilt by the next run """
+    def save(self, store_dir, state):
+        os.makedirs(store_dir, exist_ok=True)
+        index_file = os.path.join(store_dir, INDEX_FILE)
+        if os.path.isfile(index_file):
+            os.remove(index_file)
+        for name in ARRAYS:
+            array_file = os.path.join(store_dir, name + '.npy')
+            with open(array_file + '.tmp', 'wb') as file:
+                np.save(file, self.arrays[name])
+            os.replace(array_file + '.tmp', array_file)
+        with open(index_file + '.tmp', 'w') as file:
+            json.dump(dict(state, categories=self.categories, n_rows=self.n_rows), file)
+        os.replace(index_file + '.tmp', index_file)
+
+    @property
+    def n_images(self):
+        return len(self.image_id)
+
+    """ Returns the file names of all images, decoded once """
+    def file_names(self):
+        if self._file_names is None:
+            names = bytes(self.names)
+            offsets = self.name_offsets.tolist()
+            self._file_names = [names[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        return self._file_names
+
+    """ Returns the indices of the images whose file name starts with prefix, in
+    file order, by binary search in the sorted file names """
+    def images_with_prefix(self, prefix):
+        if self._sorted_names is None:
+            file_names = self.file_names()
+            self._sorted_names = [file_names[image] for image in self.name_order.tolist()]
+        start = bisect_left(self._sorted_names, prefix)
+        end = start
+        while end < len(self._sorted_names) and self._sorted_names[end].startswith(prefix):
+            end += 1
+        return np.sort(self.name_order[start:end])
+
+    """ Returns the slice of the annotation arrays that holds the annotations of an image """
+    def annotations_of(self, image):
+        return slice(int(self.annotation_offsets[image]), int(self.annotation_offsets[image + 1]))
+
+    """ Returns the image index and category id of every annotation of the json
+    file in file order, -1 for annotations that are not stored """
+    def rows(self):
+        row_images = np.full(self.n_rows, -1, dtype=np.int64)
+        row_categories = np.full(self.n_rows, -1, dtype=np.int64)
+        image_of_annotation = np.repeat(np.arange(self.n_images), np.diff(self.annotation_offsets))
+        row_images[self.annotation_row] = image_of_annotation
+        row_categories[self.annotation_row] = self.category_id
+        return row_images, row_categories
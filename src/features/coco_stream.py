@@ -0,0 +1,238 @@
+""" Contains the streaming COCO filter of prepare_dataset.py. The labels.json
+of an Open Images export is parsed incrementally, one array element at a time,
+and the filtered annotations and images are spooled to disk, so memory does
+not grow with the size of the export """
+
+import json
+import os
+import tempfile
+
+""" This class reads JSON values from a text file in blocks. Values are decoded
+with json.JSONDecoder.raw_decode from a buffer that is refilled when a value
+is not complete yet, so only the current value and one block are in memory """
+class JSONStreamReader:
+    def __init__(self, file, block_size=1 << 20):
+        self.file = file
+        self.block_size = block_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    """ Reads the next block into the buffer and drops the part already decoded.
+    Returns False at the end of the file """
+    def fill(self):
+        if self.eof:
+            return False
+        block = self.file.read(self.block_size)
+        if not block:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + block
+        self.position = 0
+        return True
+
+    """ Skips whitespace and returns the next character without consuming it,
+    or '' at the end of the file """
+    def peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\n\r':
+                self.position += 1
+            if self.position < len(self.buffer) or not self.fill():
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError(f"Expected '{character}' at character {self.position} of the JSON stream block")
+        self.position += 1
+
+    """ Decodes the next value. A value that ends at the end of the buffer is
+    decoded again after the next block, since a number can continue there """
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    """ Yields the elements of the array that starts at the current position """
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == ',':
+                self.position += 1
+            else:
+                self.expect(']')
+                return
+
+""" This function yields (key, value) for every member of the top level JSON
+object in file. Members in streamed_keys that hold arrays are yielded as
+iterators over their elements, which are drained before the next member """
+def iter_json_members(file, streamed_keys=('images', 'annotations'), block_size=1 << 20):
+    reader = JSONStreamReader(file, block_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.decode()
+        reader.expect(':')
+        if key in streamed_keys and reader.peek() == '[':
+            elements = reader.iter_array()
+            yield key, elements
+            for _ in elements:
+                pass
+        else:
+            yield key, reader.decode()
+        if reader.peek() == ',':
+            reader.position += 1
+        else:
+            reader.expect('}')
+            return
+
+""" This function writes a JSON value as a member of the top level object,
+formatted as json.dump(data, file, indent=indent) formats it """
+def write_member(file, key, value, indent):
+    prefix = ' ' * indent if indent is not None else ''
+    text = json.dumps(value, indent=indent)
+    if indent is not None:
+        text = text.replace('\n', '\n' + prefix)
+    file.write(f'{prefix}{json.dumps(key)}: {text}')
+
+""" This function writes an array member whose elements are the JSON lines of
+spool files, formatted as json.dump(data, file, indent=indent) formats it.
+Elements for which keep returns False are left out. Returns the number of
+elements written """
+def write_spooled_member(file, key, spool_files, indent, keep=None):
+    prefix = ' ' * indent if indent is not None else ''
+    opening, separator = ('\n' + 2 * prefix, ',\n' + 2 * prefix) if indent is not None else ('', ', ')
+    file.write(f'{prefix}{json.dumps(key)}: [')
+    written = 0
+    for spool_file in spool_files:
+        with open(spool_file, 'r') as spool:
+            for line in spool:
+                element = json.loads(line)
+                if keep is not None and not keep(element):
+                    continue
+                text = json.dumps(element, indent=indent)
+                if indent is not None:
+                    text = text.replace('\n', '\n' + 2 * prefix)
+                file.write((separator if written else opening) + text)
+                written += 1
+    if written and indent is not None:
+        file.write('\n' + prefix)
+    file.write(']')
+    return written
+
+""" This function filters a COCO annotation file like prepare_dataset.main and
+modify_json do, but in one streaming pass: categories are filtered to
+desired_categories and renumbered from 1, and the first desired_limits[name]
+annotations of every category in file order are kept. Annotations are spooled
+to one file per category and images to one file, and output_json is written
+from the spool files with annotations grouped by category in desired_limits
+order and the images of the kept annotations in file order. Only the kept
+image ids are held in memory. The categories member has to precede the
+annotations member, as it does in Open Images exports. Returns the number of
+kept images and annotations """
+def filter_coco_streaming(input_json, output_json, desired_categories, desired_limits,
+                          indent=2, spool_directory=None, block_size=1 << 20):
+    members = {}
+    category_id_mapping = None
+    limits = {}
+    counts = {}
+    image_ids = set()
+    annotations_done = False
+    with tempfile.TemporaryDirectory(dir=spool_directory) as spool, open(input_json, 'r') as file:
+        spool_files = {}
+        for key, value in iter_json_members(file, block_size=block_size):
+            if key == 'categories':
+                categories = [category for category in value if category['name'] in desired_categories]
+                category_id_mapping = {category['id']: index + 1 for index, category in enumerate(categories)}
+                for category in categories:
+                    category['id'] = category_id_mapping[category['id']]
+                # Limits go to the first category of every name, as get_category_id finds it
+                for name, limit in desired_limits.items():
+                    category_id = next((category['id'] for category in categories if category['name'] == name), None)
+                    if category_id is None:
+                        print(f"Category '{name}' not found in the JSON.")
+                    elif category_id not in limits:
+                        limits[category_id] = limit
+                        counts[category_id] = 0
+                        spool_files[category_id] = os.path.join(spool, f'annotations_{category_id}.jsonl')
+                members[key] = categories
+            elif key == 'annotations':
+                if category_id_mapping is None:
+                    raise ValueError(f"{input_json}: streaming needs the categories before the annotations")
+                handles = {category_id: open(path, 'w') for category_id, path in spool_files.items()}
+                try:
+                    for annotation in value:
+                        category_id = category_id_mapping.get(annotation['category_id'])
+                        if category_id not in limits or counts[category_id] >= limits[category_id]:
+                            continue
+                        annotation['category_id'] = category_id
+                        handles[category_id].write(json.dumps(annotation) + '\n')
+                        counts[category_id] += 1
+                        image_ids.add(annotation['image_id'])
+                finally:
+                    for handle in handles.values():
+                        handle.close()
+                annotations_done = True
+                members[key] = None
+            elif key == 'images':
+                # Images before the annotations are spooled all and filtered when the output is written
+                with open(os.path.join(spool, 'images.jsonl'), 'w') as handle:
+                    for image in value:
+                        if not annotations_done or image['id'] in image_ids:
+                            handle.write(json.dumps(image) + '\n')
+                members[key] = None
+            else:
+                members[key] = value
+
+        # Annotations are written in desired_limits order, as modify_json extends them
+        annotation_spools = [spool_files[category_id] for category_id in limits]
+        opening, separator, closing = ('\n', ',\n', '\n}') if indent is not None else ('', ', ', '}')
+        n_images = n_annotations = 0
+        with open(output_json + '.tmp', 'w') as output:
+            output.write('{')
+            for index, (key, value) in enumerate(members.items()):
+                output.write(separator if index else opening)
+                if key == 'annotations':
+                    n_annotations = write_spooled_member(output, key, annotation_spools, indent)
+                elif key == 'images':
+                    n_images = write_spooled_member(output, key, [os.path.join(spool, 'images.jsonl')], indent,
+                                                    keep=lambda image: image['id'] in image_ids)
+                else:
+                    write_member(output, key, value, indent)
+            output.write(closing if members else '}')
+        os.replace(output_json + '.tmp', output_json)
+
+    return n_images, n_annotations
+
+""" This function reads a COCO annotation file in one streaming pass and keeps
+only the elements of its images and annotations arrays at the indices in
+rows (a dictionary member -> indices); they are returned in the order of the
+indices. Other members are returned whole """
+def read_coco_rows(input_json, rows, block_size=1 << 20):
+    positions = {key: {row: position for position, row in enumerate(indices)} for key, indices in rows.items()}
+    data = {}
+    with open(input_json, 'r') as file:
+        for key, value in iter_json_members(file, streamed_keys=tuple(rows), block_size=block_size):
+            if key not in positions:
+                data[key] = value
+                continue
+            elements = [None] * len(positions[key])
+            for row, element in enumerate(value):
+                position = positions[key].get(row)
+                if position is not None:
+                    elements[position] = element
+            data[key] = elements
+    return data
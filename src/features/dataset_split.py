@@ -0,0 +1,141 @@
+""" Contains the train/validation split of prepare_dataset.py. Images and
+annotations are split by index arrays: every annotation is mapped to the index
+of its image once, and the split is a boolean mask over images. The split
+annotation files share all other members (categories, info, licenses) with the
+input instead of copying them """
+
+import json
+import os
+import numpy as np
+
+""" This function returns, for every annotation, the index of its image in
+images, or -1 if the image is not in images """
+def annotation_image_indices(images, annotations):
+    image_index = {image['id']: index for index, image in enumerate(images)}
+    return np.fromiter((image_index.get(annotation['image_id'], -1) for annotation in annotations),
+                       dtype=np.int64, count=len(annotations))
+
+""" This function returns the (images, categories) matrix of annotation counts
+and the category ids of its columns """
+def category_count_matrix(n_images, annotation_images, annotation_categories):
+    category_ids, columns = np.unique(annotation_categories, return_inverse=True)
+    counts = np.zeros((n_images, len(category_ids)), dtype=np.int64)
+    valid = annotation_images >= 0
+    np.add.at(counts, (annotation_images[valid], columns.reshape(-1)[valid]), 1)
+    return counts, category_ids
+
+""" This function puts the first int(n_images * split) images of order in the
+training set, as the shuffled split of prepare_dataset always did """
+def random_split(order, split):
+    train = np.zeros(len(order), dtype=bool)
+    train[order[:int(len(order) * split)]] = True
+    return train
+
+""" This function splits images by iterative stratification: categories are
+visited from the one with the fewest unassigned annotations, and every
+unassigned image with that category (in the order of order) goes to the set
+that still needs the most annotations of it, or on ties the most images.
+Every category then has about split of its annotations in the training set.
+Images without annotations fill the sets to their image quota """
+def stratified_split(counts, order, split):
+    n_images = len(counts)
+    train = np.zeros(n_images, dtype=bool)
+    assigned = np.zeros(n_images, dtype=bool)
+    # Annotations and images still wanted by the training and the validation set
+    wanted = np.stack((split * counts.sum(axis=0), (1 - split) * counts.sum(axis=0))).astype(np.float64)
+    wanted_images = np.array([split * n_images, (1 - split) * n_images])
+    remaining = counts.sum(axis=0)
+    rank = np.empty(n_images, dtype=np.int64)
+    rank[order] = np.arange(n_images)
+
+    while remaining.any():
+        category = np.flatnonzero(remaining)[np.argmin(remaining[remaining > 0])]
+        images = np.flatnonzero((counts[:, category] > 0) & ~assigned)
+        for image in images[np.argsort(rank[images])]:
+            target = 0 if (wanted[0, category], wanted_images[0]) >= (wanted[1, category], wanted_images[1]) else 1
+            train[image] = target == 0
+            assigned[image] = True
+            wanted[target] -= counts[image]
+            wanted_images[target] -= 1
+            remaining -= counts[image]
+
+    unassigned = order[~assigned[order]]
+    n_train = int(round(min(max(wanted_images[0], 0), len(unassigned))))
+    train[unassigned[:n_train]] = True
+    return train
+
+""" This function splits coco_data into training and validation data. Images
+are shuffled with seed (a new random order if None) and split at split; with
+stratified, the split keeps the ratio of every category instead. The image index
+and category id of every annotation are computed from coco_data unless given,
+e.g. from the arrays of an annotation store. Returns the training and validation
+data, which share all members except images and annotations with coco_data """
+def split_coco(coco_data, split, stratified=False, seed=None, annotation_images=None, annotation_categories=None):
+    images = coco_data['images']
+    annotations = coco_data['annotations']
+    order = np.random.default_rng(seed).permutation(len(images))
+    if annotation_images is None:
+        annotation_images = annotation_image_indices(images, annotations)
+    if stratified:
+        if annotation_categories is None:
+            annotation_categories = np.array([annotation['category_id'] for annotation in annotations], dtype=np.int64)
+        counts, _ = category_count_matrix(len(images), annotation_images, annotation_categories)
+        train = stratified_split(counts, order, split)
+    else:
+        train = random_split(order, split)
+
+    # Images keep the shuffled order and annotations the order of the file
+    annotation_train = np.zeros(len(annotations), dtype=bool)
+    annotation_val = np.zeros(len(annotations), dtype=bool)
+    valid = annotation_images >= 0
+    annotation_train[valid] = train[annotation_images[valid]]
+    annotation_val[valid] = ~train[annotation_images[valid]]
+    split_data = []
+    for image_mask, annotation_mask in ((train, annotation_train), (~train, annotation_val)):
+        data = dict(coco_data)
+        data['images'] = [images[index] for index in order[image_mask[order]]]
+        data['annotations'] = [annotations[index] for index in np.flatnonzero(annotation_mask)]
+        split_data.append(data)
+    return split_data[0], split_data[1]
+
+""" This function returns the share of the annotations of every category that
+is in train_data, by category name """
+def category_train_shares(train_data, val_data):
+    names = {category['id']: category['name'] for category in train_data['categories']}
+    train_counts = {}
+    totals = {}
+    for counts, data in ((train_counts, train_data), (totals, train_data), (totals, val_data)):
+        for annotation in data['annotations']:
+            counts[annotation['category_id']] = counts.get(annotation['category_id'], 0) + 1
+    return {names.get(category_id, category_id): train_counts.get(category_id, 0) / total
+            for category_id, total in totals.items()}
+
+""" This function reads the split that a previous run wrote to train_json and
+val_json. Returns the training and validation data if they are a split of
+coco_data as split_coco returns it, else None """
+def read_split(coco_data, train_json, val_json):
+    try:
+        with open(train_json, 'r') as file:
+            train_data = json.load(file)
+        with open(val_json, 'r') as file:
+            val_data = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    members = {key: value for key, value in coco_data.items() if key not in ('images', 'annotations')}
+    images = {image['id']: image for image in coco_data['images']}
+    split_images = [image for data in (train_data, val_data) for image in data.get('images', [])]
+    if len(split_images) != len(images) or any(images.get(image['id']) != image for image in split_images):
+        return None
+    for data in (train_data, val_data):
+        image_ids = {image['id'] for image in data['images']}
+        annotations = [annotation for annotation in coco_data['annotations'] if annotation['image_id'] in image_ids]
+        if data.get('annotations') != annotations or {key: value for key, value in data.items() if key in members} != members:
+            return None
+    return train_data, val_data
+
+""" This function writes COCO data as compact JSON. The file is written under a
+temporary name and renamed, so an interrupted run does not leave a partial split """
+def write_compact_json(data, json_file):
+    with open(json_file + '.tmp', 'w') as file:
+        json.dump(data, file, separators=(',', ':'))
+    os.replace(json_file + '.tmp', json_file)
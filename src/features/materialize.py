@@ -0,0 +1,124 @@
+""" Contains the image materialization of prepare_dataset.py: the images of a
+split are copied, hardlinked, reflinked or symlinked into the split folder by a
+thread pool. Files that already exist with the size of their source are
+skipped, so an interrupted run continues where it stopped, and files that are
+not in the split are removed first, so a folder never holds images of another
+split """
+
+import errno
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MODES = ['copy', 'hardlink', 'reflink', 'symlink']
+
+# ioctl request of Linux that clones the extents of a file (FICLONE in linux/fs.h)
+FICLONE = 0x40049409
+
+# Errors of hardlink and reflink for which the file is copied instead:
+# different filesystems, no support of the filesystem, link count limits
+LINK_ERRORS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EINVAL, errno.EMLINK, errno.EPERM, errno.ENOSYS}
+
+""" This function clones src to dst so that both share their data blocks until
+one of them is written: FICLONE on Linux (btrfs, xfs) and clonefile on macOS (APFS) """
+def reflink(src, dst):
+    if sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), dst)
+        return
+    import fcntl
+    with open(src, 'rb') as source, open(dst, 'wb') as destination:
+        try:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except OSError:
+            destination.close()
+            os.remove(dst)
+            raise
+
+""" This function checks if dst already holds src: it exists and, following
+symlinks, has the size of src """
+def is_materialized(src, dst):
+    try:
+        return os.stat(dst).st_size == os.stat(src).st_size
+    except FileNotFoundError:
+        return False
+
+""" This function materializes one file and returns (bytes, skipped, copied
+instead of linked). Files are created under a temporary name and renamed, so an
+interrupted run does not leave a file that looks complete """
+def materialize_file(src, dst, mode='copy'):
+    if is_materialized(src, dst):
+        return os.stat(src).st_size, True, False
+    size = os.stat(src).st_size
+    partial = dst + '.partial'
+    if os.path.lexists(partial):
+        os.remove(partial)
+    fallback = False
+    try:
+        if mode == 'hardlink':
+            os.link(src, partial)
+        elif mode == 'reflink':
+            reflink(src, partial)
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(src), partial)
+        else:
+            shutil.copyfile(src, partial)
+    except OSError as error:
+        if mode not in ('hardlink', 'reflink') or error.errno not in LINK_ERRORS:
+            raise
+        shutil.copyfile(src, partial)
+        fallback = True
+    os.replace(partial, dst)
+    return size, False, fallback
+
+""" This function removes the files of destination that are not in file_names,
+left by a run with another split, and the temporary files of interrupted runs.
+Returns the number of removed files """
+def remove_stale_files(file_names, destination):
+    kept = {os.path.normpath(file_name) for file_name in file_names}
+    removed = 0
+    for directory, _, files in os.walk(destination):
+        for file in files:
+            path = os.path.join(directory, file)
+            if os.path.normpath(os.path.relpath(path, destination)) not in kept:
+                os.remove(path)
+                removed += 1
+    return removed
+
+""" This function materializes the images file_names of image_directory in
+destination with a pool of workers threads and prints the throughput. Modes
+are copy, hardlink, reflink and symlink; hardlinks and reflinks that the
+filesystem does not support are copied. Files of destination that are not in
+file_names are removed before. Returns a dictionary of counts """
+def materialize_images(file_names, image_directory, destination, mode='copy', workers=8):
+    if mode not in MODES:
+        raise ValueError(f"Unknown materialization mode '{mode}', expected one of {', '.join(MODES)}")
+    os.makedirs(destination, exist_ok=True)
+    removed = remove_stale_files(file_names, destination)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(
+            lambda file_name: materialize_file(os.path.join(image_directory, file_name),
+                                               os.path.join(destination, file_name), mode),
+            file_names))
+    seconds = time.perf_counter() - start
+
+    stats = {
+        'files': len(results),
+        'skipped': sum(skipped for _, skipped, _ in results),
+        'removed': removed,
+        'copied instead of linked': sum(fallback for _, _, fallback in results),
+        'bytes': sum(size for size, skipped, _ in results if not skipped),
+        'seconds': seconds
+    }
+    rate = max(seconds, 1e-9)
+    print(f"{destination}: {stats['files']} images ({mode}), {stats['skipped']} already present, "
+          f"{stats['removed']} not in the split removed, "
+          f"{stats['copied instead of linked']} copied instead of linked, {stats['bytes'] / 1e6:.1f} MB in {seconds:.2f} s "
+          f"({(stats['files'] - stats['skipped']) / rate:.1f} files/s, {stats['bytes'] / 1e6 / rate:.1f} MB/s)")
+    return stats
@@ -1,10 +1,11 @@
 import json
 import os
-import random
-import shutil
-import copy
+import secrets
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
+from coco_stream import filter_coco_streaming
+from materialize import MODES, materialize_images
+
 desired_categories = ["Human hand", "Human head", "Person", "Hat", "Human hair", "Dress", "Human eye", "Building", "Tree", "Animal", "Human mouth"]
 desired_limits = {
     'Person': 13470, 
@@ -85,64 +86,140 @@ def delete_images_not_in_json(image_directory, json_data):
                 os.remove(file_path)
 
 # Function to split the final dataset into train and validation
-def split_dataset(coco_data, split, image_directory, output_directory):  
-    # Shuffle image IDs
+def split_dataset(coco_data, split, image_directory, output_directory, materialize='copy', workers=8,
+                  stratified=False, seed=None, annotation_images=None, annotation_categories=None):
+    # Imported here so that numpy is not loaded by --help
+    from dataset_split import category_train_shares, read_split, split_coco, write_compact_json
+
     images = coco_data['images']
     annotations = coco_data['annotations']
-    random.shuffle(images)
-    split_point = int(len(images) * split)
-    print(f"Total images: {len(images)}, Total annotations: {len(annotations)}, Image split point: {split_point}") # 11260, 44118, 9571
+    train_json = os.path.join(output_directory, 'train_annotations.json')
+    val_json = os.path.join(output_directory, 'val_annotations.json')
+    split_json = os.path.join(output_directory, 'split.json')
+    previous_settings = None
+    if os.path.isfile(split_json):
+        with open(split_json, 'r') as file:
+            previous_settings = json.load(file)
 
-    # Split the image annotations into training and validation sets
-    train_image_annotations = images[:split_point]
-    train_ids = []
-    for _image in train_image_annotations:
-        train_ids.append(_image['id'])
-    val_image_annotations = images[split_point:]
-    val_ids = []
-    for _image in val_image_annotations:
-        val_ids.append(_image['id'])
-
-    # Create new annotation files for training and validation
-    train_data = copy.deepcopy(coco_data)
-    train_data["images"] = [img for img in train_data["images"] if img["id"] in train_ids]
-    train_data["annotations"] = [ann for ann in train_data["annotations"] if ann["image_id"] in train_ids]
+    # Without a seed, the seed of an earlier split with the same settings is reused, else a new one is drawn
+    if seed is None:
+        if previous_settings is not None and previous_settings.get('seed') is not None \
+                and (previous_settings.get('split'), previous_settings.get('stratified')) == (split, stratified):
+            seed = previous_settings['seed']
+        else:
+            seed = secrets.randbits(32)
+    print(f"Split seed: {seed} (stored in {split_json})")
+    settings = {'split': split, 'stratified': stratified, 'seed': seed}
+
+    # A split of the same data with the same settings by an earlier run is kept, so a resumed run materializes the same images
+    previous_split = read_split(coco_data, train_json, val_json) if previous_settings == settings else None
+    if previous_split is not None:
+        print(f"Reusing the split of {train_json} and {val_json}")
+        train_data, val_data = previous_split
+    else:
+        # Split the shuffled images and their annotations into training and validation sets
+        train_data, val_data = split_coco(coco_data, split, stratified=stratified, seed=seed,
+                                          annotation_images=annotation_images, annotation_categories=annotation_categories)
+    split_point = len(train_data['images'])
+    print(f"Total images: {len(images)}, Total annotations: {len(annotations)}, Image split point: {split_point}") # 11260, 44118, 9571
     print (f"Number of train images: {len(train_data['images'])}, Number of train annotations: {len(train_data['annotations'])}") # 9571, ...
-    
-    val_data = copy.deepcopy(coco_data)
-    val_data["images"] = [img for img in val_data["images"] if img["id"] in val_ids]
-    val_data["annotations"] = [ann for ann in val_data["annotations"] if ann["image_id"] in val_ids]
     print (f"Number of validation images: {len(val_data['images'])}, Number of validation annotations: {len(val_data['annotations'])}") # 1689, ...
-    
-    # Save the new annotation files
-    output_train_annotation_file = os.path.join(output_directory, 'train_annotations.json')
-    with open(output_train_annotation_file, 'w') as f:
-        json.dump(train_data, f, indent = 2)
-    
-    output_val_annotation_file = os.path.join(output_directory, 'val_annotations.json')
-    with open(output_val_annotation_file, 'w') as f:
-        json.dump(val_data, f, indent = 2)
-    
-    
-    # Copy images to the respective splits
-    dst_folder_path = os.path.join(output_directory, 'train')
-    os.makedirs(dst_folder_path)
-    for _image in train_data['images']:
-        src_path = os.path.join(image_directory, _image['file_name'])
-        dst_path = os.path.join(dst_folder_path, _image['file_name'])
-        shutil.copy(src_path, dst_path)
-     
-    dst_folder_path = os.path.join(output_directory, 'validation')
-    os.makedirs(dst_folder_path)   
-    for _image in val_data['images']:
-        src_path = os.path.join(image_directory, _image['file_name'])
-        dst_path = os.path.join(dst_folder_path, _image['file_name'])
-        shutil.copy(src_path, dst_path)
+    if stratified:
+        shares = category_train_shares(train_data, val_data)
+        print("Train share of annotations per category: " + ", ".join(f"{name} {share:.3f}" for name, share in shares.items()))
+
+    # Save the new annotation files; the settings go last, so the files of an interrupted run are not reused
+    if previous_split is None:
+        if os.path.isfile(split_json):
+            os.remove(split_json)
+        write_compact_json(train_data, train_json)
+        write_compact_json(val_data, val_json)
+        write_compact_json(settings, split_json)
+
+    # Materialize images of the respective splits
+    materialize_images([_image['file_name'] for _image in train_data['images']], image_directory,
+                       os.path.join(output_directory, 'train'), mode=materialize, workers=workers)
+    materialize_images([_image['file_name'] for _image in val_data['images']], image_directory,
+                       os.path.join(output_directory, 'validation'), mode=materialize, workers=workers)
+
+
+""" This function filters the annotation file like main does without loading it:
+categories are filtered with the categories of the annotation store of
+input_json in store_directory, and annotations are selected on the arrays of
+the store, the first of every category or by greedy selection. Only the
+selected annotations and images are then read from input_json. Annotations
+whose image is not in the file are left out. Returns the filtered data and the
+image index and category id of every annotation of it, taken from the store """
+def filter_with_annotation_store(input_json, store_directory, image_directory, selection='first', selection_weight='images', seed=0):
+    import numpy as np
+    from annotation_store import AnnotationStore
+    from coco_stream import read_coco_rows
+    from subset_selection import image_file_sizes, select_annotations
+
+    store = AnnotationStore.open(input_json, store_directory)
+    filtered_categories = [dict(category) for category in store.categories if category["name"] in desired_categories]
+    category_id_mapping = {category["id"]: index + 1 for index, category in enumerate(filtered_categories)}
+
+    # Limits go to the first category of every name, as get_category_id finds it
+    limits = {}
+    names = {}
+    for name, limit in desired_limits.items():
+        category_id = next((category["id"] for category in filtered_categories if category["name"] == name), None)
+        if category_id is None:
+            print(f"Category '{name}' not found in the JSON.")
+        elif category_id not in limits:
+            limits[category_id] = limit
+            names[category_id] = name
+
+    # Column of every annotation of the file in limits, -1 for other categories
+    annotation_images, annotation_categories = store.rows()
+    columns = np.full(store.n_rows, -1, dtype=np.int64)
+    for column, category_id in enumerate(limits):
+        columns[annotation_categories == category_id] = column
+
+    if selection == 'greedy':
+        # Images are numbered among the images of the filtered categories, as in the filtered json data
+        filtered_images = np.unique(annotation_images[np.isin(annotation_categories, list(category_id_mapping)) & (annotation_images >= 0)])
+        image_numbers = np.full(store.n_images + 1, -1, dtype=np.int64)
+        image_numbers[filtered_images] = np.arange(len(filtered_images))
+        sizes = None
+        if image_directory is not None:
+            file_names = store.file_names()
+            sizes = image_file_sizes([file_names[image] for image in filtered_images.tolist()], image_directory)
+        selected, kept = select_annotations(len(filtered_images), image_numbers[annotation_images], columns, list(limits.values()),
+                                            list(names.values()), sizes, selection_weight, seed)
+        kept = filtered_images[kept]
+    else:
+        selected = []
+        for column, limit in enumerate(limits.values()):
+            selected.extend(np.flatnonzero(columns == column)[:limit].tolist())
+        kept = np.unique(annotation_images[selected]) if selected else np.zeros(0, dtype=np.int64)
+
+    json_data = read_coco_rows(input_json, {'annotations': selected, 'images': kept.tolist()})
+    for annotation in json_data["annotations"]:
+        annotation["category_id"] = category_id_mapping[annotation["category_id"]]
+    for category in filtered_categories:
+        category["id"] = category_id_mapping[category["id"]]
+    json_data["categories"] = filtered_categories
 
+    # Image index and new category id of every selected annotation in json_data, for split_dataset
+    selected = np.asarray(selected, dtype=np.int64)
+    split_images = np.searchsorted(kept, annotation_images[selected])
+    split_categories = np.array([category_id_mapping[category_id] for category_id in annotation_categories[selected].tolist()], dtype=np.int64)
+    return json_data, split_images, split_categories
 
 def main(input_json = '/Volumes/Samsung_USB/coco-dataset/labels.json', 
          input_images = '/Volumes/SAMSUNG_USB/coco-dataset/data',
-         output_directory = '/Volumes/SAMSUNG_USB/thesis-dataset'
+         output_directory = '/Volumes/SAMSUNG_USB/thesis-dataset',
+         streaming = False,
+         materialize = 'copy',
+         workers = 8,
+         stratified = False,
+         seed = None,
+         selection = 'first',
+         selection_weight = 'images',
+         selection_seed = 0,
+         annotation_store = None
          ):
     
     param_dict = {
@@ -158,58 +235,102 @@ def main(input_json = '/Volumes/Samsung_USB/coco-dataset/labels.json',
     # Directory to store modified annotation files (annotations.json, train_annotations.json, validation_annotations.json)
     output_directory = param_dict['output_diretory']
     
-    # Load the JSON file with all anotations
-    with open(input_json, 'r') as file:
-        json_data = json.load(file)
+    if streaming and selection != 'first':
+        raise ValueError("--selection greedy needs all annotations and cannot be combined with --streaming, use --annotation_store instead")
+    if streaming and annotation_store is not None:
+        raise ValueError("--streaming and --annotation_store are two ways to filter the annotation file, choose one")
 
-    # Filter categories 
-    filtered_categories = [category for category in json_data["categories"] if category["name"] in desired_categories]
-    category_id_mapping = {category["id"]: index + 1 for index, category in enumerate(filtered_categories)}
-    for category in filtered_categories:
-        category["id"] = category_id_mapping[category["id"]]
+    output_json = os.path.join(output_directory, 'annotations.json')
+    # Without the annotation store, split_dataset maps annotations to images itself
+    annotation_images = annotation_categories = None
+    if annotation_store is not None:
+        modified_json, annotation_images, annotation_categories = filter_with_annotation_store(
+            input_json, annotation_store, input_images, selection, selection_weight, selection_seed)
+        with open(output_json, 'w') as file:
+            json.dump(modified_json, file, indent=2)
+    elif streaming:
+        # Filter the annotation file in one pass with spool files next to the output
+        n_images, n_annotations = filter_coco_streaming(input_json, output_json, desired_categories, desired_limits,
+                                                        spool_directory=output_directory)
+        print(f"Filtered annotations: {n_images} images, {n_annotations} annotations")
+        with open(output_json, 'r') as file:
+            modified_json = json.load(file)
+    else:
+        # Load the JSON file with all anotations
+        with open(input_json, 'r') as file:
+            json_data = json.load(file)
 
-    # Filter annotations and update category IDs
-    filtered_annotations = [annotation for annotation in json_data["annotations"] if annotation["category_id"] in category_id_mapping]
-    for annotation in filtered_annotations:
-        annotation["category_id"] = category_id_mapping[annotation["category_id"]]
+        # Filter categories 
+        filtered_categories = [category for category in json_data["categories"] if category["name"] in desired_categories]
+        category_id_mapping = {category["id"]: index + 1 for index, category in enumerate(filtered_categories)}
+        for category in filtered_categories:
+            category["id"] = category_id_mapping[category["id"]]
 
-    valid_image_ids = set(annotation["image_id"] for annotation in filtered_annotations)
-    # Filter images
-    filtered_images = [image for image in json_data["images"] if image["id"] in valid_image_ids]
+        # Filter annotations and update category IDs
+        filtered_annotations = [annotation for annotation in json_data["annotations"] if annotation["category_id"] in category_id_mapping]
+        for annotation in filtered_annotations:
+            annotation["category_id"] = category_id_mapping[annotation["category_id"]]
 
-    # Update categories, annotations, and images in the JSON data
-    json_data["categories"] = filtered_categories
-    json_data["annotations"] = filtered_annotations
-    json_data["images"] = filtered_images
+        valid_image_ids = set(annotation["image_id"] for annotation in filtered_annotations)
+        # Filter images
+        filtered_images = [image for image in json_data["images"] if image["id"] in valid_image_ids]
 
-    # Function to modify the number of instances per category 
-    modified_json = modify_json(json_data, desired_limits)
+        # Update categories, annotations, and images in the JSON data
+        json_data["categories"] = filtered_categories
+        json_data["annotations"] = filtered_annotations
+        json_data["images"] = filtered_images
 
-    output_json = os.path.join(output_directory, 'annotations.json')
-    with open(output_json, 'w') as file:
-        json.dump(modified_json, file, indent=2)
+        # Function to modify the number of instances per category 
+        if selection == 'greedy':
+            from subset_selection import select_image_subset
+            modified_json = select_image_subset(json_data, desired_limits, input_images, selection_weight, selection_seed)
+        else:
+            modified_json = modify_json(json_data, desired_limits)
+
+        with open(output_json, 'w') as file:
+            json.dump(modified_json, file, indent=2)
 
     # Function to delete images that are not in the modified json annotation file
     delete_images_not_in_json(input_images, modified_json)
     print("Images filtered")
     print("Splitting dataset...")
     
-    split_dataset(modified_json, 0.85, input_images, output_directory)
-    
-    
-if __name__ == "__main__":
-    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    split_dataset(modified_json, 0.85, input_images, output_directory, materialize, workers, stratified, seed,
+                  annotation_images, annotation_categories)
+
+""" This function adds the command line arguments of main to parser """
+def add_arguments(parser):
     parser.add_argument('--input_json', type=str,
                            default='/Volumes/Samsung_USB/coco-dataset/labels.json',
                            help='original json annotation file')
     parser.add_argument('--input_images', type=str,
                            default='/Volumes/SAMSUNG_USB/coco-dataset/data',
-                           help='original image directory to be updated'),
+                           help='original image directory to be updated')
     parser.add_argument('--output_directory', type=str,
                            default='/Volumes/SAMSUNG_USB/thesis-dataset',
                            help='directory to store modified json annotation files (annotations.json, train_annotations.json, validation_annotations.json) and train and validation images')
-    args = parser.parse_args()
-    main(**dict(args._get_kwargs()))
-    
+    parser.add_argument('--streaming', action='store_true',
+                           help='filter the json annotation file in one streaming pass with bounded memory instead of loading it')
+    parser.add_argument('--materialize', type=str, choices=MODES, default='copy',
+                           help='how images are put into the train and validation folders; images already there with the same size are skipped and other files of the folders are removed')
+    parser.add_argument('--workers', type=int, default=8,
+                           help='number of threads that materialize images')
+    parser.add_argument('--stratified', action='store_true',
+                           help='split so that every category keeps the train/validation ratio of its annotations')
+    parser.add_argument('--seed', type=int, default=None,
+                           help='seed of the train/validation shuffle; without it a seed is drawn, or the one in split.json of the output directory is reused, so an interrupted run resumes its split')
+    parser.add_argument('--selection', type=str, choices=['first', 'greedy'], default='first',
+                           help='keep the images of the first desired_limits annotations of every category, or choose few images that fill the limits by greedy set cover')
+    parser.add_argument('--selection_weight', type=str, choices=['images', 'bytes'], default='images',
+                           help='what greedy selection minimizes: the number of images or their total file size')
+    parser.add_argument('--selection_seed', type=int, default=0,
+                           help='seed of ties in greedy selection, fixed so that the same input gives the same selection')
+    parser.add_argument('--annotation_store', type=str, default=None,
+                           help='directory of a columnar store of the json annotation file, built on first use; annotations are selected on its arrays, only the selected ones are read from the json file, and the split maps them to images and categories with the store arrays instead of the json dicts')
+    return parser
 
 
+if __name__ == "__main__":
+    parser = add_arguments(ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter))
+    args = parser.parse_args()
+    main(**dict(args._get_kwargs()))
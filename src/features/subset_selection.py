@@ -0,0 +1,134 @@
+""" Contains the image subset selection of prepare_dataset.py: instead of the
+images of the first desired_limits annotations of every category, a greedy
+weighted set cover chooses few images whose annotations fill the quota of
+every category """
+
+import heapq
+import os
+import numpy as np
+
+from dataset_split import annotation_image_indices
+
+""" This function returns the column of every annotation for the category ids
+in category_ids, in that column order (-1 for other categories) """
+def category_columns(annotation_categories, category_ids):
+    column_of = {category_id: column for column, category_id in enumerate(category_ids)}
+    return np.fromiter((column_of.get(category_id, -1) for category_id in annotation_categories),
+                       dtype=np.int64, count=len(annotation_categories))
+
+""" This function returns the (images, categories) matrix of annotation counts """
+def quota_count_matrix(n_images, annotation_images, columns, n_categories):
+    counts = np.zeros((n_images, n_categories), dtype=np.int64)
+    valid = (annotation_images >= 0) & (columns >= 0)
+    np.add.at(counts, (annotation_images[valid], columns[valid]), 1)
+    return counts
+
+""" This function chooses images by lazy greedy weighted set cover. The gain of
+an image is the number of its annotations that still count towards the
+quotas, divided by its cost; gains only decrease as quotas fill, so an image
+popped from the heap is taken if its recomputed gain still beats the next
+one. Ties are broken by a permutation seeded with seed. Returns the indices of
+the chosen images in the order they were chosen and the quotas left unfilled """
+def greedy_image_cover(counts, quotas, costs, seed=0):
+    remaining = np.asarray(quotas, dtype=np.int64).copy()
+    rank = np.random.default_rng(seed).permutation(len(counts))
+    gains = np.minimum(counts, remaining).sum(axis=1) / costs
+    candidates = np.flatnonzero(gains > 0)
+    heap = list(zip((-gains[candidates]).tolist(), rank[candidates].tolist(), candidates.tolist()))
+    heapq.heapify(heap)
+
+    chosen = []
+    while heap and remaining.any():
+        _, image_rank, image = heapq.heappop(heap)
+        covered = np.minimum(counts[image], remaining)
+        gain = covered.sum() / costs[image]
+        if gain <= 0:
+            continue
+        if heap and gain < -heap[0][0]:
+            heapq.heappush(heap, (-gain, image_rank, image))
+            continue
+        chosen.append(image)
+        remaining -= covered
+    return np.array(chosen, dtype=np.int64), remaining
+
+""" This function returns the sizes of the files file_names in image_directory,
+0 for missing files """
+def image_file_sizes(file_names, image_directory):
+    sizes = np.zeros(len(file_names), dtype=np.int64)
+    for index, file_name in enumerate(file_names):
+        try:
+            sizes[index] = os.stat(os.path.join(image_directory, file_name)).st_size
+        except OSError:
+            pass
+    return sizes
+
+""" This function selects annotations from an image subset chosen by
+greedy_image_cover. annotation_images holds the image index of every annotation
+(-1 if unknown) and columns its index in limits and names (-1 for other
+categories), in the order of the annotation file. Images are weighted by 1
+(fewest images) or by their size in sizes (fewest bytes). For every category,
+the annotations of the chosen images are kept in the order the images were
+chosen, up to its limit. Prints the images and bytes saved against the images
+of the first annotations of every category. Returns the indices of the kept
+annotations, grouped by category, and of their images """
+def select_annotations(n_images, annotation_images, columns, limits, names, sizes=None, weight='images', seed=0):
+    counts = quota_count_matrix(n_images, annotation_images, columns, len(limits))
+    available = counts.sum(axis=0)
+    quotas = np.minimum(np.array(limits, dtype=np.int64), available)
+    costs = np.maximum(sizes, 1).astype(np.float64) if weight == 'bytes' and sizes is not None else np.ones(n_images)
+    chosen, _ = greedy_image_cover(counts, quotas, costs, seed)
+
+    choice_rank = np.full(n_images + 1, n_images, dtype=np.int64)
+    choice_rank[chosen] = np.arange(len(chosen))
+    # Annotations of unknown images get the last rank through index -1
+    annotation_rank = choice_rank[annotation_images]
+    selected = []
+    for column, limit in enumerate(limits):
+        candidates = np.flatnonzero((columns == column) & (annotation_rank < n_images))
+        selected.extend(candidates[np.argsort(annotation_rank[candidates], kind='stable')][:limit].tolist())
+
+    # Images of the first annotations of every category, as modify_json selects them
+    first = set()
+    for column, limit in enumerate(limits):
+        first.update(annotation_images[np.flatnonzero(columns == column)[:limit]].tolist())
+    first.discard(-1)
+    first = np.array(sorted(first), dtype=np.int64)
+    kept = np.unique(annotation_images[selected]) if selected else np.zeros(0, dtype=np.int64)
+    report = (f"Selected {len(kept)} images instead of {len(first)} images of the first annotations of every category: "
+              f"{100 * (1 - len(kept) / max(len(first), 1)):.1f}% fewer images")
+    if sizes is not None:
+        report += (f", {sizes[kept].sum() / 1e6:.1f} MB instead of {sizes[first].sum() / 1e6:.1f} MB: "
+                   f"{100 * (1 - sizes[kept].sum() / max(sizes[first].sum(), 1)):.1f}% fewer bytes")
+    print(report)
+    for name, limit, count in zip(names, limits, available.tolist()):
+        if count < limit:
+            print(f"Category '{name}' has {count} annotations, fewer than its limit {limit}")
+    return selected, kept
+
+""" This function selects annotations like modify_json does, but from an image
+subset chosen by select_annotations; file sizes for weight 'bytes' and the
+report are read from image_directory. Returns json_data with the selected
+annotations and images """
+def select_image_subset(json_data, desired_limits, image_directory=None, weight='images', seed=0):
+    images = json_data['images']
+    annotations = json_data['annotations']
+    # Limits go to the first category of every name, as get_category_id finds it
+    limits = {}
+    names = {}
+    for name, limit in desired_limits.items():
+        category_id = next((category['id'] for category in json_data['categories'] if category['name'] == name), None)
+        if category_id is None:
+            print(f"Category '{name}' not found in the JSON.")
+        elif category_id not in limits:
+            limits[category_id] = limit
+            names[category_id] = name
+
+    annotation_images = annotation_image_indices(images, annotations)
+    columns = category_columns([annotation['category_id'] for annotation in annotations], list(limits))
+    sizes = image_file_sizes([image['file_name'] for image in images], image_directory) if image_directory is not None else None
+    selected, kept = select_annotations(len(images), annotation_images, columns, list(limits.values()),
+                                        list(names.values()), sizes, weight, seed)
+
+    json_data['annotations'] = [annotations[index] for index in selected]
+    json_data['images'] = [images[index] for index in kept]
+    return json_data
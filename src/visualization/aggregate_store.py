@@ -0,0 +1,70 @@
+""" Contains the store of per-participant aggregates used by the incremental
+mode of create_heatmap. Every participant heatmap is kept as a json file with
+the state of its csv file and its per-painting results """
+
+import json
+import os
+
+# Per-painting values that are only needed for plotting and are not stored
+GAZE_KEYS = ('x_coordinates', 'y_coordinates', 'duration_arr')
+
+""" This class keeps the aggregates of every participant in store_dir. An entry is
+fresh while the modification time and size of its csv file and the settings of the
+run (annotation file, attribution mode, paintings) are unchanged """
+class AggregateStore:
+    def __init__(self, store_dir, settings):
+        self.store_dir = store_dir
+        self.settings = settings
+        os.makedirs(store_dir, exist_ok=True)
+
+        # Entries made with other settings are dropped
+        settings_file = os.path.join(store_dir, 'settings.json')
+        stored_settings = None
+        if os.path.isfile(settings_file):
+            with open(settings_file, 'r') as file:
+                stored_settings = json.load(file)
+        if stored_settings != settings:
+            for path in os.listdir(store_dir):
+                if path.endswith('.json'):
+                    os.remove(os.path.join(store_dir, path))
+            with open(settings_file, 'w') as file:
+                json.dump(settings, file, indent=2)
+
+    def path(self, file_csv):
+        name = os.path.splitext(os.path.basename(file_csv))[0]
+        return os.path.join(self.store_dir, f'participant-{name}.json')
+
+    def source_state(self, file_csv):
+        stat = os.stat(file_csv)
+        return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+    """ Returns the stored aggregates of a participant, or None if the csv file is new or changed """
+    def load(self, file_csv):
+        path = self.path(file_csv)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as file:
+            entry = json.load(file)
+        if entry['source'] != self.source_state(file_csv):
+            return None
+        return entry['participant_result']
+
+    """ Stores the aggregates of a participant without the gaze points """
+    def save(self, file_csv, participant_result):
+        paintings = [{key: value for key, value in painting.items() if key not in GAZE_KEYS}
+                     for painting in participant_result['paintings']]
+        entry = {
+            'source': self.source_state(file_csv),
+            'participant_result': dict(participant_result, paintings=paintings)
+        }
+        path = self.path(file_csv)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(entry, file)
+        os.replace(path + '.tmp', path)
+
+    """ Removes stored participants whose csv file is no longer in files """
+    def prune(self, files):
+        keep = {os.path.basename(self.path(file_csv)) for file_csv in files}
+        for path in os.listdir(self.store_dir):
+            if path.startswith('participant-') and path.endswith('.json') and path not in keep:
+                os.remove(os.path.join(self.store_dir, path))
@@ -0,0 +1,200 @@
+""" Contains functions that rasterize ground truth bounding boxes onto the
+heatmap grid of a painting, so gaze attribution becomes a lookup. Boxes are
+rasterized as category bitmasks for point attribution and as summed-area
+tables for area-weighted attribution """
+
+import os
+import numpy as np
+
+from config import CLASSES
+from map_coordinates import summarize_gaze_durations
+from profiler import PROFILER
+
+# One bit per entry in CLASSES
+RASTER_DTYPE = np.uint16 if len(CLASSES) <= 16 else np.uint32
+
+""" This function rasterizes the bounding boxes of one painting into a grid of
+category bitmasks. Cell (b, c) of the grid holds the categories of all boxes that
+contain the gaze point (scale_width * (c + 1), scale_height * (b + 1)), the same
+point create_heatmap tests for the heatmap cell """
+def rasterize_boxes(boxes_category_dict, painting_width, painting_height, grid_shape=(100, 100)):
+    rows, cols = grid_shape
+    scale_width = painting_width / 100
+    scale_height = painting_height / 100
+    cell_x = scale_width * np.arange(1, cols + 1)
+    cell_y = scale_height * np.arange(1, rows + 1)
+
+    raster = np.zeros(grid_shape, dtype=RASTER_DTYPE)
+    for category, bounding_boxes in boxes_category_dict.items():
+        bit = RASTER_DTYPE(1 << CLASSES.index(category))
+        for box in bounding_boxes:
+            x_min, y_min, width, height = box
+            in_x = (cell_x >= x_min) & (cell_x <= x_min + width)
+            in_y = (cell_y >= y_min) & (cell_y <= y_min + height)
+            raster[np.ix_(in_y, in_x)] |= bit
+    return raster
+
+""" This function builds summed-area tables of the category box unions of one
+painting on a grid with subdivisions x subdivisions cells per heatmap cell. The grid
+starts at the top left corner of the painting and has one extra heatmap cell per
+axis, because gaze point (scale_width * (c + 1), scale_height * (b + 1)) lies on the
+right and bottom edge of the painting for the last heatmap cell. Returns the
+category names and an int32 array of shape (categories + 1, rows + 1, cols + 1),
+where the last table is the union of all boxes """
+def build_summed_area_tables(boxes_category_dict, painting_width, painting_height, grid_shape=(100, 100), subdivisions=4):
+    rows, cols = grid_shape
+    step_x = painting_width / 100 / subdivisions
+    step_y = painting_height / 100 / subdivisions
+    fine_rows = (rows + 1) * subdivisions
+    fine_cols = (cols + 1) * subdivisions
+    # A fine cell is covered by a box if its centre is inside the box
+    cell_x = step_x * (np.arange(fine_cols) + 0.5)
+    cell_y = step_y * (np.arange(fine_rows) + 0.5)
+
+    categories = [category for category in CLASSES if category in boxes_category_dict]
+    coverage = np.zeros((len(categories) + 1, fine_rows, fine_cols), dtype=bool)
+    for index, category in enumerate(categories):
+        for box in boxes_category_dict[category]:
+            x_min, y_min, width, height = box
+            in_x = (cell_x >= x_min) & (cell_x <= x_min + width)
+            in_y = (cell_y >= y_min) & (cell_y <= y_min + height)
+            coverage[index][np.ix_(in_y, in_x)] = True
+    coverage[-1] = coverage[:-1].any(axis=0)
+
+    tables = np.zeros((len(categories) + 1, fine_rows + 1, fine_cols + 1), dtype=np.int32)
+    tables[:, 1:, 1:] = coverage.cumsum(axis=1, dtype=np.int32).cumsum(axis=2, dtype=np.int32)
+    return categories, tables
+
+""" This class keeps the rasters of all paintings so they are built once per
+run and shared by all participants. Rasters are keyed by painting, annotation
+file hash, painting size and grid shape; with cache_dir set they are also
+stored as .npy files and reused by later runs """
+class AOIRasterCache:
+    def __init__(self, annotation_hash, cache_dir=None, subdivisions=4):
+        self.annotation_hash = annotation_hash
+        self.cache_dir = cache_dir
+        self.subdivisions = subdivisions
+        self.rasters = {}
+        self.summed_area_tables = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, painting_name, boxes_category_dict, painting_width, painting_height, grid_shape=(100, 100)):
+        key = (painting_name, self.annotation_hash, painting_width, painting_height, tuple(grid_shape))
+        raster = self.rasters.get(key)
+        if raster is not None:
+            return raster
+
+        cache_file = None
+        if self.cache_dir is not None:
+            cache_file = os.path.join(self.cache_dir, '{}-{}-{}x{}-{}x{}.npy'.format(
+                painting_name, self.annotation_hash[:16], painting_width, painting_height, *grid_shape))
+            if os.path.isfile(cache_file):
+                raster = np.load(cache_file)
+
+        if raster is None:
+            PROFILER.count('rasters built')
+            raster = rasterize_boxes(boxes_category_dict, painting_width, painting_height, grid_shape)
+            if cache_file is not None:
+                # Workers of a process pool may build the same raster, so write it atomically
+                temporary_file = f'{cache_file}.{os.getpid()}.tmp'
+                with open(temporary_file, 'wb') as file:
+                    np.save(file, raster)
+                os.replace(temporary_file, cache_file)
+
+        self.rasters[key] = raster
+        return raster
+
+    """ Returns the categories and summed-area tables of a painting, built once per run """
+    def get_summed_area_tables(self, painting_name, boxes_category_dict, painting_width, painting_height, grid_shape=(100, 100)):
+        key = (painting_name, self.annotation_hash, painting_width, painting_height, tuple(grid_shape))
+        if key not in self.summed_area_tables:
+            PROFILER.count('summed-area tables built')
+            self.summed_area_tables[key] = build_summed_area_tables(
+                boxes_category_dict, painting_width, painting_height, grid_shape, self.subdivisions)
+        return self.summed_area_tables[key]
+
+""" This function attributes gaze durations with a precomputed raster. gaze_rows
+and gaze_cols are the grid cells of the gaze points. A cell covered by several
+boxes of the same category counts once for that category. Returns the same values
+as calculate_gaze_duration_in_objects """
+def attribute_gaze_with_raster(gaze_rows, gaze_cols, durations, raster):
+    durations = np.asarray(durations, dtype=float)
+    PROFILER.count('points tested', len(durations))
+    labels = raster[gaze_rows, gaze_cols]
+    point_mask = labels != 0
+
+    first_hit = []
+    for index, category in enumerate(CLASSES):
+        category_mask = (labels >> index) & 1 == 1
+        hit_points = np.flatnonzero(category_mask)
+        if len(hit_points) != 0:
+            total = float(np.cumsum(durations[category_mask])[-1])
+            first_hit.append((hit_points[0], index, category, total))
+
+    # Categories in order of the first gaze point that hits them
+    first_hit.sort()
+    object_duration_dict = {category: total for _, _, category, total in first_hit}
+    return summarize_gaze_durations(durations, point_mask, object_duration_dict)
+
+""" This function looks up summed-area tables at fractional fine grid corners.
+Fine cells are covered as a whole, so the covered area grows linearly inside a
+cell and the bilinear interpolation of the tables weights partial boundary cells
+by the part of them inside the gaze area """
+def summed_area_at(tables, rows, cols):
+    row = np.minimum(np.floor(rows).astype(int), tables.shape[1] - 2)
+    col = np.minimum(np.floor(cols).astype(int), tables.shape[2] - 2)
+    row_weight = rows - row
+    col_weight = cols - col
+    return ((1 - row_weight) * (1 - col_weight) * tables[:, row, col] + (1 - row_weight) * col_weight * tables[:, row, col + 1]
+            + row_weight * (1 - col_weight) * tables[:, row + 1, col] + row_weight * col_weight * tables[:, row + 1, col + 1])
+
+""" This function splits the duration of every gaze point by the fraction of its
+area that overlaps each category's box union. The area of a gaze point is the
+square of side 2 * radius around it, looked up in O(1) per category with the
+summed-area tables of build_summed_area_tables. A gaze point counts as inside
+objects with the fraction covered by any box and as outside with the rest, so
+averages are weighted by these fractions. Returns values in the format of
+calculate_gaze_duration_in_objects """
+def attribute_gaze_by_area(gaze_rows, gaze_cols, durations, summed_area_tables, radius, painting_width, painting_height, subdivisions=4):
+    categories, tables = summed_area_tables
+    durations = np.asarray(durations, dtype=float)
+    PROFILER.count('points tested', len(durations))
+    step_x = painting_width / 100 / subdivisions
+    step_y = painting_height / 100 / subdivisions
+    gaze_x = painting_width / 100 * (np.asarray(gaze_cols) + 1)
+    gaze_y = painting_height / 100 * (np.asarray(gaze_rows) + 1)
+
+    # Corners of the gaze areas on the fine grid, at least one fine cell wide
+    half_x = max(radius, step_x / 2) / step_x
+    half_y = max(radius, step_y / 2) / step_y
+    col_0 = np.clip(gaze_x / step_x - half_x, 0, tables.shape[2] - 1)
+    col_1 = np.clip(gaze_x / step_x + half_x, 0, tables.shape[2] - 1)
+    row_0 = np.clip(gaze_y / step_y - half_y, 0, tables.shape[1] - 1)
+    row_1 = np.clip(gaze_y / step_y + half_y, 0, tables.shape[1] - 1)
+    area = (col_1 - col_0) * (row_1 - row_0)
+    covered = (summed_area_at(tables, row_1, col_1) - summed_area_at(tables, row_0, col_1)
+               - summed_area_at(tables, row_1, col_0) + summed_area_at(tables, row_0, col_0))
+    fractions = np.divide(covered, area, out=np.zeros_like(covered), where=area > 0)
+
+    in_fraction = fractions[-1]
+    out_fraction = 1 - in_fraction
+    first_hit = []
+    for index, category in enumerate(categories):
+        hit_points = np.flatnonzero(fractions[index] > 0)
+        if len(hit_points) != 0:
+            first_hit.append((hit_points[0], CLASSES.index(category), category, float(np.sum(durations * fractions[index]))))
+    # Categories in order of the first gaze point that overlaps them
+    first_hit.sort()
+    object_duration_dict = {category: total for _, _, category, total in first_hit}
+
+    total_duration_in_objects = float(np.sum(durations * in_fraction))
+    total_duration_outside_objects = float(np.sum(durations * out_fraction))
+    count_objects = float(np.sum(in_fraction))
+    count_no_objects = float(np.sum(out_fraction))
+    average_duration_in_objects = total_duration_in_objects/count_objects if count_objects != 0 else 0
+    average_duration_ouside_objects = total_duration_outside_objects/count_no_objects if count_no_objects != 0 else 0
+    max_duration_in_objects = float(durations[in_fraction > 0].max()) if np.any(in_fraction > 0) else 0
+    max_duration_outside_objects = float(durations[out_fraction > 0].max()) if np.any(out_fraction > 0) else 0
+
+    return total_duration_in_objects, total_duration_outside_objects, average_duration_in_objects, average_duration_ouside_objects, max_duration_in_objects, max_duration_outside_objects, object_duration_dict
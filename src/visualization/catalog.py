@@ -0,0 +1,73 @@
+""" Contains the catalog that maps paintings to their ground truth boxes
+and to their blocks in the participant heatmaps """
+
+from config import CLASSES
+
+""" This class is built once per run from the COCO annotation file. It maps
+painting name -> image ids -> bounding boxes grouped by category, and maps
+heatmap block names to paintings, so all lookups in the participant loop
+are dictionary lookups """
+class PaintingCatalog:
+    def __init__(self, json_data, painting_names):
+        self.painting_names = list(painting_names)
+
+        # Group annotations by image once instead of scanning them per painting
+        annotations_by_image = {}
+        for annotation in json_data["annotations"]:
+            annotations_by_image.setdefault(annotation["image_id"], []).append(annotation)
+
+        self.image_ids = {}
+        self.boxes_category = {}
+        for painting_name in self.painting_names:
+            image_ids = [image["id"] for image in json_data["images"] if image["file_name"].startswith(painting_name)]
+            # Maps categories to lists of bounding boxes associated with each category
+            boxes_category_dict = {}
+            for image_id in image_ids:
+                for annotation in annotations_by_image.get(image_id, []):
+                    category = CLASSES[annotation["category_id"]]
+                    boxes_category_dict.setdefault(category, []).append(annotation["bbox"])
+            self.image_ids[painting_name] = image_ids
+            self.boxes_category[painting_name] = boxes_category_dict
+
+    """ Builds the catalog from an AnnotationStore (features/annotation_store.py)
+    instead of json data: the images of a painting are found by binary search in
+    the sorted file names and their boxes are slices of the store arrays """
+    @classmethod
+    def from_annotation_store(cls, store, painting_names):
+        catalog = cls.__new__(cls)
+        catalog.painting_names = list(painting_names)
+        catalog.image_ids = {}
+        catalog.boxes_category = {}
+        for painting_name in catalog.painting_names:
+            images = store.images_with_prefix(painting_name)
+            boxes_category_dict = {}
+            for image in images.tolist():
+                annotations = store.annotations_of(image)
+                for category_id, box in zip(store.category_id[annotations].tolist(), store.bbox[annotations].tolist()):
+                    boxes_category_dict.setdefault(CLASSES[category_id], []).append(box)
+            catalog.image_ids[painting_name] = store.image_id[images].tolist()
+            catalog.boxes_category[painting_name] = boxes_category_dict
+        return catalog
+
+    """ Returns the bounding boxes of a painting grouped by category """
+    def boxes(self, painting_name):
+        return self.boxes_category.get(painting_name, {})
+
+    """ Returns a dictionary that maps painting names to the index of their
+    block in a participant heatmap. block_names are the names in the first cell
+    of each block; a block belongs to the first painting name it starts with """
+    def heatmap_blocks(self, block_names):
+        first_block = {}
+        for index, block_name in enumerate(block_names):
+            first_block.setdefault(block_name, index)
+
+        blocks = {}
+        for painting_name in self.painting_names:
+            if painting_name in first_block:
+                blocks[painting_name] = first_block[painting_name]
+                continue
+            for index, block_name in enumerate(block_names):
+                if block_name.startswith(painting_name):
+                    blocks[painting_name] = index
+                    break
+        return blocks
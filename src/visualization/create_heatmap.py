@@ -2,24 +2,39 @@
 the calculations for statistical analysis and heatmaps
 '''
 
+import contextlib
 import numpy as np
-import pandas as pd 
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
 import json
 import os
+import sys
 import glob
 import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
-from map_coordinates import calculate_gaze_duration_in_objects, find_most_viewed_object_ind, find_most_viewed_object_group
-from stat_analysis import calculate_significance, perform_one_way_anova
-from utils import normalize_colors, modify_csv
+from map_coordinates import calculate_gaze_duration_in_objects_vectorized, find_most_viewed_object_ind, find_most_viewed_object_group
+from catalog import PaintingCatalog
+from aoi_raster import AOIRasterCache, attribute_gaze_with_raster, attribute_gaze_by_area
+from heatmap_cache import HeatmapCache
+from heatmap_reader import read_heatmaps
+from painting_store import PaintingStore
+from aggregate_store import AggregateStore
+from results_writer import ResultsWriter
+from utils import normalize_colors, file_hash
 from config import CLASSES
+from profiler import PROFILER
+
+# Gaze durations are kept in double precision so reported values do not change
+HEATMAP_DTYPE = np.float64
 
 # This function plots the heatmap overlay
 def plot_heatmap(painting_img, x_coordinates, y_coordinates, duration_arr, my_colormap, radius):
+    # matplotlib and the statistics modules are imported where they are used, so runs
+    # that only calculate metrics start quickly
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import ListedColormap
+
     fig, ax = plt.subplots() # Create axes
     ax.imshow(painting_img)  # Display the painting image
     cmap = ListedColormap(my_colormap)
@@ -29,14 +44,152 @@ def plot_heatmap(painting_img, x_coordinates, y_coordinates, duration_arr, my_co
         ax.add_patch(circle)
     
     norm = plt.Normalize(min(duration_arr), max(duration_arr)) # Linearly normalizes data into the [0.0, 1.0] interval
-    cbar = plt.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap))
+    cbar = plt.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap), ax=ax)
     
     cbar.set_label('Duration of eye gaze')
     plt.show()
+    plt.close(fig) # Release the figure once the window is closed
+
+# Data shared by all participants, set once per process by init_participant_worker
+_worker_state = {}
+
+""" This function stores the read-only data shared by all participants in the 
+current process. With a process pool it runs once per worker, not once per participant, 
+and profile enables the profiler of the worker """
+def init_participant_worker(test_images, painting_sizes, catalog, attribution, raster_cache, heatmap_cache, profile=False):
+    if profile:
+        PROFILER.enable()
+    _worker_state['test_images'] = test_images
+    _worker_state['painting_sizes'] = painting_sizes
+    _worker_state['catalog'] = catalog
+    _worker_state['attribution'] = attribution
+    _worker_state['raster_cache'] = raster_cache
+    # Parsed heatmaps are loaded from a memory-mapped binary cache when it is up to date
+    if heatmap_cache is not None:
+        _worker_state['load_heatmaps'] = HeatmapCache(heatmap_cache, dtype=HEATMAP_DTYPE).load
+    else:
+        _worker_state['load_heatmaps'] = partial(read_heatmaps, dtype=HEATMAP_DTYPE)
+
+""" This function reads the heatmap of one participant and calculates gaze durations 
+within and outside objects for every painting. It does not print, so participants 
+can be analyzed in parallel and reported in order """
+def analyze_participant(file_csv):
+    test_images = _worker_state['test_images']
+    catalog = _worker_state['catalog']
+    attribution = _worker_state['attribution']
+    raster_cache = _worker_state['raster_cache']
+
+    csv_name_without_extension = os.path.splitext(os.path.basename(file_csv))[0]
+    participant__num = csv_name_without_extension.split('_')[0]
+
+    # Read each csv heatmap file into a 3d array, one 2d array of gaze durations per painting
+    with PROFILER.stage('parse heatmaps'):
+        block_names, array_3d = _worker_state['load_heatmaps'](file_csv)
+
+    # Maps painting names to the index of their 2d array
+    heatmap_blocks = catalog.heatmap_blocks(block_names)
+
+    # Stores the results of the participant for every painting
+    paintings = []
+
+    # Iterate over all paintings
+    for i in range(len(test_images)):
+
+        image_name = os.path.splitext(os.path.basename(test_images[i]))[0]
+
+        # Find index of a 2d array with painting name 
+        painting_index = heatmap_blocks.get(image_name)
+
+        if painting_index is not None:
+            painting_height, painting_width = _worker_state['painting_sizes'][image_name]
+            scale_width = painting_width / 100
+            scale_height = painting_height / 100
+            # Nonzero cells are gaze points in row-major order
+            heatmap_grid = array_3d[painting_index]
+            gaze_rows, gaze_cols = np.nonzero(heatmap_grid)
+            x_coordinates = scale_width * (gaze_cols + 1)
+            y_coordinates = scale_height * (gaze_rows + 1)
+            duration_arr = heatmap_grid[gaze_rows, gaze_cols]
+
+            # Ensure one gaze point corresponds to one painting unit
+            unit_width = painting_width/100 
+            unit_height = painting_height/100
+            radius = min(unit_width, unit_height) / 2 # Calculate radius of gaze point
+
+            # Array to store gaze point coordinates and their corresponding durations
+            gaze_data = np.column_stack((x_coordinates, y_coordinates, duration_arr))
+
+            # Dictionary that maps categories to lists of bounding boxes associated with each category
+            boxes_category_dict = catalog.boxes(image_name)
+
+            # Function to calculate durations for gaze points within objects and gaze points outside objects 
+            PROFILER.count('paintings analyzed')
+            with PROFILER.stage('attribution'):
+                if attribution == 'raster':
+                    raster = raster_cache.get(image_name, boxes_category_dict, painting_width, painting_height, heatmap_grid.shape)
+                    gaze_results = attribute_gaze_with_raster(gaze_rows, gaze_cols, duration_arr, raster)
+                elif attribution == 'area':
+                    summed_area_tables = raster_cache.get_summed_area_tables(image_name, boxes_category_dict, painting_width, painting_height, heatmap_grid.shape)
+                    gaze_results = attribute_gaze_by_area(gaze_rows, gaze_cols, duration_arr, summed_area_tables, radius, painting_width, painting_height, raster_cache.subdivisions)
+                else:
+                    gaze_results = calculate_gaze_duration_in_objects_vectorized(gaze_data, radius, boxes_category_dict)
+            total_duration_in_objects, total_duration_outside_objects, average_duration_in_objects, average_duration_outside_objects, max_duration_in_objects, max_duration_outside_objects, object_duration_dict = gaze_results
+
+            paintings.append({
+                'painting': image_name,
+                'image_path': test_images[i],
+                'total_time': np.sum(duration_arr),
+                'mean_duration': np.mean(duration_arr),
+                'total_duration_in_objects': total_duration_in_objects,
+                'total_duration_outside_objects': total_duration_outside_objects,
+                'average_duration_in_objects': average_duration_in_objects,
+                'average_duration_outside_objects': average_duration_outside_objects,
+                'max_duration_in_objects': max_duration_in_objects,
+                'max_duration_outside_objects': max_duration_outside_objects,
+                'object_durations': object_duration_dict,
+                'x_coordinates': x_coordinates,
+                'y_coordinates': y_coordinates,
+                'duration_arr': duration_arr,
+                'radius': radius
+            })
+
+    return {'participant': participant__num, 'paintings': paintings}
+
+""" This function analyzes one participant and returns the result together with the
+profiler measurements of the process, so measurements of workers reach the parent """
+def run_participant(file_csv):
+    participant_result = analyze_participant(file_csv)
+    return participant_result, PROFILER.pop_snapshot()
+
+""" This function builds the participant x painting x category tensor of gaze
+durations used by stat_analysis.test_duration_tensor, with categories in the order
+of config.CLASSES, and the participant x painting durations in objects. Category 0
+holds the duration outside objects; categories without boxes on a painting and
+paintings a participant did not see are NaN """
+def duration_tensor(participant_paintings, painting_names, catalog):
+    durations = np.full((len(participant_paintings), len(painting_names), len(CLASSES)), np.nan)
+    objects = np.full(durations.shape[:2], np.nan)
+    painting_index = {name: index for index, name in enumerate(painting_names)}
+    for participant, paintings in enumerate(participant_paintings):
+        for painting in paintings:
+            index = painting_index[painting['painting']]
+            for category in catalog.boxes(painting['painting']):
+                durations[participant, index, CLASSES.index(category)] = 0
+            for category, duration in painting['object_durations'].items():
+                durations[participant, index, CLASSES.index(category)] = duration
+            durations[participant, index, 0] = painting['total_duration_outside_objects']
+            objects[participant, index] = painting['total_duration_in_objects']
+    return durations, objects
  
 # Colors for the heatmap, change according to your requirements     
 def main(test_images = '/Volumes/SAMSUNG_USB/test-images', annotation_file = '/Volumes/SAMSUNG_USB/annotations/test-ann-27-06.json', 
-         heatmaps = '../../data/heatmaps', anova_file = '../../data/processed/anova-data-filtered-time.csv'):
+         heatmaps = '../../data/heatmaps', anova_file = '../../data/processed/anova-data-filtered-time.csv',
+         attribution = 'boxes', raster_cache = None, heatmap_cache = None, workers = 1,
+         output_images = None, kernel = 'disk', no_plots = False, image_cache_size = 32,
+         incremental = None, results_dir = None, results_format = 'csv', quiet = False,
+         profile = None, area_subdivisions = 4, significance = 'classic', resamples = 100000,
+         multiple_testing = None, batched_test = 't', anova_method = 'statsmodels', no_stats = False,
+         annotation_store = None):
     rgb_colors = [(251, 187, 20), 
             (251, 183, 19),
             (251, 179, 17),
@@ -92,14 +245,41 @@ def main(test_images = '/Volumes/SAMSUNG_USB/test-images', annotation_file = '/V
     average_higher = 0
     # Stores how many times the total gaze duration on areas with objects was higher
     total_higher = 0
+    # Stores the painting results of every participant for the batched tests
+    participant_paintings = []
     
     param_dict = {
         'test_images': test_images,
         'annotation_file': annotation_file,
         'heatmaps': heatmaps,
-        'anova_file': anova_file
+        'anova_file': anova_file,
+        'attribution': attribution,
+        'raster_cache': raster_cache,
+        'heatmap_cache': heatmap_cache,
+        'annotation_store': annotation_store,
+        'workers': workers,
+        'output_images': output_images,
+        'kernel': kernel,
+        'no_plots': no_plots,
+        'image_cache_size': image_cache_size,
+        'incremental': incremental,
+        'results_dir': results_dir,
+        'results_format': results_format,
+        'quiet': quiet,
+        'profile': profile,
+        'area_subdivisions': area_subdivisions,
+        'significance': significance,
+        'resamples': resamples,
+        'multiple_testing': multiple_testing,
+        'batched_test': batched_test,
+        'anova_method': anova_method,
+        'no_stats': no_stats
     }
 
+    # Stage timings and counters are only collected with a profile report
+    if param_dict['profile'] is not None:
+        PROFILER.enable()
+
     # Directory where images of paintings are stored
     DIR_TEST = param_dict['test_images']
     test_images = []
@@ -113,8 +293,35 @@ def main(test_images = '/Volumes/SAMSUNG_USB/test-images', annotation_file = '/V
 
     # Read JSON file with ground truth boxes
     annotation_file = param_dict['annotation_file']
-    with open(annotation_file, 'r') as f:
-        json_data = json.load(f)
+    painting_names = [os.path.splitext(os.path.basename(test_image))[0] for test_image in test_images]
+    if param_dict['annotation_store'] is not None:
+        # Boxes are read from the memory-mapped columnar store of the annotation file,
+        # which is built in features/annotation_store.py on first use
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'features'))
+        from annotation_store import AnnotationStore
+        with PROFILER.stage('read annotations'):
+            store = AnnotationStore.open(annotation_file, param_dict['annotation_store'])
+        with PROFILER.stage('build catalog'):
+            catalog = PaintingCatalog.from_annotation_store(store, painting_names)
+    else:
+        with PROFILER.stage('read annotations'), open(annotation_file, 'r') as f:
+            json_data = json.load(f)
+
+        # Maps paintings to their ground truth boxes and heatmap blocks
+        with PROFILER.stage('build catalog'):
+            catalog = PaintingCatalog(json_data, painting_names)
+
+    # How gaze points are attributed to objects: 'boxes' tests every box, 'raster' looks up
+    # a category bitmask grid that is built once per painting and shared by all participants,
+    # 'area' splits durations by the overlap of the gaze area with the boxes of each category
+    attribution = param_dict['attribution']
+    raster_cache = AOIRasterCache(file_hash(annotation_file), param_dict['raster_cache'], param_dict['area_subdivisions'])
+
+    # Height and width of every painting are read from the image headers; pixels are
+    # decoded lazily, at most once per painting, and only if heatmaps are plotted
+    with PROFILER.stage('read painting sizes'):
+        painting_store = PaintingStore(test_images, cache_size=param_dict['image_cache_size'])
+    painting_sizes = painting_store.sizes
 
     # Directory where heatmaps are stored
     heatmaps = param_dict['heatmaps']
@@ -123,185 +330,224 @@ def main(test_images = '/Volumes/SAMSUNG_USB/test-images', annotation_file = '/V
         file = os.path.join(heatmaps, path)
         files.append(file)
 
-    for file_csv in files:
-        # Function to add header to csv
-        modify_csv(file_csv)
-        df = pd.read_csv(file_csv, delimiter=",") # Read each csv heatmap file
+    # Directory to write heatmap overlays as PNG files instead of showing them
+    output_images = param_dict['output_images']
 
-        csv_name_without_extension = os.path.splitext(os.path.basename(file_csv))[0]
-        participant__num = csv_name_without_extension.split('_')[0]
-        print("Participant:", participant__num)
-    
-        object_names=[]
-        for _, row in df.iterrows():
-            if pd.isna(row[1]): # rows with object names (paintings) have an empty second element
-                object_names.append(row[0])
-            
-        # Create a 3d array
-        result = []
-        current_array = None
-
-        heatmap_data = df.values
-        for row in heatmap_data:
-            if row[0] in object_names:
-                if current_array is not None:
-                    result.append(current_array)
-                current_array = np.expand_dims(row, axis=0)
-            else:
-                if current_array is not None:
-                    current_array = np.concatenate((current_array, np.expand_dims(row, axis=0)), axis=0)
-    
-        if current_array is not None:
-            result.append(current_array)
+    # Participants are analyzed in a process pool with more than one worker; results
+    # are reported in the order of files, so the output is the same as a serial run
+    worker_args = (test_images, painting_sizes, catalog, attribution, raster_cache, param_dict['heatmap_cache'])
+    workers = param_dict['workers']
+
+    # In incremental mode only new or changed heatmaps are analyzed, the aggregates 
+    # of the other participants are loaded from the store
+    aggregate_store = None
+    stored_results = {}
+    if param_dict['incremental'] is not None:
+        settings = {
+            'annotation_hash': raster_cache.annotation_hash,
+            'attribution': attribution,
+            'area_subdivisions': raster_cache.subdivisions,
+            'paintings': painting_names,
+            'painting_sizes': {name: list(size) for name, size in painting_sizes.items()}
+        }
+        aggregate_store = AggregateStore(param_dict['incremental'], settings)
+        aggregate_store.prune(files)
+        for file_csv in files:
+            stored_result = aggregate_store.load(file_csv)
+            if stored_result is not None:
+                stored_results[file_csv] = stored_result
+        print(f"Participants loaded from aggregate store: {len(stored_results)}, participants to analyze: {len(files) - len(stored_results)}")
+    files_to_analyze = [file_csv for file_csv in files if file_csv not in stored_results]
+
+    # The pool is shut down when the participant loop ends or raises, pending participants
+    # are cancelled first, so no worker processes are left behind
+    with contextlib.ExitStack() as pool_context:
+        if workers > 1:
+            executor = pool_context.enter_context(ProcessPoolExecutor(max_workers=workers, initializer=init_participant_worker, initargs=worker_args + (PROFILER.enabled,)))
+            pool_context.callback(executor.shutdown, cancel_futures=True)
+            analyzed_results = executor.map(run_participant, files_to_analyze)
+        else:
+            init_participant_worker(*worker_args)
+            analyzed_results = map(run_participant, files_to_analyze)
 
-        array_3d = np.stack(result, axis=0)
+        # Results of all participants in the order of files
+        def participant_results():
+            for file_csv in files:
+                if file_csv in stored_results:
+                    yield stored_results[file_csv]
+                else:
+                    participant_result, snapshot = next(analyzed_results)
+                    PROFILER.merge(snapshot)
+                    if aggregate_store is not None:
+                        aggregate_store.save(file_csv, participant_result)
+                    yield participant_result
 
-        painting_index = None
+        # Per-participant results are written as tables and printed unless quiet is set
+        results_writer = None
+        if param_dict['results_dir'] is not None:
+            results_writer = ResultsWriter(param_dict['results_dir'], param_dict['results_format'])
+        report = print if not param_dict['quiet'] else lambda *args: None
+
+        # Stores how many paintings were compared for the two counters above
+        compared_paintings = 0
+
+        for participant_result in participant_results():
+            if results_writer is not None:
+                results_writer.add_participant(participant_result)
+            participant__num = participant_result['participant']
+            report("Participant:", participant__num)
+            if param_dict['multiple_testing'] is not None:
+                participant_paintings.append([{key: painting[key] for key in ('painting', 'total_duration_in_objects', 'total_duration_outside_objects', 'object_durations')}
+                                              for painting in participant_result['paintings']])
     
-        # Stores the total gaze duration for an individual participant per painting 
-        participant_dur = []
-        # Stores the average gaze duration on objects for an individual participant per painting 
-        average_durations_objects_arr = []
-        # Stores the average gaze duration outside objects for an individual participant per painting
-        average_durations_no_objects_arr = []
-        # Stores gaze duration on different objects for all participants
-        participant_dict = {}
+            # Stores the total gaze duration for an individual participant per painting 
+            participant_dur = []
+            # Stores the average gaze duration on objects for an individual participant per painting 
+            average_durations_objects_arr = []
+            # Stores the average gaze duration outside objects for an individual participant per painting
+            average_durations_no_objects_arr = []
+            # Stores gaze duration on different objects for all participants
+            participant_dict = {}
+            # Stores heatmap overlays of the participant to write as PNG files
+            render_jobs = []
     
-        # Iterate over all paintings
-        for i in range(len(test_images)):
-        # Arrays to store eye gaze data
-            x_coordinates = []
-            y_coordinates = []
-            duration_arr = []
-
-            image_name = os.path.splitext(os.path.basename(test_images[i]))[0]
+            # Iterate over all paintings
+            for painting in participant_result['paintings']:
+                image_name = painting['painting']
+                total_time = painting['total_time']
+                report(f"Image: {image_name}, Total time:", total_time, "Average gaze:", painting['mean_duration'])
         
-            # Find index of a 2d array with painting name 
-            for a, array_2d in enumerate(array_3d):  # a = index of 2d array representing different paintings
-                if array_2d[0, 0].startswith(image_name):
-                    painting_index = a
-                    break
-        
-            if painting_index is not None:
-                painting_img = mpimg.imread(test_images[i])
-                painting_height = painting_img.shape[0]
-                painting_width = painting_img.shape[1]
-                scale_width = painting_width / 100
-                scale_height = painting_height / 100
-                for b, row in enumerate(array_3d[painting_index][1:], start=1):   # b = index of a row in a 2d array
-                    for c, element in enumerate(row, start=1): # c = index of an element in a row
-                        float_element = float(element)
-                        if float_element != 0:
-                            x = scale_width * c
-                            y = scale_height * b
-                            x_coordinates.append(x)
-                            y_coordinates.append(y)
-                            duration_arr.append(float_element)
-            
-            
-                # Ensure one gaze point corresponds to one painting unit
-                unit_width = painting_width/100 
-                unit_height = painting_height/100
-                radius = min(unit_width, unit_height) / 2 # Calculate radius of gaze point
-            
-            
-                # Array to store gaze point coordinates and their corresponding durations
-                gaze_data = []
-                for xi, yi, dur in zip(x_coordinates, y_coordinates, duration_arr):
-                    gaze_data.append([xi, yi, dur])
-            
-            
-                total_time = np.sum(duration_arr)
-                mean_duration = np.mean(duration_arr)  
-                print(f"Image: {image_name}, Total time:", total_time, "Average gaze:", mean_duration)
-            
                 participant_dur.append(total_time)
-            
-                # Create a dictionary based on the ground truth json file that maps categories to lists of bounding boxes associated with each category
-                boxes_category_dict = {}
-                for image in json_data["images"]:
-                    if image["file_name"].startswith(image_name):
-                        image_id = image["id"]
-                        for annotation in json_data["annotations"]:
-                            if annotation["image_id"] == image_id:
-                                box = annotation["bbox"]
-                                category = CLASSES[annotation["category_id"]]
-                                if category in boxes_category_dict:
-                                # If it exists, append the new bbox to the existing list of bbox values
-                                    boxes_category_dict[category].append(box)
-                                else:
-                                # If it doesn't exist, create a new list with the bbox value
-                                    boxes_category_dict[category] = [box]
-                          
-            
-                # Function to calculate durations for gaze points within objects and gaze points outside objects 
-                total_duration_in_objects, total_duration_outside_objects, average_duration_in_objects, average_duration_outside_objects, max_duration_in_objects, max_duration_outside_objects, object_duration_dict = calculate_gaze_duration_in_objects(gaze_data, radius, boxes_category_dict)
-            
+
+                total_duration_in_objects = painting['total_duration_in_objects']
+                total_duration_outside_objects = painting['total_duration_outside_objects']
+                average_duration_in_objects = painting['average_duration_in_objects']
+                average_duration_outside_objects = painting['average_duration_outside_objects']
+        
                 # Stores gaze duration on different objects for all participants
                 participant_painting_dict = {}
-            
+        
+                compared_paintings += 1
                 if average_duration_in_objects > average_duration_outside_objects:
                     average_higher += 1
                 if total_duration_in_objects > total_duration_outside_objects:
                     total_higher += 1
-            
+        
                 # Prints summary for an individual participant for one painting image
-                participant_painting_dict[image_name] = object_duration_dict
-                print(f"Total duration in objects: {total_duration_in_objects}")
-                print(f"Total duration outside objects: {total_duration_outside_objects}")
-                print(f"Average duration in objects: {average_duration_in_objects}")
-                print(f"Average duration outside objects: {average_duration_outside_objects}")
-                # print(f"Max duration in objects: {max_duration_in_objects}")
-                # print(f"Max duration outside objects: {max_duration_outside_objects}")
-                print(participant_painting_dict)
-                print('')
-            
+                participant_painting_dict[image_name] = painting['object_durations']
+                report(f"Total duration in objects: {total_duration_in_objects}")
+                report(f"Total duration outside objects: {total_duration_outside_objects}")
+                report(f"Average duration in objects: {average_duration_in_objects}")
+                report(f"Average duration outside objects: {average_duration_outside_objects}")
+                # print(f"Max duration in objects: {painting['max_duration_in_objects']}")
+                # print(f"Max duration outside objects: {painting['max_duration_outside_objects']}")
+                report(participant_painting_dict)
+                report('')
+        
                 participant_dict.update(participant_painting_dict)
-   
+
                 average_durations_objects_arr.append(average_duration_in_objects)
                 average_durations_no_objects_arr.append(average_duration_outside_objects)
+        
+                # Function to plot heatmap overlay, or collect it for PNG export
+                if param_dict['no_plots'] or 'duration_arr' not in painting:
+                    # Participants loaded from the aggregate store have no gaze points to plot
+                    pass
+                elif output_images is not None:
+                    render_jobs.append({
+                        'name': f"{participant__num}_{image_name}",
+                        'painting_img': painting_store.pixels(painting['image_path']),
+                        'x_coordinates': painting['x_coordinates'],
+                        'y_coordinates': painting['y_coordinates'],
+                        'duration_arr': painting['duration_arr'],
+                        'radius': painting['radius']
+                    })
+                else:
+                    painting_img = painting_store.pixels(painting['image_path'])
+                    with PROFILER.stage('plot heatmaps'):
+                        plot_heatmap(painting_img, painting['x_coordinates'], painting['y_coordinates'], painting['duration_arr'], my_colormap, painting['radius'])
             
-                # Function to plot heatmap overlay
-                plot_heatmap(painting_img, x_coordinates, y_coordinates, duration_arr, my_colormap, radius)
-            
-            
-        avg_durations_object_participant = np.mean(average_durations_objects_arr)
-        avg_durations_no_object_participant = np.mean(average_durations_no_objects_arr)
-        average_durations_object_t_test.append(avg_durations_object_participant)
-        average_durations_no_object_t_test.append(avg_durations_no_object_participant)
+            if render_jobs:
+                with PROFILER.stage('render heatmaps'):
+                    from render_heatmap import render_heatmaps
+                    render_heatmaps(render_jobs, output_images, my_colormap, param_dict['kernel'])
+
+            avg_durations_object_participant = np.mean(average_durations_objects_arr)
+            avg_durations_no_object_participant = np.mean(average_durations_no_objects_arr)
+            average_durations_object_t_test.append(avg_durations_object_participant)
+            average_durations_no_object_t_test.append(avg_durations_no_object_participant)
     
-        # Print summary for an individual participant for all painting images
-        average_time = np.mean(participant_dur)
-        most_viewed_by_participant = find_most_viewed_object_ind(participant_dict)
-        array_of_dicts.append(most_viewed_by_participant)
-        print(f"Participant: {participant__num}, Average time:", average_time)
-        # print("Within bounding boxes: ", average_durations_objects_arr)
-        # print("Outside bounding boxes: ", average_durations_no_objects_arr)
-        print("Most viewed by participant:", most_viewed_by_participant)
-        print('-' * 200)
+            # Print summary for an individual participant for all painting images
+            average_time = np.mean(participant_dur)
+            most_viewed_by_participant = find_most_viewed_object_ind(participant_dict)
+            array_of_dicts.append(most_viewed_by_participant)
+            report(f"Participant: {participant__num}, Average time:", average_time)
+            # print("Within bounding boxes: ", average_durations_objects_arr)
+            # print("Outside bounding boxes: ", average_durations_no_objects_arr)
+            report("Most viewed by participant:", most_viewed_by_participant)
+            report('-' * 200)
+
+        if results_writer is not None:
+            results_writer.close()
 
     # Print summary for all participants for all painting images
-    most_viewed_group = find_most_viewed_object_group(array_of_dicts)
+    # With --output_images the bar chart is saved next to the heatmap overlays
+    plot_file = os.path.join(output_images, 'most_viewed_objects.png') if output_images is not None else None
+    most_viewed_group = find_most_viewed_object_group(array_of_dicts, plot=not param_dict['no_plots'], plot_file=plot_file)
     print("Most viewed objects per painting:")
     for _dictionary in most_viewed_group:
         print(_dictionary)
     print()
 
+    if param_dict['no_stats']:
+        if param_dict['profile'] is not None:
+            PROFILER.write(param_dict['profile'])
+            print(f"Profile written to {param_dict['profile']}")
+        return
+
+    from stat_analysis import calculate_significance, print_resampling_result, perform_one_way_anova, test_duration_tensor
     print("Meaningful versus non-meaningful areas:")
-    calculate_significance(average_durations_object_t_test, average_durations_no_object_t_test)
-    average_higher = math.floor(average_higher/(31*19)*100)
-    total_higher = math.floor(total_higher/(31*19)*100)
+    with PROFILER.stage('significance test'):
+        if param_dict['significance'] == 'resampling':
+            significance = calculate_significance(average_durations_object_t_test, average_durations_no_object_t_test,
+                                                  method='resampling', n_resamples=param_dict['resamples'],
+                                                  workers=param_dict['workers'])
+            print_resampling_result(significance)
+        else:
+            calculate_significance(average_durations_object_t_test, average_durations_no_object_t_test)
+    average_higher = math.floor(average_higher/compared_paintings*100) if compared_paintings != 0 else 0
+    total_higher = math.floor(total_higher/compared_paintings*100) if compared_paintings != 0 else 0
     print(f"Average gaze duration on objects was higher in {average_higher}% cases")
     print(f"Total gaze duration on objects was higher in {total_higher}% cases")
     print()
 
+    if param_dict['multiple_testing'] is not None:
+        print(f"Per-painting and per-category tests ({param_dict['batched_test']} test, {param_dict['multiple_testing']} correction):")
+        durations, objects = duration_tensor(participant_paintings, painting_names, catalog)
+        tests = test_duration_tensor(durations, objects, param_dict['batched_test'], param_dict['multiple_testing'])
+        labels = {
+            'objects': lambda index: painting_names[index[0]],
+            'painting categories': lambda index: f"{painting_names[index[0]]} {CLASSES[index[1] + 1]}",
+            'categories': lambda index: CLASSES[index[0] + 1]
+        }
+        for family, result in tests.items():
+            significant = np.argwhere(result['p_adjusted'] <= 0.05)
+            print(f"{family}: {len(significant)} of {np.count_nonzero(~np.isnan(result['p_value']))} tests significant")
+            for index in significant:
+                index = tuple(index)
+                print(f"  {labels[family](index)}: statistic {result['statistic'][index]}, adjusted p-value {result['p_adjusted'][index]}")
+        print()
+
     print("Object-Interest analysis:")
-    perform_one_way_anova(param_dict['anova_file'])
+    with PROFILER.stage('one-way anova'):
+        perform_one_way_anova(param_dict['anova_file'], param_dict['anova_method'])
 
+    if param_dict['profile'] is not None:
+        PROFILER.write(param_dict['profile'])
+        print(f"Profile written to {param_dict['profile']}")
 
-if __name__ == "__main__":
-    # construct the argument parser
-    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+""" This function adds the command line arguments of main to parser """
+def add_arguments(parser):
     parser.add_argument('--test_images', type=str,
                            default='/Volumes/SAMSUNG_USB/test-images',
                            help='directory where painting images are stored')
@@ -314,9 +560,71 @@ if __name__ == "__main__":
     parser.add_argument('--anova_file', type=str,
                            default='../../data/processed/anova-data-filtered-time.csv',
                            help='csv file for one-way anova test')
-    
-    args = parser.parse_args()
-    main(**dict(args._get_kwargs()))
-    
+    parser.add_argument('--attribution', type=str, choices=['boxes', 'raster', 'area'],
+                           default='boxes',
+                           help='attribute gaze points by testing every bounding box, with a precomputed category raster per painting, or by the fraction of the gaze area that overlaps each category')
+    parser.add_argument('--area_subdivisions', type=int,
+                           default=4,
+                           help='subdivisions per heatmap cell of the summed-area tables used by --attribution area')
+    parser.add_argument('--raster_cache', type=str,
+                           default=None,
+                           help='directory to store category rasters between runs')
+    parser.add_argument('--annotation_store', type=str,
+                           default=None,
+                           help='directory of a columnar store of the annotation file (int32/int16/float32 arrays memory mapped from .npy files), built on first use and rebuilt when the file changes')
+    parser.add_argument('--heatmap_cache', type=str,
+                           default=None,
+                           help='directory to cache parsed heatmaps as memory-mapped binary files')
+    parser.add_argument('--workers', type=int,
+                           default=1,
+                           help='number of processes that analyze participants in parallel')
+    parser.add_argument('--output_images', type=str,
+                           default=None,
+                           help='directory to write heatmap overlays and the bar chart of the most viewed objects as PNG files instead of showing them')
+    parser.add_argument('--kernel', type=str, choices=['disk', 'gaussian'],
+                           default='disk',
+                           help='kernel used to splat gaze points in PNG heatmap overlays')
+    parser.add_argument('--no_plots', action='store_true',
+                           help='only calculate the metrics, without showing plots or writing heatmap overlays')
+    parser.add_argument('--no_stats', action='store_true',
+                           help='skip the statistical tests, e.g. to run them later on the result tables')
+    parser.add_argument('--image_cache_size', type=int,
+                           default=32,
+                           help='number of decoded painting images kept in memory for plotting')
+    parser.add_argument('--incremental', type=str,
+                           default=None,
+                           help='directory of the aggregate store; only new or changed heatmaps are analyzed and group results are recomputed from the store')
+    parser.add_argument('--results_dir', type=str,
+                           default=None,
+                           help='directory to write per-participant results as tables (painting_metrics, category_durations)')
+    parser.add_argument('--results_format', type=str, choices=['csv', 'parquet'],
+                           default='csv',
+                           help='file format of the result tables; parquet requires pyarrow')
+    parser.add_argument('--significance', type=str, choices=['classic', 'resampling'],
+                           default='classic',
+                           help='compare objects and non-objects with a t-test or Wilcoxon test chosen by a normality check, or with a permutation test and bootstrap confidence intervals')
+    parser.add_argument('--resamples', type=int,
+                           default=100000,
+                           help='number of permutation and bootstrap resamples used by --significance resampling')
+    parser.add_argument('--multiple_testing', type=str, choices=['bh', 'holm'],
+                           default=None,
+                           help='also test objects against non-objects per painting and every category against the others, with Benjamini-Hochberg or Holm correction')
+    parser.add_argument('--batched_test', type=str, choices=['t', 'wilcoxon'],
+                           default='t',
+                           help='paired test used by --multiple_testing')
+    parser.add_argument('--anova_method', type=str, choices=['statsmodels', 'streaming'],
+                           default='statsmodels',
+                           help='fit the one-way anova with statsmodels on the whole file, or read the file in chunks with streaming accumulators')
+    parser.add_argument('--quiet', action='store_true',
+                           help='do not print results of individual participants and paintings')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json',
+                           default=None,
+                           help='write stage timings and counters as a json report to this file')
+    return parser
 
 
+if __name__ == "__main__":
+    # construct the argument parser
+    parser = add_arguments(ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter))
+    args = parser.parse_args()
+    main(**dict(args._get_kwargs()))
@@ -0,0 +1,78 @@
+""" Contains the binary cache for parsed participant heatmaps. Every csv
+file is stored as a .npy array of shape (n_paintings, rows, cols) and a
+small json index with the painting names and the state of the source file """
+
+import hashlib
+import json
+import os
+import numpy as np
+
+from heatmap_reader import read_heatmaps
+from utils import file_hash
+from profiler import PROFILER
+
+""" This class loads parsed heatmaps from cache_dir and only parses a csv file
+when its cache entry is missing or stale. With validate='mtime' an entry is
+fresh when the modification time and size of the csv file did not change, with
+validate='hash' when its sha256 hash did not change. Fresh entries are memory
+mapped read-only, so loading them does not copy the data """
+class HeatmapCache:
+    def __init__(self, cache_dir, dtype=np.float32, validate='mtime'):
+        if validate not in ('mtime', 'hash'):
+            raise ValueError(f"validate must be 'mtime' or 'hash', not '{validate}'")
+        self.cache_dir = cache_dir
+        self.dtype = np.dtype(dtype)
+        self.validate = validate
+        os.makedirs(cache_dir, exist_ok=True)
+
+    """ Returns the array and index files of csv_file. The key includes a hash of
+    the absolute path, so csv files with the same name in different directories
+    get their own entries """
+    def paths(self, csv_file):
+        source_hash = hashlib.sha256(os.path.abspath(csv_file).encode('utf-8')).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(csv_file))[0] + '-' + source_hash
+        return os.path.join(self.cache_dir, name + '.npy'), os.path.join(self.cache_dir, name + '.json')
+
+    def source_state(self, csv_file):
+        stat = os.stat(csv_file)
+        state = {'source': os.path.abspath(csv_file), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'dtype': self.dtype.str}
+        if self.validate == 'hash':
+            state['sha256'] = file_hash(csv_file)
+        return state
+
+    def is_fresh(self, index, csv_file):
+        if index is None or index.get('dtype') != self.dtype.str or index.get('source') != os.path.abspath(csv_file):
+            return False
+        if self.validate == 'hash':
+            # Compare the hash only if the cheap checks fail
+            stat = os.stat(csv_file)
+            if index.get('mtime_ns') == stat.st_mtime_ns and index.get('size') == stat.st_size and 'sha256' in index:
+                return True
+            return index.get('sha256') == file_hash(csv_file)
+        stat = os.stat(csv_file)
+        return index.get('mtime_ns') == stat.st_mtime_ns and index.get('size') == stat.st_size
+
+    """ Returns the painting names and a read-only (n_paintings, rows, cols) array """
+    def load(self, csv_file):
+        array_file, index_file = self.paths(csv_file)
+        index = None
+        if os.path.isfile(index_file) and os.path.isfile(array_file):
+            with open(index_file, 'r') as file:
+                index = json.load(file)
+
+        if self.is_fresh(index, csv_file):
+            PROFILER.count('heatmap cache hits')
+            PROFILER.count('bytes mapped', os.path.getsize(array_file))
+            return index['painting_names'], np.load(array_file, mmap_mode='r')
+
+        state = self.source_state(csv_file)
+        painting_names, array_3d = read_heatmaps(csv_file, dtype=self.dtype)
+        # Write to temporary files first so an interrupted run never leaves a broken entry
+        with open(array_file + '.tmp', 'wb') as file:
+            np.save(file, array_3d)
+        os.replace(array_file + '.tmp', array_file)
+        state['painting_names'] = painting_names
+        with open(index_file + '.tmp', 'w') as file:
+            json.dump(state, file)
+        os.replace(index_file + '.tmp', index_file)
+        return painting_names, np.load(array_file, mmap_mode='r')
@@ -0,0 +1,56 @@
+""" Contains functions that read participant heatmap csv files. A heatmap file
+is a sequence of blocks: a row with the painting name followed by empty cells,
+then one row of gaze durations per row of the painting grid """
+
+import csv
+import os
+import numpy as np
+
+from profiler import PROFILER
+
+""" This function checks if a csv row starts a new painting block. Rows with
+painting names have an empty second element """
+def is_painting_row(row):
+    return len(row) < 2 or row[1] == ''
+
+""" This function reads a heatmap csv file once, read-only, and yields
+(painting_name, 2d array of gaze durations) for every painting block. Files
+with the c1..cN header row that earlier versions of create_heatmap.py wrote into
+the heatmap files are also supported """
+def iter_heatmap_blocks(csv_file, dtype=np.float32):
+    painting_name = None
+    rows = []
+    PROFILER.count('heatmap csv files parsed')
+    PROFILER.count('bytes read', os.path.getsize(csv_file))
+    with open(csv_file, 'r', newline='') as file:
+        for row in csv.reader(file):
+            if not row or row[0] == 'c1':
+                continue
+            if is_painting_row(row):
+                if painting_name is not None:
+                    yield painting_name, np.array(rows, dtype=dtype)
+                painting_name = row[0]
+                rows = []
+            elif painting_name is not None:
+                rows.append(row)
+    if painting_name is not None:
+        yield painting_name, np.array(rows, dtype=dtype)
+
+""" This function reads all painting blocks of a heatmap csv file and returns
+the painting names and a (n_paintings, rows, cols) array. If out is given, the
+blocks are written into that preallocated array instead """
+def read_heatmaps(csv_file, dtype=np.float32, out=None):
+    painting_names = []
+    blocks = []
+    for index, (painting_name, block) in enumerate(iter_heatmap_blocks(csv_file, dtype)):
+        painting_names.append(painting_name)
+        if out is not None:
+            out[index] = block
+        else:
+            blocks.append(block)
+
+    if out is not None:
+        return painting_names, out[:len(painting_names)]
+    if not blocks:
+        return painting_names, np.zeros((0, 100, 100), dtype=dtype)
+    return painting_names, np.stack(blocks, axis=0)
@@ -1,6 +1,9 @@
 """ Contains functions that prepare the data for future statistical analysis """
 
-import matplotlib.pyplot as plt
+import os
+import numpy as np
+
+from profiler import PROFILER
 
 """ This function check if the gaze points fall within the bounding 
 boxes of at least one of the boxes in boxes_category_dict """
@@ -29,6 +32,8 @@ def calculate_gaze_duration_in_objects(gaze_data, radius, boxes_category_dict):
     duration_no_objects_arr = []
     object_duration_dict = {}
 
+    PROFILER.count('points tested', len(gaze_data))
+    PROFILER.count('boxes tested', len(gaze_data) * sum(len(boxes) for boxes in boxes_category_dict.values()))
     for gaze_point in gaze_data:
         gaze_x, gaze_y, duration = gaze_point
 
@@ -60,6 +65,89 @@ def calculate_gaze_duration_in_objects(gaze_data, radius, boxes_category_dict):
 
     return total_duration_in_objects, total_duration_outside_objects, average_duration_in_objects, average_duration_ouside_objects, max_duration_in_objects, max_duration_outside_objects, object_duration_dict
 
+""" This function flattens boxes_category_dict into an (N, 4) array of 
+bounding boxes and an array with the category index of every box """
+def boxes_to_array(boxes_category_dict):
+    categories = list(boxes_category_dict.keys())
+    boxes = []
+    box_categories = []
+    for index, category in enumerate(categories):
+        for box in boxes_category_dict[category]:
+            boxes.append(box)
+            box_categories.append(index)
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    box_categories = np.asarray(box_categories, dtype=int)
+    return categories, boxes, box_categories
+
+""" This function checks all gaze points of a painting against all bounding 
+boxes at once and returns a (points, boxes) boolean hit matrix """
+def check_gaze_in_bounding_boxes_vectorized(gaze_x, gaze_y, boxes):
+    gaze_x = np.asarray(gaze_x, dtype=float)[:, np.newaxis]
+    gaze_y = np.asarray(gaze_y, dtype=float)[:, np.newaxis]
+    x_min, y_min, width, height = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    return (gaze_x >= x_min) & (gaze_x <= x_min + width) & (gaze_y >= y_min) & (gaze_y <= y_min + height)
+
+""" This function attributes gaze durations to object categories in one 
+broadcasted pass. It returns the per-point hit mask (gaze point inside at least 
+one box), the per-point per-category hit mask and the per-category duration sums """
+def attribute_gaze_to_boxes(gaze_x, gaze_y, durations, boxes_category_dict):
+    durations = np.asarray(durations, dtype=float)
+    categories, boxes, box_categories = boxes_to_array(boxes_category_dict)
+    PROFILER.count('points tested', len(durations))
+    PROFILER.count('boxes tested', len(durations) * len(boxes))
+    hits = check_gaze_in_bounding_boxes_vectorized(gaze_x, gaze_y, boxes)
+    point_mask = hits.any(axis=1)
+
+    # A point inside two boxes of the same category counts twice for that category,
+    # exactly like check_gaze_in_bounding_boxes, so sums are taken over boxes
+    contributions = np.where(hits, durations[:, np.newaxis], 0.0)
+    category_mask = np.zeros((len(durations), len(categories)), dtype=bool)
+    first_hit = []
+    category_durations = []
+    for index in range(len(categories)):
+        columns = box_categories == index
+        category_mask[:, index] = hits[:, columns].any(axis=1)
+        hit_points = np.flatnonzero(category_mask[:, index])
+        if len(hit_points) == 0:
+            continue
+        # Cumulative sum adds the values in the same order as the loop version,
+        # so the floating point result is identical
+        total = np.cumsum(contributions[:, columns].ravel())[-1]
+        first_hit.append((hit_points[0], index))
+        category_durations.append((index, float(total)))
+
+    # Keep the key order of the loop version: categories in order of the first gaze point that hits them
+    order = {index: rank for rank, (_, index) in enumerate(sorted(first_hit))}
+    category_durations.sort(key=lambda item: order[item[0]])
+    object_duration_dict = {categories[index]: total for index, total in category_durations}
+    return point_mask, category_mask, object_duration_dict
+
+""" This function calculates duration (average, total, max) for gaze points 
+within objects and gaze points outside objects with NumPy. It returns the same 
+values as calculate_gaze_duration_in_objects """
+def calculate_gaze_duration_in_objects_vectorized(gaze_data, radius, boxes_category_dict):
+    gaze_data = np.asarray(gaze_data, dtype=float).reshape(-1, 3)
+    gaze_x, gaze_y, durations = gaze_data[:, 0], gaze_data[:, 1], gaze_data[:, 2]
+    point_mask, _, object_duration_dict = attribute_gaze_to_boxes(gaze_x, gaze_y, durations, boxes_category_dict)
+    return summarize_gaze_durations(durations, point_mask, object_duration_dict)
+
+""" This function summarizes durations of gaze points within objects (point_mask) 
+and outside objects in the format returned by calculate_gaze_duration_in_objects """
+def summarize_gaze_durations(durations, point_mask, object_duration_dict):
+    duration_objects_arr = durations[point_mask]
+    duration_no_objects_arr = durations[~point_mask]
+    count_objects = len(duration_objects_arr)
+    count_no_objects = len(duration_no_objects_arr)
+    # Sequential sums to match the built-in sum used by the loop version
+    total_duration_in_objects = float(np.cumsum(duration_objects_arr)[-1]) if count_objects != 0 else 0
+    total_duration_outside_objects = float(np.cumsum(duration_no_objects_arr)[-1]) if count_no_objects != 0 else 0
+    average_duration_ouside_objects = total_duration_outside_objects/count_no_objects if count_no_objects != 0 else 0
+    average_duration_in_objects = total_duration_in_objects/count_objects if count_objects != 0 else 0
+    max_duration_in_objects = float(duration_objects_arr.max()) if count_objects != 0 else 0
+    max_duration_outside_objects = float(duration_no_objects_arr.max()) if count_no_objects != 0 else 0
+
+    return total_duration_in_objects, total_duration_outside_objects, average_duration_in_objects, average_duration_ouside_objects, max_duration_in_objects, max_duration_outside_objects, object_duration_dict
+
 """ This function returns a dictionary of most viewed object 
 by each participant per each painting """
 def find_most_viewed_object_ind(participant_data):
@@ -75,8 +163,9 @@ def find_most_viewed_object_ind(participant_data):
 
 
 """ This function returns a dictionary of most viewed object 
-by all participants per each painting """
-def find_most_viewed_object_group(participant_data):
+by all participants per each painting. With plot, the bar chart is shown, or
+saved to plot_file if given """
+def find_most_viewed_object_group(participant_data, plot=True, plot_file=None):
     most_viewed_objects = {}
 
     for participant_dict in participant_data:
@@ -104,7 +193,8 @@ def find_most_viewed_object_group(participant_data):
 
     paintings, objects, count, duration_objects, percentage = split_dictionary(most_viewed_list_per_painting)
     # Plot a bar chart of most viewed objects per painting
-    plot_objects_by_painting(objects, paintings, percentage)
+    if plot:
+        plot_objects_by_painting(objects, paintings, percentage, plot_file)
     
     return most_viewed_list_per_painting
 
@@ -128,8 +218,10 @@ def split_dictionary(dictionary):
     return paintings, objects, count, duration_objects, percentage
 
 """ This functions plots a bar chart of most popular 
-objects by painting """
-def plot_objects_by_painting(objects, paintings, percentage):
+objects by painting. With output_file, the chart is saved there instead of shown """
+def plot_objects_by_painting(objects, paintings, percentage, output_file=None):
+    import matplotlib.pyplot as plt
+
     color_dict = {
         'Human hair': '#BF9B58',
         'Building': '#7CACDE',
@@ -172,6 +264,12 @@ def plot_objects_by_painting(objects, paintings, percentage):
     # Adjust the layout to prevent overlapping of bars
     fig.tight_layout()
 
-    # Show the plot
-    plt.show()
+    # Show the plot, or save it for runs without a display
+    with PROFILER.stage('plot most viewed objects'):
+        if output_file is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            fig.savefig(output_file)
+        else:
+            plt.show()
+        plt.close(fig)
 
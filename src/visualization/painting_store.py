@@ -0,0 +1,78 @@
+""" Contains the painting store. Painting sizes are read from the image
+headers and kept in a json file next to the images; pixels are decoded
+lazily and kept in a bounded LRU cache """
+
+import json
+import os
+from functools import lru_cache
+
+from profiler import PROFILER
+
+# Name of the file with painting sizes, stored in the painting directory
+METADATA_FILE = 'painting_sizes.json'
+
+""" This function reads the height and width of an image from its header
+without decoding the pixels """
+def read_image_size(image_path):
+    from PIL import Image
+
+    PROFILER.count('image headers read')
+    with Image.open(image_path) as image:
+        width, height = image.size
+    return height, width
+
+""" This function decodes the pixels of an image """
+def decode_image(image_path):
+    import matplotlib.image as mpimg
+
+    PROFILER.count('images decoded')
+    PROFILER.count('bytes read', os.path.getsize(image_path))
+    with PROFILER.stage('decode images'):
+        return mpimg.imread(image_path)
+
+""" This class gives access to the sizes and pixels of the paintings. Sizes are
+read once from the image headers and persisted in metadata_file (by default
+painting_sizes.json next to the images); an entry is reread when the image file
+changes. Pixels are only decoded on request, at most once per painting while it
+stays in the LRU cache of cache_size paintings """
+class PaintingStore:
+    def __init__(self, test_images, metadata_file=None, cache_size=32):
+        self.test_images = list(test_images)
+        if metadata_file is None and self.test_images:
+            metadata_file = os.path.join(os.path.dirname(os.path.abspath(self.test_images[0])), METADATA_FILE)
+        self.metadata_file = metadata_file
+        self.sizes = self.load_sizes()
+        self.pixels = lru_cache(maxsize=cache_size)(decode_image)
+
+    def load_sizes(self):
+        metadata = {}
+        if self.metadata_file is not None and os.path.isfile(self.metadata_file):
+            with open(self.metadata_file, 'r') as file:
+                metadata = json.load(file)
+
+        sizes = {}
+        changed = False
+        for test_image in self.test_images:
+            file_name = os.path.basename(test_image)
+            stat = os.stat(test_image)
+            entry = metadata.get(file_name)
+            if entry is None or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                height, width = read_image_size(test_image)
+                entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'height': height, 'width': width}
+                metadata[file_name] = entry
+                changed = True
+            painting_name = os.path.splitext(file_name)[0]
+            sizes[painting_name] = (entry['height'], entry['width'])
+
+        if changed and self.metadata_file is not None:
+            try:
+                with open(self.metadata_file, 'w') as file:
+                    json.dump(metadata, file, indent=2)
+            except OSError:
+                # The painting directory may be read-only; the sizes are then read again next run
+                pass
+        return sizes
+
+    """ Returns the height and width of a painting """
+    def size(self, painting_name):
+        return self.sizes[painting_name]
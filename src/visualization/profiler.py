@@ -0,0 +1,87 @@
+""" Contains lightweight instrumentation: named stage timers and counters.
+Profiling is off by default; a disabled profiler returns a shared no-op
+context manager and ignores counts, so instrumented code pays almost nothing """
+
+import contextlib
+import json
+import time
+
+# Returned by Profiler.stage when profiling is disabled
+_NO_STAGE = contextlib.nullcontext()
+
+""" This class measures the time spent in a named stage of a Profiler """
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        seconds, calls = self.profiler.timings.get(self.name, (0.0, 0))
+        self.profiler.timings[self.name] = (seconds + elapsed, calls + 1)
+        return False
+
+""" This class collects stage timings and counters. Use it as
+    with PROFILER.stage('parse heatmaps'): ...
+    PROFILER.count('points tested', n) """
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+
+    """ Starts collecting; measurements inherited from a parent process are dropped """
+    def enable(self):
+        self.enabled = True
+        self.timings = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    """ Returns the collected timings and counters and resets them, used to send
+    the measurements of a worker process to the parent """
+    def pop_snapshot(self):
+        if not self.enabled:
+            return None
+        snapshot = {'timings': self.timings, 'counters': self.counters}
+        self.timings = {}
+        self.counters = {}
+        return snapshot
+
+    """ Adds the measurements of a snapshot, e.g. from a worker process """
+    def merge(self, snapshot):
+        if snapshot is None:
+            return
+        for name, (seconds, calls) in snapshot['timings'].items():
+            total_seconds, total_calls = self.timings.get(name, (0.0, 0))
+            self.timings[name] = (total_seconds + seconds, total_calls + calls)
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+
+    def report(self):
+        return {
+            'total_seconds': time.perf_counter() - self.start,
+            'stages': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in self.timings.items()},
+            'counters': dict(self.counters)
+        }
+
+    """ Writes the report as json """
+    def write(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+# Profiler shared by all modules of a process
+PROFILER = Profiler()
@@ -0,0 +1,113 @@
+""" Contains functions that render heatmap overlays without matplotlib figures.
+Gaze durations are splatted into a raster with NumPy, colored with a lookup
+table and alpha-composited onto the painting, so thousands of overlays can be
+written to PNG files on any backend """
+
+import os
+import numpy as np
+
+""" This function converts a painting image to float RGB values in [0, 1] """
+def painting_to_rgb(painting_img):
+    painting = np.asarray(painting_img)
+    if painting.dtype == np.uint8:
+        painting = painting / 255
+    else:
+        painting = painting.astype(float)
+    if painting.ndim == 2:
+        painting = np.stack((painting,) * 3, axis=-1)
+    return painting[:, :, :3]
+
+""" This function maps gaze durations to colors of my_colormap the same way
+ListedColormap does: values in [0, 1] select one of the colors, values outside
+that interval take the first or the last color """
+def map_colors(values, my_colormap):
+    lut = np.asarray(my_colormap, dtype=float)
+    indices = np.clip(np.floor(np.asarray(values) * len(lut)), 0, len(lut) - 1).astype(int)
+    return lut[indices]
+
+""" This function returns the pixel offsets and weights of a kernel. A disk
+kernel has weight 1 inside the radius, a gaussian kernel uses the radius as
+standard deviation and is cut off at three standard deviations """
+def kernel_stamp(radius, kernel='disk'):
+    extent = radius if kernel == 'disk' else 3 * radius
+    size = int(np.ceil(extent)) + 1
+    offset_y, offset_x = np.mgrid[-size:size + 1, -size:size + 1]
+    return offset_x.ravel(), offset_y.ravel(), extent
+
+""" This function splats gaze points into rasters of the painting size. It returns
+the kernel weight of every pixel and the weighted sum of gaze durations. Points
+are splatted in chunks of at most max_elements kernel pixels, so memory does
+not grow with the number of points times the kernel size """
+def splat_gaze(x_coordinates, y_coordinates, duration_arr, radius, shape, kernel='disk', max_elements=1 << 20):
+    if kernel not in ('disk', 'gaussian'):
+        raise ValueError(f"Unknown kernel '{kernel}', use 'disk' or 'gaussian'")
+    height, width = shape
+    x_coordinates = np.asarray(x_coordinates, dtype=float)
+    y_coordinates = np.asarray(y_coordinates, dtype=float)
+    duration_arr = np.asarray(duration_arr, dtype=float)
+    offset_x, offset_y, extent = kernel_stamp(radius, kernel)
+    weight_sum = np.zeros(height * width)
+    duration_sum = np.zeros(height * width)
+
+    chunk_size = max(1, max_elements // len(offset_x))
+    for start in range(0, len(x_coordinates), chunk_size):
+        chunk_x = x_coordinates[start:start + chunk_size, np.newaxis]
+        chunk_y = y_coordinates[start:start + chunk_size, np.newaxis]
+        chunk_durations = duration_arr[start:start + chunk_size, np.newaxis]
+
+        # Pixels around every gaze point of the chunk, one row per gaze point
+        pixel_x = np.round(chunk_x).astype(int) + offset_x
+        pixel_y = np.round(chunk_y).astype(int) + offset_y
+        squared_distance = (pixel_x - chunk_x) ** 2 + (pixel_y - chunk_y) ** 2
+        if kernel == 'disk':
+            weights = (squared_distance <= radius ** 2).astype(float)
+        else:
+            weights = np.exp(-squared_distance / (2 * radius ** 2)) * (squared_distance <= extent ** 2)
+
+        inside = (weights > 0) & (pixel_x >= 0) & (pixel_x < width) & (pixel_y >= 0) & (pixel_y < height)
+        pixels = pixel_y[inside] * width + pixel_x[inside]
+        if len(pixels) == 0:
+            continue
+        weights_inside = weights[inside]
+        durations_inside = np.broadcast_to(chunk_durations, weights.shape)[inside]
+        # Sums are taken over the pixel range of the chunk only
+        first, last = pixels.min(), pixels.max() + 1
+        weight_sum[first:last] += np.bincount(pixels - first, weights=weights_inside, minlength=last - first)
+        duration_sum[first:last] += np.bincount(pixels - first, weights=weights_inside * durations_inside, minlength=last - first)
+    return weight_sum.reshape(shape), duration_sum.reshape(shape)
+
+""" This function renders the heatmap overlay of one painting and returns it as
+a uint8 RGB image. Every gaze point covers the painting with alpha, so pixels
+covered by k gaze points get the opacity of k stacked circles """
+def render_heatmap_overlay(painting_img, x_coordinates, y_coordinates, duration_arr, my_colormap, radius, kernel='disk', alpha=0.4):
+    painting = painting_to_rgb(painting_img)
+    weight_sum, duration_sum = splat_gaze(x_coordinates, y_coordinates, duration_arr, radius, painting.shape[:2], kernel)
+
+    covered = weight_sum > 0
+    mean_duration = np.zeros_like(weight_sum)
+    mean_duration[covered] = duration_sum[covered] / weight_sum[covered]
+    opacity = (1 - (1 - alpha) ** weight_sum)[:, :, np.newaxis]
+    colors = map_colors(mean_duration, my_colormap)
+
+    overlay = painting * (1 - opacity) + colors * opacity
+    return np.round(overlay * 255).astype(np.uint8)
+
+""" This function renders heatmap overlays in a batch and writes them as PNG files
+to output_directory. Every job is a dictionary with 'name', 'x_coordinates',
+'y_coordinates', 'duration_arr', 'radius' and either 'painting_img' or 'image_path'.
+Returns the paths of the written files """
+def render_heatmaps(jobs, output_directory, my_colormap, kernel='disk', alpha=0.4):
+    import matplotlib.image as mpimg
+
+    os.makedirs(output_directory, exist_ok=True)
+    output_files = []
+    for job in jobs:
+        painting_img = job.get('painting_img')
+        if painting_img is None:
+            painting_img = mpimg.imread(job['image_path'])
+        overlay = render_heatmap_overlay(painting_img, job['x_coordinates'], job['y_coordinates'], job['duration_arr'],
+                                         my_colormap, job['radius'], kernel, alpha)
+        output_file = os.path.join(output_directory, f"{job['name']}.png")
+        mpimg.imsave(output_file, overlay)
+        output_files.append(output_file)
+    return output_files
@@ -0,0 +1,84 @@
+""" Contains the writer that stores the per-participant results of
+create_heatmap as tidy tables in csv or Parquet files """
+
+import csv
+import os
+
+# Columns of the participant x painting table
+METRIC_COLUMNS = [
+    'participant',
+    'painting',
+    'total_time',
+    'mean_duration',
+    'total_duration_in_objects',
+    'total_duration_outside_objects',
+    'average_duration_in_objects',
+    'average_duration_outside_objects',
+    'max_duration_in_objects',
+    'max_duration_outside_objects'
+]
+# Columns of the participant x painting x category table
+CATEGORY_COLUMNS = ['participant', 'painting', 'category', 'duration']
+
+""" This class collects the results of participants in memory and writes them in
+batches of batch_size rows to painting_metrics and category_durations tables in
+output_directory. file_format is 'csv' or 'parquet' (requires pyarrow) """
+class ResultsWriter:
+    def __init__(self, output_directory, file_format='csv', batch_size=10000):
+        if file_format not in ('csv', 'parquet'):
+            raise ValueError(f"file_format must be 'csv' or 'parquet', not '{file_format}'")
+        os.makedirs(output_directory, exist_ok=True)
+        self.output_directory = output_directory
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.tables = {
+            'painting_metrics': {'columns': METRIC_COLUMNS, 'rows': [], 'writer': None, 'file': None},
+            'category_durations': {'columns': CATEGORY_COLUMNS, 'rows': [], 'writer': None, 'file': None}
+        }
+
+    def path(self, table_name):
+        return os.path.join(self.output_directory, f'{table_name}.{self.file_format}')
+
+    """ Adds the per-painting metrics and category durations of one participant """
+    def add_participant(self, participant_result):
+        participant = participant_result['participant']
+        for painting in participant_result['paintings']:
+            row = [participant, painting['painting']] + [float(painting[column]) for column in METRIC_COLUMNS[2:]]
+            self.tables['painting_metrics']['rows'].append(row)
+            for category, duration in painting['object_durations'].items():
+                self.tables['category_durations']['rows'].append([participant, painting['painting'], category, float(duration)])
+
+        for table_name, table in self.tables.items():
+            if len(table['rows']) >= self.batch_size:
+                self.flush(table_name)
+
+    """ Writes the collected rows of a table """
+    def flush(self, table_name):
+        table = self.tables[table_name]
+        if self.file_format == 'csv':
+            if table['writer'] is None:
+                table['file'] = open(self.path(table_name), 'w', newline='')
+                table['writer'] = csv.writer(table['file'])
+                table['writer'].writerow(table['columns'])
+            table['writer'].writerows(table['rows'])
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            columns = list(zip(*table['rows'])) if table['rows'] else [[] for _ in table['columns']]
+            arrays = [pa.array(column, type=pa.string() if name in ('participant', 'painting', 'category') else pa.float64())
+                      for name, column in zip(table['columns'], columns)]
+            batch = pa.Table.from_arrays(arrays, names=table['columns'])
+            if table['writer'] is None:
+                table['writer'] = pq.ParquetWriter(self.path(table_name), batch.schema)
+            table['writer'].write_table(batch)
+        table['rows'] = []
+
+    """ Writes the remaining rows and closes the files """
+    def close(self):
+        for table_name, table in self.tables.items():
+            if table['rows'] or table['writer'] is None:
+                self.flush(table_name)
+            if self.file_format == 'csv':
+                table['file'].close()
+            else:
+                table['writer'].close()
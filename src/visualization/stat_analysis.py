@@ -1,13 +1,136 @@
 """ Contains functions for statistical analysis """
 
-import scipy.stats as stats
-import pandas as pd
-import statsmodels.api as sm
-from scipy.stats import shapiro, levene, kruskal
-
-""" This function checks for normality assumption and prints whether 
-the participants spent more time on areas with meaningful objects """
-def calculate_significance(obj_arr, non_obj_arr):
+import os
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+from profiler import PROFILER
+
+# Relative tolerance for resampled statistics that equal the observed one up to rounding
+RESAMPLING_RTOL = 1e-12
+
+""" This function compares resampled statistics with the observed one and returns
+the number of resamples that are at least as extreme """
+def count_extreme(statistics, observed, alternative):
+    tolerance = abs(observed) * RESAMPLING_RTOL
+    if alternative == 'greater':
+        return int(np.count_nonzero(statistics >= observed - tolerance))
+    if alternative == 'less':
+        return int(np.count_nonzero(statistics <= observed + tolerance))
+    return int(np.count_nonzero(np.abs(statistics) >= abs(observed) - tolerance))
+
+""" This function flips the signs of the paired differences with the sign patterns
+start..stop-1, where bit i of a pattern flips difference i, and returns the number
+of mean differences at least as extreme as the observed one """
+def exact_sign_flip_chunk(differences, observed, alternative, start, stop):
+    patterns = np.arange(start, stop, dtype=np.int64)[:, np.newaxis]
+    signs = 1 - 2 * ((patterns >> np.arange(len(differences))) & 1)
+    return count_extreme(signs @ differences / len(differences), observed, alternative)
+
+""" This function flips the signs of the paired differences at random in size
+resamples and returns the number of mean differences at least as extreme as the
+observed one """
+def random_sign_flip_chunk(differences, observed, alternative, seed, size):
+    rng = np.random.default_rng(seed)
+    signs = 1 - 2 * rng.integers(0, 2, size=(size, len(differences)), dtype=np.int8)
+    return count_extreme(signs @ differences / len(differences), observed, alternative)
+
+""" This function draws size bootstrap samples of the paired differences and
+returns their mean differences and effect sizes (Cohen's d of paired samples) """
+def bootstrap_chunk(differences, seed, size):
+    rng = np.random.default_rng(seed)
+    samples = differences[rng.integers(0, len(differences), size=(size, len(differences)))]
+    means = samples.mean(axis=1)
+    deviations = samples.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effect_sizes = np.where(deviations > 0, means / deviations, np.nan)
+    return means, effect_sizes
+
+""" This function runs the chunk tasks, in a process pool if workers > 1, and
+returns their results in order """
+def run_chunks(function, tasks, workers):
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(function, *zip(*tasks)))
+    return [function(*task) for task in tasks]
+
+""" This function splits n items into chunks of at most chunk_size and returns
+the (start, stop) pairs """
+def chunk_bounds(n, chunk_size):
+    return [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+
+""" This function tests whether the participants spent more time on areas with
+meaningful objects with a paired permutation test and bootstrap confidence
+intervals. The permutation test flips the signs of the paired differences: all
+2^n sign patterns if there are at most n_resamples, else n_resamples random ones.
+Resamples are processed in chunks of chunk_size to bound memory, in a process
+pool if workers > 1, and are reproducible for a seed independently of workers """
+def resampling_significance(obj_arr, non_obj_arr, n_resamples=100000, confidence_level=0.95,
+                            alternative='greater', chunk_size=10000, workers=1, seed=0):
+    differences = np.asarray(obj_arr, dtype=float) - np.asarray(non_obj_arr, dtype=float)
+    n = len(differences)
+    observed = differences.mean()
+    deviation = differences.std(ddof=1) if n > 1 else 0.0
+    effect_size = observed / deviation if deviation > 0 else float('nan')
+    seeds = np.random.SeedSequence(seed).spawn(2 * len(chunk_bounds(n_resamples, chunk_size)))
+
+    with PROFILER.stage('significance: permutation test'):
+        exact = n < 63 and 2 ** n <= n_resamples
+        if exact:
+            tasks = [(differences, observed, alternative, start, stop) for start, stop in chunk_bounds(2 ** n, chunk_size)]
+            p_value = sum(run_chunks(exact_sign_flip_chunk, tasks, workers)) / 2 ** n
+            permutations = 2 ** n
+        else:
+            tasks = [(differences, observed, alternative, chunk_seed, stop - start)
+                     for (start, stop), chunk_seed in zip(chunk_bounds(n_resamples, chunk_size), seeds[0::2])]
+            # The observed sign pattern counts as one of the resamples
+            p_value = (sum(run_chunks(random_sign_flip_chunk, tasks, workers)) + 1) / (n_resamples + 1)
+            permutations = n_resamples
+        PROFILER.count('permutation resamples', permutations)
+
+    with PROFILER.stage('significance: bootstrap'):
+        tasks = [(differences, chunk_seed, stop - start)
+                 for (start, stop), chunk_seed in zip(chunk_bounds(n_resamples, chunk_size), seeds[1::2])]
+        chunks = run_chunks(bootstrap_chunk, tasks, workers)
+        bootstrap_means = np.concatenate([means for means, _ in chunks])
+        bootstrap_effect_sizes = np.concatenate([effect_sizes for _, effect_sizes in chunks])
+        PROFILER.count('bootstrap resamples', n_resamples)
+    tail = (1 - confidence_level) / 2 * 100
+    percentiles = [tail, 100 - tail]
+
+    return {
+        'test': 'paired permutation test',
+        'alternative': alternative,
+        'n': n,
+        'mean_difference': float(observed),
+        'effect_size': float(effect_size),
+        'p_value': float(min(p_value, 1.0)),
+        'exact': exact,
+        'permutations': permutations,
+        'bootstrap_resamples': n_resamples,
+        'confidence_level': confidence_level,
+        'mean_difference_ci': tuple(float(value) for value in np.percentile(bootstrap_means, percentiles)),
+        'effect_size_ci': tuple(float(value) for value in np.nanpercentile(bootstrap_effect_sizes, percentiles))
+    }
+
+""" This function prints the result of resampling_significance """
+def print_resampling_result(significance):
+    print(f"Paired permutation test ({'exact' if significance['exact'] else str(significance['permutations']) + ' resamples'})")
+    print("Mean difference:", significance['mean_difference'], f"{significance['confidence_level']:.0%} CI:", significance['mean_difference_ci'])
+    print("Effect size (Cohen's d):", significance['effect_size'], f"{significance['confidence_level']:.0%} CI:", significance['effect_size_ci'])
+    print("p-value:", significance['p_value'])
+
+""" This function checks for normality assumption and prints whether
+the participants spent more time on areas with meaningful objects. With
+method='resampling' it runs resampling_significance instead and returns
+its result without printing """
+def calculate_significance(obj_arr, non_obj_arr, method='classic', **resampling_options):
+    if method == 'resampling':
+        return resampling_significance(obj_arr, non_obj_arr, **resampling_options)
+    import scipy.stats as stats
+
     differences = [obj_arr - non_obj_arr for obj_arr, non_obj_arr in zip(obj_arr, non_obj_arr)]
     # Perform Shapiro-Wilk test for normality
     _, p_value_shapiro = stats.shapiro(differences)
@@ -37,42 +160,218 @@ def calculate_significance(obj_arr, non_obj_arr):
             print("Rejected H0: the median time spent on areas containing the objects is significantly greater than the median time spent on areas not containing objects")
         
  
+""" This function adjusts p-values of one family of tests for multiple comparisons
+with the Benjamini-Hochberg ('bh') or Holm ('holm') procedure. The p-values can
+have any shape; NaN p-values are not counted as tests and stay NaN """
+def adjust_p_values(p_values, method='bh'):
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    order = valid[np.argsort(p_values.flat[valid], kind='stable')]
+    sorted_p = p_values.flat[order]
+    m = len(sorted_p)
+    rank = np.arange(1, m + 1)
+    if method == 'bh':
+        adjusted_sorted = np.minimum.accumulate((m / rank * sorted_p)[::-1])[::-1]
+    elif method == 'holm':
+        adjusted_sorted = np.maximum.accumulate((m - rank + 1) * sorted_p)
+    else:
+        raise ValueError(f"Unknown correction method: {method}")
+    adjusted.flat[order] = np.minimum(adjusted_sorted, 1)
+    return adjusted
+
+""" This function runs paired tests of first against second along axis 0
+(participants) for every index of the remaining axes at once: a t-test ('t')
+or a Wilcoxon signed-rank test ('wilcoxon'). Pairs with a NaN are left out.
+Returns arrays of statistics, p-values and numbers of pairs """
+def batched_paired_tests(first, second, test='t', alternative='greater'):
+    import scipy.stats as stats
+
+    differences = np.asarray(first, dtype=float) - np.asarray(second, dtype=float)
+    n = np.count_nonzero(~np.isnan(differences), axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if test == 't':
+            statistic = np.nanmean(differences, axis=0) / (np.nanstd(differences, axis=0, ddof=1) / np.sqrt(n))
+            degrees_of_freedom = np.maximum(n - 1, 1)
+            if alternative == 'greater':
+                p_value = stats.t.sf(statistic, degrees_of_freedom)
+            elif alternative == 'less':
+                p_value = stats.t.cdf(statistic, degrees_of_freedom)
+            else:
+                p_value = 2 * stats.t.sf(np.abs(statistic), degrees_of_freedom)
+        elif test == 'wilcoxon':
+            statistic, p_value = stats.wilcoxon(differences, axis=0, nan_policy='omit', alternative=alternative)
+        else:
+            raise ValueError(f"Unknown test: {test}")
+    statistic = np.where(n > 1, statistic, np.nan)
+    p_value = np.where(n > 1, p_value, np.nan)
+    return statistic, p_value, n
+
+""" This function tests all paintings and categories of a participant x painting
+x category tensor of gaze durations in vectorized passes. Category 0 is the
+background, i.e. the duration outside objects, as in config.CLASSES; a NaN marks
+a painting the participant did not see or a category without boxes on the
+painting. objects is a participant x painting array of durations in objects and
+defaults to the sum of the object categories, which counts overlapping boxes
+twice. Three families of tests are run, each corrected separately:
+'objects': per painting, durations in objects against outside objects
+'painting categories': per painting and object category, the category against the
+mean of the other object categories of the painting
+'categories': per object category, the same comparison with the means over paintings """
+def test_duration_tensor(durations, objects=None, test='t', correction='bh', alternative='greater'):
+    durations = np.asarray(durations, dtype=float)
+    category_durations = durations[:, :, 1:]
+    if objects is None:
+        objects = np.where(np.all(np.isnan(category_durations), axis=2), np.nan, np.nansum(category_durations, axis=2))
+    objects = np.asarray(objects, dtype=float)
+
+    # Mean duration of the other object categories of a painting
+    present = ~np.isnan(category_durations)
+    others = present.sum(axis=2, keepdims=True) - present
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        rest = (np.nansum(category_durations, axis=2, keepdims=True) - np.nan_to_num(category_durations)) / others
+        rest = np.where(present & (others > 0), rest, np.nan)
+        pooled_category = np.nanmean(np.where(np.isnan(rest), np.nan, category_durations), axis=1)
+        pooled_rest = np.nanmean(rest, axis=1)
+
+    families = {
+        'objects': (objects, durations[:, :, 0]),
+        'painting categories': (category_durations, rest),
+        'categories': (pooled_category, pooled_rest)
+    }
+    results = {}
+    with PROFILER.stage('batched hypothesis tests'):
+        for family, (first, second) in families.items():
+            statistic, p_value, n = batched_paired_tests(first, second, test, alternative)
+            PROFILER.count('hypothesis tests', int(np.count_nonzero(~np.isnan(p_value))))
+            results[family] = {
+                'statistic': statistic,
+                'p_value': p_value,
+                'p_adjusted': adjust_p_values(p_value, correction),
+                'n': n
+            }
+    return results
+
 """ This function checks for normality and homogeniety assumptions and prints
 results to determine whether there is a difference in the average time spent
-on the painting between the different object categories """ 
-def perform_one_way_anova(anova_file):
-    # Read the CSV file
-    df = pd.read_csv(anova_file)
-    # df = pd.read_csv('../../data/processed/anova-data-filtered-time.csv')
-    list_of_column_names = list(df.columns)
-    interest_column = list_of_column_names[0] # Column containing the time spent on the painting
-    group_column = list_of_column_names[1] # Column containing the object type
-    # Fit the one-way ANOVA model
-    model = sm.formula.ols(f'{interest_column} ~ {group_column}', data=df).fit()
-    # Calculate the residuals
-    residuals = model.resid
-    # Create a DataFrame with the residuals and the group column
-    residuals_df = pd.DataFrame({group_column: df[group_column], 'Residuals': residuals})
-    # Calculate the group residuals
-    group_resid = residuals_df.groupby(group_column)['Residuals'].apply(list)
-    # Check for normality using Shapiro-Wilk test
-    _, p_value_shapiro = shapiro(residuals)
-    # Check for homogeneity of variances using Levene's test
-    _, p_value_levene = levene(*group_resid)
+on the painting between the different object categories. With method='streaming'
+the file is read in chunks of chunk_size rows by StreamingOneWayAnova instead of
+fitting a statsmodels model on the whole file """
+def perform_one_way_anova(anova_file, method='statsmodels', chunk_size=100000):
+    # scipy, pandas and statsmodels are imported here so the command line starts quickly
+    import pandas as pd
+    from scipy.stats import shapiro, levene, kruskal
+
+    if method == 'streaming':
+        from streaming_anova import StreamingOneWayAnova
+
+        accumulator = StreamingOneWayAnova(anova_file, chunk_size)
+        _, p_value_shapiro = accumulator.shapiro()
+        _, p_value_levene = accumulator.levene()
+        run_anova = accumulator.anova_table
+        run_kruskal = accumulator.kruskal
+    else:
+        import statsmodels.api as sm
+
+        # Read the CSV file
+        with PROFILER.stage('anova: read csv'):
+            df = pd.read_csv(anova_file)
+        # df = pd.read_csv('../../data/processed/anova-data-filtered-time.csv')
+        list_of_column_names = list(df.columns)
+        interest_column = list_of_column_names[0] # Column containing the time spent on the painting
+        group_column = list_of_column_names[1] # Column containing the object type
+        # Fit the one-way ANOVA model
+        with PROFILER.stage('anova: statsmodels ols fit'):
+            model = sm.formula.ols(f'{interest_column} ~ {group_column}', data=df).fit()
+        # Calculate the residuals
+        residuals = model.resid
+        # Create a DataFrame with the residuals and the group column
+        residuals_df = pd.DataFrame({group_column: df[group_column], 'Residuals': residuals})
+        # Calculate the group residuals
+        group_resid = residuals_df.groupby(group_column)['Residuals'].apply(list)
+        # Check for normality using Shapiro-Wilk test
+        _, p_value_shapiro = shapiro(residuals)
+        # Check for homogeneity of variances using Levene's test
+        _, p_value_levene = levene(*group_resid)
+        run_anova = lambda: sm.stats.anova_lm(model)
+        run_kruskal = lambda: kruskal(*group_resid)
     alpha = 0.05  # Significance level
     print("Shapiro-Wilk's p-value (normality assumption):", p_value_shapiro)
     print("Levene's p-value (homogeniety of variances assumption):", p_value_levene)
   
     if p_value_shapiro > alpha and p_value_levene > alpha:
         # Perform the ANOVA
-        anova_table = sm.stats.anova_lm(model)
+        anova_table = run_anova()
         # Print the ANOVA table
         print("One-way ANOVA test")
         print(anova_table)
     else:
         # Perform the Kruskal-Wallis test
-        stat_kruskal, p_value_kruskal = kruskal(*group_resid)
+        stat_kruskal, p_value_kruskal = run_kruskal()
         print("The sample does not meet one-way ANOVA test assumptions. Conducting Kruskal-Wallis test...")
         print("Kruskal-Wallis test statistic:", stat_kruskal)
         print("P-value:", p_value_kruskal)
 
+""" This function reads the painting_metrics table written by create_heatmap with
+--results_dir and returns the mean over paintings of the average gaze duration in
+and outside objects of every participant, as create_heatmap tests them """
+def participant_averages(results_dir, results_format='csv'):
+    import pandas as pd
+
+    metrics_file = os.path.join(results_dir, f'painting_metrics.{results_format}')
+    if results_format == 'parquet':
+        metrics = pd.read_parquet(metrics_file)
+    else:
+        metrics = pd.read_csv(metrics_file, float_precision='round_trip')
+    participants = metrics.groupby('participant', sort=False)
+    average_durations_object = [np.mean(group['average_duration_in_objects'].to_numpy()) for _, group in participants]
+    average_durations_no_object = [np.mean(group['average_duration_outside_objects'].to_numpy()) for _, group in participants]
+    return average_durations_object, average_durations_no_object
+
+def main(anova_file = '../../data/processed/anova-data-filtered-time.csv', anova_method = 'statsmodels',
+         results_dir = None, results_format = 'csv', significance = 'classic', resamples = 100000, workers = 1):
+    if results_dir is not None:
+        print("Meaningful versus non-meaningful areas:")
+        average_durations_object, average_durations_no_object = participant_averages(results_dir, results_format)
+        if significance == 'resampling':
+            print_resampling_result(calculate_significance(average_durations_object, average_durations_no_object,
+                                                           method='resampling', n_resamples=resamples, workers=workers))
+        else:
+            calculate_significance(average_durations_object, average_durations_no_object)
+        print()
+
+    print("Object-Interest analysis:")
+    perform_one_way_anova(anova_file, anova_method)
+
+""" This function adds the command line arguments of main to parser """
+def add_arguments(parser):
+    parser.add_argument('--anova_file', type=str,
+                           default='../../data/processed/anova-data-filtered-time.csv',
+                           help='csv file for one-way anova test')
+    parser.add_argument('--anova_method', type=str, choices=['statsmodels', 'streaming'],
+                           default='statsmodels',
+                           help='fit the one-way anova with statsmodels on the whole file, or read the file in chunks with streaming accumulators')
+    parser.add_argument('--results_dir', type=str,
+                           default=None,
+                           help='directory with the result tables written by create_heatmap.py --results_dir, to compare objects and non-objects')
+    parser.add_argument('--results_format', type=str, choices=['csv', 'parquet'],
+                           default='csv',
+                           help='file format of the result tables')
+    parser.add_argument('--significance', type=str, choices=['classic', 'resampling'],
+                           default='classic',
+                           help='compare objects and non-objects with a t-test or Wilcoxon test chosen by a normality check, or with a permutation test and bootstrap confidence intervals')
+    parser.add_argument('--resamples', type=int,
+                           default=100000,
+                           help='number of permutation and bootstrap resamples used by --significance resampling')
+    parser.add_argument('--workers', type=int,
+                           default=1,
+                           help='number of processes used by --significance resampling')
+    return parser
+
+
+if __name__ == "__main__":
+    parser = add_arguments(ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter))
+    args = parser.parse_args()
+    main(**dict(args._get_kwargs()))
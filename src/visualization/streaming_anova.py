@@ -0,0 +1,280 @@
+""" Contains accumulators for the one-way ANOVA of a csv file with a value column
+and a group column. The file is read in chunks, so memory is bounded by the
+chunk size and the number of groups instead of the number of rows """
+
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from profiler import PROFILER
+
+""" This class maps group labels to integer codes in order of appearance """
+class GroupCodes:
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, labels):
+        for label in pd.unique(labels):
+            if label not in self.codes:
+                self.codes[label] = len(self.codes)
+        return pd.Categorical(labels, categories=list(self.codes)).codes.astype(np.intp)
+
+    def labels(self):
+        return list(self.codes)
+
+""" This class accumulates the count, mean, sum of squared deviations (M2),
+minimum and maximum of every group, combining chunks with the pairwise update
+of Chan et al. so there is no cancellation between large sums """
+class GroupMoments:
+    def __init__(self):
+        self.n = np.zeros(0)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+
+    def grow(self, n_groups):
+        extra = n_groups - len(self.n)
+        if extra > 0:
+            self.n = np.concatenate((self.n, np.zeros(extra)))
+            self.mean = np.concatenate((self.mean, np.zeros(extra)))
+            self.m2 = np.concatenate((self.m2, np.zeros(extra)))
+            self.min = np.concatenate((self.min, np.full(extra, np.inf)))
+            self.max = np.concatenate((self.max, np.full(extra, -np.inf)))
+
+    def update(self, codes, values, n_groups):
+        self.grow(n_groups)
+        chunk_n = np.bincount(codes, minlength=n_groups).astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk_mean = np.where(chunk_n > 0, np.bincount(codes, values, n_groups) / chunk_n, 0)
+            chunk_m2 = np.bincount(codes, (values - chunk_mean[codes]) ** 2, n_groups)
+            n = self.n + chunk_n
+            delta = chunk_mean - self.mean
+            weight = np.where(n > 0, chunk_n / n, 0)
+        self.m2 += chunk_m2 + delta ** 2 * self.n * weight
+        self.mean += delta * weight
+        self.n = n
+        np.minimum.at(self.min, codes, values)
+        np.maximum.at(self.max, codes, values)
+
+""" This class keeps a uniform random sample of size rows of a stream
+(reservoir sampling), used for tests that need individual values """
+class Reservoir:
+    def __init__(self, size, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.values = np.empty(size)
+        self.codes = np.empty(size, dtype=np.intp)
+        self.seen = 0
+
+    def update(self, codes, values):
+        size = len(self.values)
+        fill = max(0, min(size - self.seen, len(values)))
+        self.values[self.seen:self.seen + fill] = values[:fill]
+        self.codes[self.seen:self.seen + fill] = codes[:fill]
+        if fill < len(values):
+            # Row t of the stream replaces a random slot with probability size / (t + 1)
+            positions = np.arange(self.seen + fill, self.seen + len(values))
+            slots = self.rng.integers(0, positions + 1)
+            keep = slots < size
+            self.values[slots[keep]] = values[fill:][keep]
+            self.codes[slots[keep]] = codes[fill:][keep]
+        self.seen += len(values)
+
+    def sample(self):
+        size = min(self.seen, len(self.values))
+        return self.codes[:size], self.values[:size]
+
+""" This function splits the values of a chunk by group code """
+def split_by_group(codes, values, n_groups):
+    order = np.argsort(codes, kind='stable')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=n_groups))))
+    sorted_values = values[order]
+    return [sorted_values[bounds[group]:bounds[group + 1]] for group in range(n_groups)]
+
+""" This class computes the one-way ANOVA table, the Shapiro-Wilk test of the
+residuals, Levene's test and the Kruskal-Wallis test of the residuals of a csv
+file, like perform_one_way_anova does with statsmodels. The first column holds
+the values and the second the groups. Each statistic reads the file again in
+chunks of chunk_size rows:
+- the ANOVA table needs only group counts, means and sums of squares
+- Shapiro-Wilk is run on a reservoir sample of sample_size residuals, which are
+all residuals for files of at most sample_size rows
+- Levene's test uses exact group medians, found by refining a histogram of the
+interval that contains the median until at most collect_limit values remain
+- Kruskal-Wallis ranks every residual by binary search in sorted runs of at most
+run_size residuals, which are stored as temporary .npy files """
+class StreamingOneWayAnova:
+    def __init__(self, anova_file, chunk_size=100000, sample_size=5000, run_size=1000000,
+                 collect_limit=1000000, bins=4096, seed=0):
+        self.anova_file = anova_file
+        self.chunk_size = chunk_size
+        self.run_size = run_size
+        self.collect_limit = collect_limit
+        self.bins = bins
+        self.value_column, self.group_column = list(pd.read_csv(anova_file, nrows=0).columns)[:2]
+        self.group_codes = GroupCodes()
+        self.moments = GroupMoments()
+        self.reservoir = Reservoir(sample_size, seed)
+        self._medians = None
+
+        with PROFILER.stage('anova: group moments'):
+            for codes, values in self.chunks():
+                self.moments.update(codes, values, len(self.group_codes.codes))
+                self.reservoir.update(codes, values)
+        self.n_groups = len(self.group_codes.codes)
+        self.n_total = self.moments.n.sum()
+
+    """ Reads the file in chunks and yields (group codes, values); rows with missing
+    values are skipped, as statsmodels does """
+    def chunks(self):
+        for chunk in pd.read_csv(self.anova_file, usecols=[self.value_column, self.group_column], chunksize=self.chunk_size):
+            chunk = chunk.dropna()
+            PROFILER.count('anova rows read', len(chunk))
+            yield self.group_codes.encode(chunk[self.group_column].to_numpy()), chunk[self.value_column].to_numpy(dtype=float)
+
+    """ Returns the ANOVA table in the format of statsmodels.stats.anova_lm """
+    def anova_table(self):
+        n, mean = self.moments.n, self.moments.mean
+        grand_mean = np.sum(n * mean) / self.n_total
+        sum_sq = np.array([np.sum(n * (mean - grand_mean) ** 2), np.sum(self.moments.m2)])
+        df = np.array([self.n_groups - 1, self.n_total - self.n_groups], dtype=float)
+        mean_sq = sum_sq / df
+        f_statistic = mean_sq[0] / mean_sq[1]
+        return pd.DataFrame({
+            'df': df,
+            'sum_sq': sum_sq,
+            'mean_sq': mean_sq,
+            'F': [f_statistic, np.nan],
+            'PR(>F)': [stats.f.sf(f_statistic, df[0], df[1]), np.nan]
+        }, index=[self.group_column, 'Residual'])
+
+    """ Returns the Shapiro-Wilk test of the residuals of the reservoir sample """
+    def shapiro(self):
+        codes, values = self.reservoir.sample()
+        return stats.shapiro(values - self.moments.mean[codes])
+
+    """ Returns the exact median of every group """
+    def medians(self):
+        if self._medians is None:
+            with PROFILER.stage('anova: group medians'):
+                self._medians = self.find_medians()
+        return self._medians
+
+    def find_medians(self):
+        n = self.moments.n.astype(np.int64)
+        # The median is the mean of the values at the two middle ranks (equal for odd counts)
+        targets = [(group, rank) for group in range(self.n_groups) for rank in sorted({(n[group] - 1) // 2, n[group] // 2})]
+        # Interval [low, high] of every target and the number of group values below it
+        low = np.array([self.moments.min[group] for group, _ in targets])
+        high = np.array([self.moments.max[group] for group, _ in targets])
+        below = np.zeros(len(targets), dtype=np.int64)
+        inside = np.array([n[group] for group, _ in targets])
+        found = {}
+
+        while len(found) < len(targets):
+            pending = [index for index in range(len(targets)) if index not in found]
+            for index in pending:
+                if low[index] == high[index]:
+                    found[index] = low[index]
+            pending = [index for index in pending if index not in found]
+            if not pending:
+                break
+            collected = {index: [] for index in pending if inside[index] <= self.collect_limit}
+            histograms = {index: (np.zeros(self.bins, dtype=np.int64), np.full(self.bins, np.inf), np.full(self.bins, -np.inf))
+                          for index in pending if index not in collected}
+            PROFILER.count('anova median passes')
+            for codes, values in self.chunks():
+                groups = split_by_group(codes, values, self.n_groups)
+                for index in pending:
+                    group_values = groups[targets[index][0]]
+                    group_values = group_values[(group_values >= low[index]) & (group_values <= high[index])]
+                    if index in collected:
+                        collected[index].append(group_values)
+                        continue
+                    counts, bin_min, bin_max = histograms[index]
+                    edges = np.linspace(low[index], high[index], self.bins + 1)
+                    bin_index = np.clip(np.searchsorted(edges, group_values, side='right') - 1, 0, self.bins - 1)
+                    counts += np.bincount(bin_index, minlength=self.bins)
+                    np.minimum.at(bin_min, bin_index, group_values)
+                    np.maximum.at(bin_max, bin_index, group_values)
+
+            for index in pending:
+                rank = targets[index][1] - below[index]
+                if index in collected:
+                    found[index] = np.sort(np.concatenate(collected[index]))[rank]
+                    continue
+                counts, bin_min, bin_max = histograms[index]
+                cumulative = np.cumsum(counts)
+                chosen = int(np.searchsorted(cumulative, rank, side='right'))
+                below[index] += cumulative[chosen - 1] if chosen > 0 else 0
+                # Collect the values next pass if the histogram cannot split the interval further
+                stuck = bin_min[chosen] == low[index] and bin_max[chosen] == high[index]
+                low[index], high[index], inside[index] = bin_min[chosen], bin_max[chosen], 0 if stuck else counts[chosen]
+
+        medians = np.zeros(self.n_groups)
+        for index, (group, _) in enumerate(targets):
+            medians[group] += found[index] / sum(1 for target_group, _ in targets if target_group == group)
+        return medians
+
+    """ Returns Levene's test of the groups with the median as center, as
+    scipy.stats.levene. The deviations from the median are the same for values
+    and residuals, because residuals are values minus the group mean """
+    def levene(self):
+        medians = self.medians()
+        deviations = GroupMoments()
+        with PROFILER.stage('anova: levene'):
+            for codes, values in self.chunks():
+                deviations.update(codes, np.abs(values - medians[codes]), self.n_groups)
+        grand_mean = np.sum(deviations.n * deviations.mean) / self.n_total
+        statistic = ((self.n_total - self.n_groups) / (self.n_groups - 1)
+                     * np.sum(deviations.n * (deviations.mean - grand_mean) ** 2) / np.sum(deviations.m2))
+        return statistic, stats.f.sf(statistic, self.n_groups - 1, self.n_total - self.n_groups)
+
+    """ Returns the Kruskal-Wallis test of the residuals, as scipy.stats.kruskal """
+    def kruskal(self):
+        with PROFILER.stage('anova: kruskal'), tempfile.TemporaryDirectory() as run_directory:
+            # Sorted runs of residuals
+            runs = []
+            buffer = []
+            buffered = 0
+            for codes, values in self.chunks():
+                buffer.append(values - self.moments.mean[codes])
+                buffered += len(values)
+                if buffered >= self.run_size:
+                    runs.append(self.write_run(run_directory, len(runs), buffer))
+                    buffer, buffered = [], 0
+            if buffer:
+                runs.append(self.write_run(run_directory, len(runs), buffer))
+            runs = [np.load(run, mmap_mode='r') for run in runs]
+
+            # Rank of a residual: residuals below it plus the middle of its ties
+            rank_sums = np.zeros(self.n_groups)
+            ties = 0.0
+            for codes, values in self.chunks():
+                residuals = values - self.moments.mean[codes]
+                # Sorted queries keep the binary searches cache friendly
+                order = np.argsort(residuals)
+                codes, residuals = codes[order], residuals[order]
+                smaller = np.zeros(len(residuals))
+                not_larger = np.zeros(len(residuals))
+                for run in runs:
+                    smaller += np.searchsorted(run, residuals, side='left')
+                    not_larger += np.searchsorted(run, residuals, side='right')
+                tied = not_larger - smaller
+                rank_sums += np.bincount(codes, smaller + (tied + 1) / 2, self.n_groups)
+                # Every value of a group of t ties adds t^2 - 1, so a group adds t^3 - t
+                ties += np.sum(tied ** 2 - 1)
+            del runs
+
+        n_total = self.n_total
+        statistic = 12 / (n_total * (n_total + 1)) * np.sum(rank_sums ** 2 / self.moments.n) - 3 * (n_total + 1)
+        statistic /= 1 - ties / (n_total ** 3 - n_total)
+        return statistic, stats.chi2.sf(statistic, self.n_groups - 1)
+
+    def write_run(self, run_directory, index, buffer):
+        path = os.path.join(run_directory, f'run-{index}.npy')
+        np.save(path, np.sort(np.concatenate(buffer)))
+        PROFILER.count('anova sorted runs')
+        return path
@@ -1,4 +1,4 @@
-import csv
+import hashlib
 
 """ This function changes rgb colors to normalized 
 rgb colors to enable matplotlib ListedColormap generation"""
@@ -12,26 +12,11 @@ def normalize_colors(rgb_colors):
     return normalized_colors
 
 
-""" This function adds a header row to csv for easier 
-manipulation"""
-def modify_csv (csv_file):
-    # Read the existing CSV file
-    with open(csv_file, 'r') as file:
-        reader = csv.reader(file)
-        rows = list(reader)
-    # Check if csv already modified
-    for row in rows:
-        if row[0] == "c1":
-            return
-            
-    row_length = len(rows[2])
-    # Define values for the first row
-    first_row_names = ['c{}'.format(i) for i in range(1, row_length + 1)]
-
-    # Add the first row to the rows list
-    rows.insert(0, first_row_names)
-
-    # Write the modified rows to a new CSV file
-    with open(csv_file, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerows(rows)
+""" This function returns the sha256 hash of a file, used to 
+detect changes of input files between runs """
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
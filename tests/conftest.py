@@ -0,0 +1,11 @@
+''' Puts the script folders of src on the import path, as the scripts import
+their sibling modules by name
+'''
+
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+for folder in ('data', 'features', 'visualization'):
+    sys.path.append(os.path.join(SRC, folder))
+sys.path.append(SRC)
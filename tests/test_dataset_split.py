@@ -0,0 +1,26 @@
+''' Tests of the train/validation split of prepare_dataset.py '''
+
+import numpy as np
+
+from dataset_split import annotation_image_indices, split_coco
+
+def make_coco_data(n_images=40, seed=0):
+    rng = np.random.default_rng(seed)
+    images = [{'id': 100 + index, 'file_name': f'{index:04d}.jpg'} for index in range(n_images)]
+    annotations = [{'id': index, 'image_id': 100 + int(rng.integers(n_images)), 'category_id': int(rng.integers(1, 5))}
+                   for index in range(3 * n_images)]
+    return {'info': {}, 'categories': [{'id': index, 'name': str(index)} for index in range(1, 5)],
+            'images': images, 'annotations': annotations}
+
+def test_split_with_given_indices_matches_the_computed_split():
+    coco_data = make_coco_data()
+    annotation_images = annotation_image_indices(coco_data['images'], coco_data['annotations'])
+    annotation_categories = np.array([annotation['category_id'] for annotation in coco_data['annotations']])
+    for stratified in (False, True):
+        expected = split_coco(coco_data, 0.85, stratified=stratified, seed=3)
+        given = split_coco(coco_data, 0.85, stratified=stratified, seed=3,
+                           annotation_images=annotation_images, annotation_categories=annotation_categories)
+        assert given == expected
+        train_ids = {image['id'] for image in expected[0]['images']}
+        assert all(annotation['image_id'] in train_ids for annotation in expected[0]['annotations'])
+        assert not train_ids & {image['id'] for image in expected[1]['images']}
@@ -0,0 +1,72 @@
+''' Tests of the embedding cache and the term clustering of semart_object_analysis.py '''
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from config import CLASSES
+from embedding_cache import EmbeddingCache
+import semart_object_analysis as semart
+
+# Word vectors of a small vocabulary: two groups of terms around two directions
+WORD_VECTORS = {
+    'saint': [1.0, 0.1, 0.0],
+    'angel': [0.9, 0.2, 0.0],
+    'monk': [1.0, 0.0, 0.1],
+    'hat': [0.0, 0.1, 1.0],
+    'dress': [0.1, 0.0, 0.9],
+    'glove': [0.0, 0.2, 1.0],
+}
+
+""" Stands in for a spaCy model: the tokenizer splits at spaces and every token
+has the vector of its word """
+class StubNLP:
+    def __init__(self):
+        self.vocab = SimpleNamespace(vectors_length=3)
+        self.tokenized = []
+
+    def tokenizer(self, text):
+        self.tokenized.append(text)
+        return [SimpleNamespace(vector=np.array(WORD_VECTORS[word], dtype=np.float32)) for word in text.split()]
+
+def fail_to_load():
+    raise AssertionError('the model is loaded although all terms are cached')
+
+def test_vectors_are_reused_from_the_memory_mapped_cache(tmp_path):
+    nlp = StubNLP()
+    cache = EmbeddingCache('stub', lambda: nlp, str(tmp_path))
+    terms = ['saint', 'hat', 'saint angel']
+    vectors = cache.vectors_for(terms)
+    assert vectors.dtype == np.float32
+    np.testing.assert_allclose(vectors[0], WORD_VECTORS['saint'])
+    np.testing.assert_allclose(vectors[2], np.mean([WORD_VECTORS['saint'], WORD_VECTORS['angel']], axis=0))
+    assert nlp.tokenized == terms
+
+    reopened = EmbeddingCache('stub', fail_to_load, str(tmp_path))
+    assert isinstance(reopened.vectors, np.memmap)
+    np.testing.assert_array_equal(reopened.vectors_for(terms[::-1]), vectors[::-1])
+
+    # New terms are appended to the cached ones
+    nlp = StubNLP()
+    reopened.load_model = lambda: nlp
+    np.testing.assert_allclose(reopened.vectors_for(['glove', 'hat'])[0], WORD_VECTORS['glove'])
+    assert nlp.tokenized == ['glove']
+    assert EmbeddingCache('stub', fail_to_load, str(tmp_path)).terms == terms + ['glove']
+
+def test_cache_of_another_model_is_not_used(tmp_path):
+    EmbeddingCache('stub', StubNLP, str(tmp_path)).vectors_for(['hat'])
+    assert EmbeddingCache('other', StubNLP, str(tmp_path)).terms == []
+
+def test_global_clustering_reproduces_the_genre_clusters():
+    pytest.importorskip('sklearn')
+    cache = EmbeddingCache('stub', StubNLP)
+    genre_terms = {'religious': ['saint', 'angel', 'hat', 'dress'], 'portrait': ['hat', 'glove', 'monk', 'saint']}
+    all_terms = list(dict.fromkeys(term for terms in genre_terms.values() for term in terms))
+    class_vectors = np.random.default_rng(0).normal(size=(len(CLASSES) - 1, 3))
+    grouped_terms = semart.cluster_terms_globally(all_terms, cache.vectors_for(all_terms), class_vectors)
+    global_groups = [set(terms) for terms, _ in grouped_terms.values()]
+
+    for terms in genre_terms.values():
+        genre_groups = {frozenset(group) for group in semart.group_categories(terms, cache.vectors_for(terms)).values()}
+        assert genre_groups == {frozenset(group & set(terms)) for group in global_groups if group & set(terms)}
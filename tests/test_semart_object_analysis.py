@@ -0,0 +1,78 @@
+''' Tests of the noun counting of semart_object_analysis.py '''
+
+from types import SimpleNamespace
+
+import pytest
+
+import semart_object_analysis as semart
+
+# Descriptions whose nouns have distinct counts per genre: saint 3, angel 2, book 1
+# and hat 3, dress 2, glove 1
+GENRE_DESCRIPTIONS = [
+    ('religious', 'The saint holds a book. An angel stands beside the saint.'),
+    ('portrait', 'She wears a hat with a dress.'),
+    ('religious', 'The angel kneels before the saint.'),
+    ('portrait', 'Her hat and her dress are red.'),
+    ('portrait', 'The hat has a glove beside it.'),
+]
+
+EXPECTED_TOP_TERMS = {
+    'religious': [('saint', 3), ('angel', 2), ('book', 1)],
+    'portrait': [('hat', 3), ('dress', 2), ('glove', 1)],
+}
+
+""" Stands in for a spaCy pipeline: every word is a noun whose lemma is the lower
+case word, and pipe yields (doc, context) for (text, context) pairs as nlp.pipe
+with as_tuples does """
+class StubNLP:
+    def __init__(self, nouns):
+        self.nouns = nouns
+
+    def pipe(self, texts, as_tuples=False, batch_size=256, n_process=1):
+        assert as_tuples
+        for text, context in texts:
+            words = text.replace('.', ' ').split()
+            yield [SimpleNamespace(text=word, lemma_=word.lower(), tag_='NN' if word.lower() in self.nouns else 'DT', ent_type_='')
+                   for word in words], context
+
+def test_count_nouns_spacy_counts_per_genre():
+    nlp = StubNLP({'saint', 'book', 'angel', 'hat', 'dress', 'glove'})
+    counters = semart.count_nouns_spacy(nlp, iter(GENRE_DESCRIPTIONS), set(semart.individual_words))
+    assert set(counters) == {'religious', 'portrait'}
+    for genre, expected in EXPECTED_TOP_TERMS.items():
+        assert semart.most_common_terms(counters[genre], list(counters), n=3) == expected
+
+def test_pipelines_return_the_same_top_terms():
+    pytest.importorskip('nltk')
+    spacy = pytest.importorskip('spacy')
+    model = next((name for name in ('en_core_web_sm', 'en_core_web_md', 'en_core_web_lg') if spacy.util.is_package(name)), None)
+    if model is None:
+        pytest.skip('no English spaCy model installed')
+    try:
+        semart.check_nltk_resources()
+    except LookupError as error:
+        pytest.skip(str(error))
+
+    remove_words = semart.words_to_remove()
+    nltk_counters = semart.count_nouns_nltk(GENRE_DESCRIPTIONS, remove_words)
+    spacy_counters = semart.count_nouns_spacy(semart.load_spacy_model(model, disable=['parser']), iter(GENRE_DESCRIPTIONS), remove_words)
+    assert set(nltk_counters) == set(spacy_counters) == set(EXPECTED_TOP_TERMS)
+    for genre, expected in EXPECTED_TOP_TERMS.items():
+        assert semart.most_common_terms(nltk_counters[genre], list(nltk_counters), n=3) == expected
+        assert semart.most_common_terms(spacy_counters[genre], list(spacy_counters), n=3) == expected
+
+def test_chunked_catalogue_counts_per_genre(tmp_path):
+    pytest.importorskip('pandas')
+    semart_file = tmp_path / 'semart.csv'
+    rows = [('1601-1650', genre, description) for genre, description in GENRE_DESCRIPTIONS]
+    rows.insert(2, ('1501-1550', 'religious', 'The saint holds a book.'))
+    with open(semart_file, 'w', encoding='latin-1') as file:
+        file.write('IMAGE_FILE\tDESCRIPTION\tTYPE\tTIMEFRAME\n')
+        for index, (timeframe, genre, description) in enumerate(rows):
+            file.write(f'{index}.jpg\t{description}\t{genre}\t{timeframe}\n')
+
+    chunks = semart.iter_semart_chunks([str(semart_file)], ['1601-1650'], chunk_size=2)
+    nlp = StubNLP({'saint', 'book', 'angel', 'hat', 'dress', 'glove'})
+    counters = semart.count_nouns_spacy(nlp, (pair for chunk in chunks for pair in chunk), set(semart.individual_words))
+    for genre, expected in EXPECTED_TOP_TERMS.items():
+        assert semart.most_common_terms(counters[genre], list(counters), n=3) == expected